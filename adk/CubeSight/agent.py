@@ -3,14 +3,37 @@ import os
 from zoneinfo import ZoneInfo
 from google.adk.agents import LlmAgent, SequentialAgent
 from google.adk.models.lite_llm import LiteLlm
-from google.adk.tools.mcp_tool.mcp_toolset import MCPToolset, SseConnectionParams
+from google.adk.tools.mcp_tool.mcp_toolset import (
+    MCPToolset, SseConnectionParams, StreamableHTTPConnectionParams
+)
+
+from .profiling import RunProfiler
 
 api_base = os.getenv("OPENAI_API_BASE")
 api_key = os.getenv("OPENAI_API_KEY")
 
+# "sse" keeps a session stream open to the MCP server; "http" uses its
+# stateless Streamable HTTP endpoint, one POST per call.
+mcp_transport = os.getenv("MCP_TRANSPORT", "sse").lower()
+if mcp_transport == "http":
+    connection_params = StreamableHTTPConnectionParams(url=os.getenv("MCP_URL", "http://mcp:3001/mcp"), headers={})
+elif mcp_transport == "sse":
+    connection_params = SseConnectionParams(url=os.getenv("MCP_URL", "http://mcp:3001/sse"), headers={})
+else:
+    raise ValueError(f"MCP_TRANSPORT must be 'sse' or 'http', got {mcp_transport!r}")
+
+TOOLS = ['cubejs_cubesql', 'cubejs_meta', 'cubejs_search_members', 'cubejs_batch', 'cubejs_chart_data']
+
 toolset = MCPToolset(
-    connection_params=SseConnectionParams(url="http://mcp:3001/sse", headers={}),
-    tool_filter=['cubejs_cubesql', 'cubejs_meta']
+    connection_params=connection_params,
+    tool_filter=TOOLS
+)
+
+# Span timeline of every run (model calls with tokens, tool calls with
+# response sizes), written per run as "json" or OpenTelemetry "otlp" JSON.
+profiler = RunProfiler(
+    export=os.getenv("CUBESIGHT_PROFILE", "off").lower(),
+    directory=os.getenv("CUBESIGHT_PROFILE_DIR", "profiles")
 )
 
 cubesight_agent = LlmAgent(
@@ -29,8 +52,13 @@ cubesight_agent = LlmAgent(
         You are a data visualization expert who creates Plotly JS charts from Cube.js data.
         
         WORKFLOW:
-        1. Use cubejs_meta tool to understand the cube schema and available dimensions/measures
-        2. Query data using cubejs_cubesql tool with PostgreSQL syntax based on user requirements
+        1. Use cubejs_search_members to find the dimensions/measures the request is about (e.g. search
+           "survived" or "age"); use cubejs_meta only when you need an overview of the whole schema
+        2. Query data using cubejs_cubesql tool with PostgreSQL syntax based on user requirements.
+           When the chart needs several queries (e.g. one per trace), send them together in one
+           cubejs_batch call with "tool": "cubejs_cubesql" for each query instead of one call per query.
+           Prefer cubejs_chart_data when you know the x column, value column(s) and optional series
+           column: it returns the Plotly "data" traces directly, so you only add titles and layout
         3. Analyze the returned data structure to determine the most appropriate chart type
         4. Generate Plotly JS compliant JSON that includes:
             - Proper data arrays and formatting
@@ -65,7 +93,8 @@ cubesight_agent = LlmAgent(
             - Return raw JSON that can be directly passed to Plotly.newPlot()
     """
     ),
-    tools=[toolset]
+    tools=[toolset],
+    **profiler.callbacks()
 )
 
 # greeting_agent = LlmAgent(
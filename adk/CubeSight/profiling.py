@@ -0,0 +1,290 @@
+"""
+Per-run profiling of the CubeSight agent
+
+``RunProfiler.callbacks()`` returns agent callbacks that record one span
+per agent run, with a child span per model call (latency, prompt and
+completion tokens) and per MCP tool call (latency, response bytes,
+errors). A tool call made after a failed one in the same run (the model
+trying again, possibly with another tool) is marked as a retry. Finished runs are kept in memory and, unless
+the export format is "off", written to one file per run either as plain
+JSON or as OTLP/JSON (the OpenTelemetry trace export format, accepted by
+collectors' file receivers and by ``POST /v1/traces``).
+"""
+
+import collections
+import json
+import logging
+import os
+import secrets
+import time
+from typing import Any, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("off", "json", "otlp")
+
+# Runs that never finished (e.g. a tool raised) are dropped past this many.
+_MAX_OPEN_RUNS = 100
+
+_SPAN_KIND_INTERNAL = 1
+_SPAN_KIND_CLIENT = 3
+_STATUS_ERROR = 2
+
+_ERROR_PREFIX = "Error:"
+
+
+class Span:
+    __slots__ = ("span_id", "parent_id", "name", "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, kind: str, parent_id: Optional[str] = None, **attributes: Any):
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        # "agent", "model" or "tool".
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, Any] = attributes
+        self.error: Optional[str] = None
+
+    def end(self, error: Optional[str] = None, **attributes: Any) -> None:
+        self.end_ns = time.time_ns()
+        self.error = error
+        self.attributes.update(attributes)
+
+    @property
+    def seconds(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def to_dict(self, run_start_ns: int) -> Dict[str, Any]:
+        return {
+            "id": self.span_id,
+            "parent": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_ms": round((self.start_ns - run_start_ns) / 1e6, 3),
+            "duration_ms": round(self.seconds * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class Run:
+    """The spans of one agent invocation."""
+
+    def __init__(self, invocation_id: str, agent: str):
+        self.invocation_id = invocation_id
+        self.trace_id = secrets.token_hex(16)
+        self.root = Span(f"invoke_agent {agent}", "agent", **{"gen_ai.agent.name": agent})
+        self.spans: List[Span] = [self.root]
+        # Model span of the call in flight; model calls of a run do not overlap.
+        self.model: Optional[Span] = None
+        # Tool spans in flight by function call id.
+        self.tools: Dict[str, Span] = {}
+        self.last_tool_failed = False
+
+    def start(self, name: str, kind: str, **attributes: Any) -> Span:
+        span = Span(name, kind, self.root.span_id, **attributes)
+        self.spans.append(span)
+        return span
+
+    def summary(self) -> Dict[str, Any]:
+        model = [s for s in self.spans if s.kind == "model"]
+        tools = [s for s in self.spans if s.kind == "tool"]
+        return {
+            "invocation_id": self.invocation_id,
+            "seconds": round(self.root.seconds, 4),
+            "model_calls": len(model),
+            "model_seconds": round(sum(s.seconds for s in model), 4),
+            "prompt_tokens": sum(s.attributes.get("gen_ai.usage.input_tokens") or 0 for s in model),
+            "completion_tokens": sum(s.attributes.get("gen_ai.usage.output_tokens") or 0 for s in model),
+            "tool_calls": len(tools),
+            "tool_seconds": round(sum(s.seconds for s in tools), 4),
+            "tool_bytes": sum(s.attributes.get("tool.response_bytes") or 0 for s in tools),
+            "tool_errors": sum(1 for s in tools if s.error),
+            "retries": sum(1 for s in tools if s.attributes.get("tool.retry")),
+            "tools": dict(collections.Counter(s.attributes["gen_ai.tool.name"] for s in tools)),
+        }
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "start": self.root.start_ns / 1e9,
+            "summary": self.summary(),
+            "spans": [span.to_dict(self.root.start_ns) for span in self.spans],
+        }
+
+    def to_otlp(self, service: str) -> Dict[str, Any]:
+        spans = []
+        for span in self.spans:
+            otlp = {
+                "traceId": self.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": _SPAN_KIND_INTERNAL if span.kind == "agent" else _SPAN_KIND_CLIENT,
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns or time.time_ns()),
+                "attributes": _otlp_attributes(span.attributes),
+            }
+            if span.parent_id:
+                otlp["parentSpanId"] = span.parent_id
+            if span.error:
+                otlp["status"] = {"code": _STATUS_ERROR, "message": span.error}
+            spans.append(otlp)
+        return {"resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": service})},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}],
+        }]}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    out = []
+    for key, value in attributes.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            typed = {"boolValue": value}
+        elif isinstance(value, int):
+            typed = {"intValue": str(value)}
+        elif isinstance(value, float):
+            typed = {"doubleValue": value}
+        else:
+            typed = {"stringValue": str(value)}
+        out.append({"key": key, "value": typed})
+    return out
+
+
+def _tool_result(response: Any) -> tuple:
+    """``(response bytes, error message or None)`` of a tool response.
+
+    MCP tools return a ``CallToolResult``: the bytes are those of its text
+    content. The cube-mcp server reports a failed call as text starting
+    with "Error:"; other servers set ``isError``.
+    """
+    content = getattr(response, "content", None)
+    if content is not None:
+        texts = [getattr(item, "text", None) or "" for item in content]
+        size = sum(len(text.encode()) for text in texts)
+        if getattr(response, "isError", False) or (texts and texts[0].startswith(_ERROR_PREFIX)):
+            return size, texts[0][:200] if texts else "error"
+        return size, None
+    if isinstance(response, dict):
+        size = len(json.dumps(response, default=str).encode())
+        return size, str(response["error"])[:200] if response.get("error") else None
+    return len(str(response).encode()), None
+
+
+class RunProfiler:
+    """Records a span timeline per agent run; see the module docstring.
+
+    ``export`` is one of ``EXPORT_FORMATS``; files go to ``directory``.
+    The last ``keep`` finished runs stay in ``finished``.
+    """
+
+    def __init__(self, export: str = "off", directory: str = "profiles", service: str = "cubesight",
+                 keep: int = 100):
+        if export not in EXPORT_FORMATS:
+            raise ValueError(f"Profile export must be one of {', '.join(EXPORT_FORMATS)}, got {export!r}")
+        self.export = export
+        self.directory = directory
+        self.service = service
+        self._runs: "collections.OrderedDict[str, Run]" = collections.OrderedDict()
+        self.finished: Deque[Run] = collections.deque(maxlen=keep)
+
+    def callbacks(self) -> Dict[str, Any]:
+        """Keyword arguments for ``LlmAgent`` that install the profiler."""
+        return {
+            "before_agent_callback": self.before_agent,
+            "after_agent_callback": self.after_agent,
+            "before_model_callback": self.before_model,
+            "after_model_callback": self.after_model,
+            "before_tool_callback": self.before_tool,
+            "after_tool_callback": self.after_tool,
+        }
+
+    def _run(self, context: Any) -> Optional[Run]:
+        return self._runs.get(context.invocation_id)
+
+    def before_agent(self, callback_context: Any) -> None:
+        self._runs[callback_context.invocation_id] = Run(callback_context.invocation_id, callback_context.agent_name)
+        while len(self._runs) > _MAX_OPEN_RUNS:
+            self._runs.popitem(last=False)
+
+    def after_agent(self, callback_context: Any) -> None:
+        run = self._runs.pop(callback_context.invocation_id, None)
+        if run is None:
+            return
+        run.root.end()
+        for span in run.spans:
+            if span.end_ns is None:
+                span.end(error="unfinished")
+        self.finished.append(run)
+        summary = run.summary()
+        logger.info(
+            f"Run {run.invocation_id}: {summary['seconds']:.2f}s, "
+            f"{summary['model_calls']} model calls ({summary['model_seconds']:.2f}s, "
+            f"{summary['prompt_tokens']}+{summary['completion_tokens']} tokens), "
+            f"{summary['tool_calls']} tool calls ({summary['tool_seconds']:.2f}s, {summary['tool_bytes']} bytes)"
+        )
+        if self.export != "off":
+            self.write(run)
+
+    def before_model(self, callback_context: Any, llm_request: Any) -> None:
+        run = self._run(callback_context)
+        if run is not None:
+            run.model = run.start(f"chat {llm_request.model or ''}".strip(), "model",
+                                  **{"gen_ai.request.model": llm_request.model})
+
+    def after_model(self, callback_context: Any, llm_response: Any) -> None:
+        run = self._run(callback_context)
+        if run is None or run.model is None:
+            return
+        span = run.model
+        if getattr(llm_response, "partial", False):
+            # Streaming: the usage comes with the final, aggregated response.
+            span.attributes.setdefault("gen_ai.response.first_chunk_ms", round(span.seconds * 1000, 3))
+            return
+        usage = llm_response.usage_metadata
+        calls = [part.function_call.name for part in (llm_response.content.parts if llm_response.content else [])
+                 if part.function_call]
+        span.end(
+            error=llm_response.error_message or llm_response.error_code,
+            **{
+                "gen_ai.usage.input_tokens": usage.prompt_token_count if usage else None,
+                "gen_ai.usage.output_tokens": usage.candidates_token_count if usage else None,
+                "gen_ai.response.tool_calls": ",".join(calls) or None,
+            },
+        )
+        run.model = None
+
+    def before_tool(self, tool: Any, args: Dict[str, Any], tool_context: Any) -> None:
+        run = self._run(tool_context)
+        if run is not None:
+            run.tools[tool_context.function_call_id] = run.start(
+                f"execute_tool {tool.name}", "tool",
+                **{"gen_ai.tool.name": tool.name, "gen_ai.tool.call.id": tool_context.function_call_id,
+                   "tool.retry": run.last_tool_failed},
+            )
+
+    def after_tool(self, tool: Any, args: Dict[str, Any], tool_context: Any, tool_response: Any) -> None:
+        run = self._run(tool_context)
+        span = run.tools.pop(tool_context.function_call_id, None) if run is not None else None
+        if span is None:
+            return
+        size, error = _tool_result(tool_response)
+        span.end(error=error, **{"tool.response_bytes": size})
+        run.last_tool_failed = error is not None
+
+    def write(self, run: Run) -> Optional[str]:
+        """Write ``run`` to a file in the export format; returns its path."""
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime(run.root.start_ns / 1e9))
+        path = os.path.join(self.directory, f"{stamp}-{run.invocation_id}.{self.export}.json")
+        payload = run.to_otlp(self.service) if self.export == "otlp" else run.to_json()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(payload, f, indent=2)
+        except OSError as e:
+            logger.warning(f"Could not write run profile {path}: {e}")
+            return None
+        return path
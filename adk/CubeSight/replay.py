@@ -0,0 +1,247 @@
+"""
+Replay a fixed set of chart prompts through the CubeSight agent
+
+Each case of replay_cases.json is run against the MCP server of the local
+stack, by default with a scripted stand-in for the model: it makes the
+case's tool calls in order, then answers with a Plotly figure built from
+the last tool result. Its token counts are estimated from the request and
+response sizes (about 4 characters per token), so they follow changes to
+the instruction, the tool declarations and the tool results, while model
+latency is taken out of the comparison. ``--model agent`` uses the
+agent's configured model instead.
+
+Usage (from adk/, with the stack up):
+    python -m CubeSight.replay --repeat 3 --out after.json --baseline before.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import statistics
+import sys
+import time
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.adk.runners import InMemoryRunner
+from google.adk.tools.mcp_tool.mcp_toolset import MCPToolset, SseConnectionParams, StreamableHTTPConnectionParams
+from google.genai import types
+
+from .agent import TOOLS, cubesight_agent
+from .profiling import EXPORT_FORMATS, RunProfiler
+
+CASES_PATH = os.path.join(os.path.dirname(__file__), "replay_cases.json")
+
+# Per-case metrics, compared against a baseline report.
+METRICS = ("seconds", "model_seconds", "tool_seconds", "model_calls", "tool_calls", "prompt_tokens",
+           "completion_tokens", "tool_bytes", "tool_errors", "retries")
+
+
+def _tokens(chars: int) -> int:
+    return math.ceil(chars / 4)
+
+
+def _part_text(part: types.Part) -> str:
+    if part.text:
+        return part.text
+    if part.function_call:
+        return json.dumps({"name": part.function_call.name, "args": part.function_call.args})
+    if part.function_response:
+        return json.dumps(part.function_response.response, default=_tool_text)
+    return ""
+
+
+def _tool_text(response: Any) -> str:
+    """Text of an MCP tool result (a ``CallToolResult``, possibly wrapped in a dict)."""
+    if isinstance(response, dict) and "result" in response:
+        response = response["result"]
+    content = getattr(response, "content", None)
+    if content is not None:
+        return "".join(getattr(item, "text", None) or "" for item in content)
+    return response if isinstance(response, str) else json.dumps(response, default=str)
+
+
+class ScriptedLlm(BaseLlm):
+    """Answers with the tool calls scripted for the prompt, then a figure from the last tool result."""
+
+    model: str = "scripted"
+    scripts: Dict[str, List[Dict[str, Any]]] = {}
+    # Simulated latency of each model call, in seconds.
+    latency: float = 0.0
+
+    async def generate_content_async(self, llm_request: LlmRequest,
+                                     stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        # The current turn: everything since the last user message with text.
+        start = max(
+            (i for i, content in enumerate(llm_request.contents)
+             if content.role == "user" and any(part.text for part in content.parts or [])),
+            default=0,
+        )
+        turn = llm_request.contents[start:]
+        prompt = next(part.text for part in turn[0].parts if part.text) if turn else ""
+        responses = [part.function_response for content in turn for part in content.parts or []
+                     if part.function_response]
+        script = self.scripts.get(prompt.strip(), [])
+
+        if len(responses) < len(script):
+            step = script[len(responses)]
+            parts = [types.Part(function_call=types.FunctionCall(name=step["tool"], args=step["args"]))]
+        else:
+            parts = [types.Part(text=json.dumps(self._figure(prompt, responses[-1] if responses else None)))]
+
+        config = llm_request.config
+        prompt_chars = sum(len(_part_text(part)) for content in llm_request.contents for part in content.parts or [])
+        if config is not None:
+            prompt_chars += len(str(config.system_instruction or ""))
+            prompt_chars += sum(len(tool.model_dump_json(exclude_none=True)) for tool in config.tools or [])
+        completion_chars = sum(len(_part_text(part)) for part in parts)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        yield LlmResponse(
+            content=types.Content(role="model", parts=parts),
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=_tokens(prompt_chars),
+                candidates_token_count=_tokens(completion_chars),
+                total_token_count=_tokens(prompt_chars) + _tokens(completion_chars),
+            ),
+        )
+
+    @staticmethod
+    def _figure(prompt: str, response: Optional[types.FunctionResponse]) -> Dict[str, Any]:
+        traces: List[Dict[str, Any]] = []
+        if response is not None:
+            try:
+                result = json.loads(_tool_text(response.response))
+            except ValueError:
+                result = None
+            if isinstance(result, dict) and isinstance(result.get("data"), list):
+                # cubejs_chart_data returns traces; rows of other tools are left out.
+                traces = [trace for trace in result["data"] if isinstance(trace, dict) and "type" in trace]
+        return {"data": traces, "layout": {"title": {"text": prompt}}}
+
+
+def _connection_params(url: str):
+    if url.rstrip("/").endswith("/mcp"):
+        return StreamableHTTPConnectionParams(url=url, headers={})
+    return SseConnectionParams(url=url, headers={})
+
+
+async def replay(cases: List[Dict[str, Any]], model: str, mcp_url: Optional[str], repeat: int,
+                 latency: float, profiler: RunProfiler) -> Dict[str, Any]:
+    toolset = MCPToolset(connection_params=_connection_params(mcp_url), tool_filter=TOOLS) if mcp_url else None
+    update: Dict[str, Any] = dict(profiler.callbacks())
+    if toolset is not None:
+        update["tools"] = [toolset]
+    if model == "stub":
+        update["model"] = ScriptedLlm(scripts={case["prompt"].strip(): case["script"] for case in cases},
+                                      latency=latency)
+    agent = cubesight_agent.model_copy(update=update)
+    runner = InMemoryRunner(agent=agent, app_name="cubesight-replay")
+
+    results: Dict[str, Any] = {}
+    try:
+        for case in cases:
+            runs = []
+            for _ in range(repeat):
+                session = await runner.session_service.create_session(app_name="cubesight-replay", user_id="replay")
+                answer = ""
+                message = types.Content(role="user", parts=[types.Part(text=case["prompt"])])
+                async for event in runner.run_async(user_id="replay", session_id=session.id, new_message=message):
+                    if event.is_final_response() and event.content and event.content.parts:
+                        answer = "".join(part.text or "" for part in event.content.parts)
+                summary = profiler.finished[-1].summary()
+                try:
+                    summary["valid_figure"] = isinstance(json.loads(answer).get("data"), list)
+                except (ValueError, AttributeError):
+                    summary["valid_figure"] = False
+                runs.append(summary)
+                print(f"{case['name']}: {summary['seconds']:.3f}s, {summary['prompt_tokens']}"
+                      f"+{summary['completion_tokens']} tokens, {summary['tool_calls']} tool calls",
+                      file=sys.stderr)
+            results[case["name"]] = {
+                **{metric: statistics.median(run[metric] for run in runs) for metric in METRICS},
+                "valid_figures": sum(run["valid_figure"] for run in runs),
+                "runs": runs,
+            }
+    finally:
+        if toolset is not None:
+            await toolset.close()
+        else:
+            for tool in cubesight_agent.tools:
+                if isinstance(tool, MCPToolset):
+                    await tool.close()
+
+    total = {metric: round(sum(case[metric] for case in results.values()), 4) for metric in METRICS}
+    return {
+        "params": {
+            "model": model if model == "stub" else str(getattr(cubesight_agent.model, "model", cubesight_agent.model)),
+            "mcp_url": mcp_url,
+            "repeat": repeat,
+            "model_latency": latency,
+            "instruction_chars": len(cubesight_agent.instruction) if isinstance(cubesight_agent.instruction, str) else None,
+        },
+        "cases": results,
+        "total": total,
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any]) -> str:
+    """A table of the per-case medians of ``report`` against ``baseline``."""
+    lines = [f"{'case':<28} {'metric':<18} {'baseline':>12} {'current':>12} {'change':>8}"]
+    rows = [(name, case) for name, case in report["cases"].items()] + [("total", report["total"])]
+    for name, current in rows:
+        before = baseline["total"] if name == "total" else baseline.get("cases", {}).get(name)
+        if before is None:
+            continue
+        for metric in METRICS:
+            old, new = before.get(metric), current.get(metric)
+            if old is None or new is None or (old == 0 and new == 0):
+                continue
+            change = f"{(new - old) / old * 100:+.1f}%" if old else "new"
+            lines.append(f"{name:<28} {metric:<18} {old:>12g} {new:>12g} {change:>8}")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cases", default=CASES_PATH, help="JSON list of {name, prompt, script}")
+    parser.add_argument("--only", action="append", help="Run only this case (repeatable)")
+    parser.add_argument("--model", choices=("stub", "agent"), default="stub",
+                        help="Scripted stand-in (default) or the agent's configured model")
+    parser.add_argument("--model-latency-ms", type=float, default=0.0, help="Simulated latency per stub model call")
+    parser.add_argument("--mcp-url", default="http://localhost:3001/sse",
+                        help="MCP server of the local stack; URLs ending in /mcp use Streamable HTTP. "
+                             "Empty to use the agent's MCP_URL/MCP_TRANSPORT")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case; metrics are medians")
+    parser.add_argument("--out", help="Write the report here")
+    parser.add_argument("--baseline", help="Report of an earlier replay to compare with")
+    parser.add_argument("--profile", choices=EXPORT_FORMATS, default="off", help="Also write each run's spans")
+    parser.add_argument("--profile-dir", default="profiles")
+    args = parser.parse_args()
+
+    with open(args.cases) as f:
+        cases = json.load(f)
+    if args.only:
+        cases = [case for case in cases if case["name"] in args.only]
+    profiler = RunProfiler(export=args.profile, directory=args.profile_dir, keep=1)
+    started = time.perf_counter()
+    report = asyncio.run(replay(cases, args.model, args.mcp_url or None, args.repeat,
+                                args.model_latency_ms / 1000, profiler))
+    report["params"]["wall_seconds"] = round(time.perf_counter() - started, 3)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            print(compare(report, json.load(f)))
+    else:
+        print(json.dumps({"params": report["params"], "total": report["total"]}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Local stand-in for the Cube REST API used by the benchmark
+
+Serves /cubejs-api/v1/meta, /v1/load and the NDJSON /v1/cubesql endpoint
+over the Titanic passenger rows in db/init.sql, with optional added latency.
+"""
+
+import asyncio
+import json
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+INIT_SQL = Path(__file__).resolve().parents[2] / "db" / "init.sql"
+
+# Column name -> Cube member type, following cube/passenger.js.
+COLUMNS = {
+    "passengerid": "number", "survived": "number", "pclass": "number", "name": "string",
+    "sex": "string", "age": "number", "sibsp": "number", "parch": "number",
+    "ticket": "string", "fare": "number", "cabin": "string", "embarked": "string",
+    "wikiid": "number", "name_wiki": "string", "age_wiki": "number", "hometown": "string",
+    "boarded": "string", "destination": "string", "lifeboat": "string", "body": "string",
+    "class": "number",
+}
+
+META = {
+    "cubes": [
+        {
+            "name": "Passenger",
+            "title": "Passenger",
+            "type": "cube",
+            "measures": [
+                {"name": "Passenger.count", "title": "Passenger Count", "type": "number", "aggType": "count"},
+                {"name": "Passenger.survivedCount", "title": "Passenger Survived Count", "type": "number",
+                 "aggType": "sum"},
+            ],
+            "dimensions": [
+                {"name": f"Passenger.{column}", "title": f"Passenger {column}", "type": kind}
+                for column, kind in COLUMNS.items()
+            ],
+            "segments": [],
+        }
+    ]
+}
+
+
+def load_passengers(path: Path = INIT_SQL) -> List[Dict[str, Any]]:
+    """Parse the COPY block of db/init.sql into row dicts."""
+    rows = []
+    in_copy = False
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("COPY public.passenger"):
+                in_copy = True
+                continue
+            if not in_copy:
+                continue
+            if line.startswith("\\."):
+                break
+            row = {}
+            for (column, kind), raw in zip(COLUMNS.items(), line.rstrip("\n").split("\t")):
+                if raw == "\\N":
+                    row[column] = None
+                elif kind == "number":
+                    row[column] = float(raw) if "." in raw else int(raw)
+                else:
+                    row[column] = raw
+            rows.append(row)
+    return rows
+
+
+def _matches(row: Dict[str, Any], filters: List[Dict[str, Any]]) -> bool:
+    for f in filters:
+        value = row.get(f["member"].split(".", 1)[1])
+        values = [str(v) for v in f.get("values", [])]
+        if f["operator"] == "equals" and str(value) not in values:
+            return False
+        if f["operator"] == "notEquals" and str(value) in values:
+            return False
+        if f["operator"] == "set" and value is None:
+            return False
+        if f["operator"] == "notSet" and value is not None:
+            return False
+        if f["operator"] in ("gt", "gte", "lt", "lte"):
+            bound = float(values[0])
+            if value is None or not {"gt": value > bound, "gte": value >= bound,
+                                     "lt": value < bound, "lte": value <= bound}[f["operator"]]:
+                return False
+        if f["operator"] in ("contains", "notContains"):
+            found = value is not None and any(v.lower() in str(value).lower() for v in values)
+            if found != (f["operator"] == "contains"):
+                return False
+    return True
+
+
+def aggregate(rows: List[Dict[str, Any]], query: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Group ``rows`` the way Cube would answer a simple /v1/load query."""
+    dimensions = query.get("dimensions", [])
+    measures = query.get("measures", [])
+    groups: Dict[tuple, Dict[str, float]] = defaultdict(lambda: {"count": 0, "survivedCount": 0})
+    for row in rows:
+        if not _matches(row, query.get("filters", [])):
+            continue
+        key = tuple(row.get(d.split(".", 1)[1]) for d in dimensions)
+        groups[key]["count"] += 1
+        groups[key]["survivedCount"] += row.get("survived") or 0
+
+    data = []
+    for key, values in groups.items():
+        item = {d: (None if v is None else str(v)) for d, v in zip(dimensions, key)}
+        for m in measures:
+            item[m] = str(values[m.split(".", 1)[1]])
+        data.append(item)
+
+    order = query.get("order") or {}
+    for member, direction in reversed(list(order.items() if isinstance(order, dict) else order)):
+        numeric = member in measures or COLUMNS.get(member.split(".", 1)[1]) == "number"
+        data.sort(key=lambda r: (r.get(member) is None,
+                                 float(r[member]) if numeric and r.get(member) is not None else r.get(member)),
+                  reverse=direction == "desc")
+    offset = query.get("offset", 0)
+    limit = query.get("limit")
+    return data[offset:offset + limit if limit else None]
+
+
+def create_app(latency_ms: float = 0.0, chunk_rows: int = 500,
+               rows: Optional[List[Dict[str, Any]]] = None) -> Starlette:
+    passengers = rows if rows is not None else load_passengers()
+    delay = latency_ms / 1000.0
+
+    async def meta(request: Request) -> Response:
+        await asyncio.sleep(delay)
+        return JSONResponse(META)
+
+    async def load(request: Request) -> Response:
+        body = await request.json()
+        await asyncio.sleep(delay)
+        query = body["query"]
+        return JSONResponse({"query": query, "data": aggregate(passengers, query), "annotation": {}})
+
+    async def cubesql(request: Request) -> Response:
+        body = await request.json()
+        sql = body["query"].lower()
+        if "group by" in sql:
+            columns = ["sex", "pclass"]
+            data = [[r["Passenger.sex"], r["Passenger.pclass"], r["Passenger.count"]]
+                    for r in aggregate(passengers, {"dimensions": ["Passenger.sex", "Passenger.pclass"],
+                                                    "measures": ["Passenger.count"]})]
+            columns.append("count")
+        else:
+            columns = ["passengerid", "name", "sex", "age", "pclass", "survived"]
+            data = [[r[c] for c in columns] for r in passengers]
+
+        async def stream():
+            await asyncio.sleep(delay)
+            yield json.dumps({"schema": [{"name": c, "column_type": "String"} for c in columns]}) + "\n"
+            for i in range(0, len(data), chunk_rows):
+                yield json.dumps({"data": data[i:i + chunk_rows]}) + "\n"
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    return Starlette(routes=[
+        Route("/cubejs-api/v1/meta", meta),
+        Route("/cubejs-api/v1/load", load, methods=["POST"]),
+        Route("/cubejs-api/v1/cubesql", cubesql, methods=["POST"]),
+    ])
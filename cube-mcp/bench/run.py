@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Load-generation benchmark for the CubeJS MCP server
+
+Runs the app from CubeJSMCPServer.create_starlette_app() in-process against
+the local Cube stand-in in fake_cube.py, drives concurrent MCP sessions
+(over SSE, or the stateless Streamable HTTP endpoint with --transport http)
+through every tool and writes latency/throughput/memory results as JSON.
+CubeSQL is benchmarked only when --cubesql-host points at a Postgres loaded
+with db/init.sql (e.g. the `db` compose service). --idle-sessions also
+measures the server memory held per idle session, for both transports.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import multiprocessing
+import resource
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+import uvicorn
+from mcp import ClientSession
+from mcp.client.sse import sse_client
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import fake_cube  # noqa: E402
+from main import CubeJSMCPServer  # noqa: E402
+
+logger = logging.getLogger("bench")
+
+# One call per tool per iteration.
+SCENARIOS: Dict[str, Dict[str, Any]] = {
+    "cubejs_meta": {},
+    "cubejs_load": {
+        "query": {
+            "measures": ["Passenger.count", "Passenger.survivedCount"],
+            "dimensions": ["Passenger.pclass", "Passenger.sex"],
+        }
+    },
+    "cubejs_sql": {"query": "SELECT sex, pclass, COUNT(*) FROM Passenger GROUP BY 1, 2"},
+    "cubejs_cubesql": {
+        "query": "SELECT sex, pclass, COUNT(*) AS count FROM passenger GROUP BY 1, 2 ORDER BY 1, 2"
+    },
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _rss_kb(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def _serve(app: Any, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    return server
+
+
+class _HTTPSession:
+    """Minimal client for the stateless Streamable HTTP endpoint: one POST per request."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.client = httpx.AsyncClient(timeout=300)
+        self._next_id = 0
+
+    async def request(self, method: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        self._next_id += 1
+        response = await self.client.post(
+            self.url,
+            json={"jsonrpc": "2.0", "id": self._next_id, "method": method, "params": params},
+            headers={"Accept": "application/json, text/event-stream"},
+        )
+        response.raise_for_status()
+        message = response.json()
+        if "error" in message:
+            raise RuntimeError(message["error"]["message"])
+        return message["result"]
+
+    async def initialize(self) -> None:
+        await self.request("initialize", {
+            "protocolVersion": "2025-03-26", "capabilities": {}, "clientInfo": {"name": "bench", "version": "0"},
+        })
+        await self.client.post(self.url, json={"jsonrpc": "2.0", "method": "notifications/initialized"})
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+@contextlib.asynccontextmanager
+async def _connect(transport: str, base_url: str):
+    """Yield ``call_tool(name, arguments) -> (texts, is_error)`` on an initialized session."""
+    if transport == "http":
+        http = _HTTPSession(f"{base_url}/mcp")
+        try:
+            await http.initialize()
+
+            async def call_http(name: str, arguments: Dict[str, Any]):
+                result = await http.request("tools/call", {"name": name, "arguments": arguments})
+                texts = [c["text"] for c in result["content"] if c["type"] == "text"]
+                return texts, result.get("isError", False)
+
+            yield call_http
+        finally:
+            await http.aclose()
+        return
+
+    async with sse_client(f"{base_url}/sse", timeout=30, sse_read_timeout=300) as (read, write):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+
+            async def call_sse(name: str, arguments: Dict[str, Any]):
+                result = await session.call_tool(name, arguments)
+                return [c.text for c in result.content if c.type == "text"], result.isError
+
+            yield call_sse
+
+
+async def _session(transport: str, base_url: str, tools: List[str], iterations: int,
+                   samples: Dict[str, List[Dict[str, float]]]) -> None:
+    async with _connect(transport, base_url) as call_tool:
+        for _ in range(iterations):
+            for tool in tools:
+                started = time.perf_counter()
+                texts, is_error = await call_tool(tool, SCENARIOS[tool])
+                elapsed = time.perf_counter() - started
+                size = sum(len(text.encode("utf-8")) for text in texts)
+                error = is_error or any(text.startswith("Error:") for text in texts)
+                samples[tool].append({"seconds": elapsed, "bytes": size, "error": error})
+
+
+def _idle_server(port: int) -> None:
+    """Serve the Cube stand-in and the MCP app on ``port``; run in a child process."""
+    async def serve() -> None:
+        cube_port = _free_port()
+        await _serve(fake_cube.create_app(latency_ms=0), cube_port)
+        mcp = CubeJSMCPServer(f"http://127.0.0.1:{cube_port}", cubesql_host="127.0.0.1", cubesql_port=_free_port())
+        config = uvicorn.Config(mcp.create_starlette_app(), host="127.0.0.1", port=port, log_level="critical")
+        await uvicorn.Server(config).serve()
+
+    logging.basicConfig(level=logging.CRITICAL, force=True)
+    asyncio.run(serve())
+
+
+async def _idle_memory(transport: str, count: int) -> Dict[str, Any]:
+    """Server RSS growth from opening ``count`` initialized sessions that then sit idle.
+
+    The server runs in its own process so the client side is not counted.
+    """
+    port = _free_port()
+    process = multiprocessing.get_context("spawn").Process(target=_idle_server, args=(port,), daemon=True)
+    process.start()
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        async with httpx.AsyncClient() as client:
+            while True:
+                try:
+                    await client.get(f"{base_url}/stats")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+        async with contextlib.AsyncExitStack() as stack:
+            # Warm up imports, caches and the upstream client before the baseline.
+            call_tool = await stack.enter_async_context(_connect(transport, base_url))
+            await call_tool("cubejs_meta", {})
+            await asyncio.sleep(0.5)
+            before = _rss_kb(process.pid)
+            for _ in range(count):
+                await stack.enter_async_context(_connect(transport, base_url))
+            await asyncio.sleep(0.5)
+            after = _rss_kb(process.pid)
+    finally:
+        process.terminate()
+        process.join(10)
+    return {
+        "sessions": count,
+        "server_rss_before_mb": before / 1024,
+        "server_rss_after_mb": after / 1024,
+        "kb_per_session": (after - before) / count,
+    }
+
+
+def _summarize(samples: List[Dict[str, float]], wall: float) -> Dict[str, Any]:
+    latencies = [s["seconds"] * 1000 for s in samples]
+    sizes = [s["bytes"] for s in samples]
+    return {
+        "calls": len(samples),
+        "errors": sum(1 for s in samples if s["error"]),
+        "calls_per_sec": len(samples) / wall if wall else 0.0,
+        "latency_ms": {
+            "p50": _percentile(latencies, 50),
+            "p95": _percentile(latencies, 95),
+            "p99": _percentile(latencies, 99),
+            "max": max(latencies, default=0.0),
+        },
+        "bytes_per_response": sum(sizes) / len(sizes) if sizes else 0,
+    }
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"], cwd=Path(__file__).parent, text=True,
+            stderr=subprocess.DEVNULL,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    tools = args.tools or [t for t in SCENARIOS if t != "cubejs_cubesql" or args.cubesql_host]
+
+    cube_port = _free_port()
+    cube = await _serve(fake_cube.create_app(latency_ms=args.upstream_latency_ms), cube_port)
+
+    mcp = CubeJSMCPServer(
+        f"http://127.0.0.1:{cube_port}",
+        cubesql_host=args.cubesql_host or "127.0.0.1",
+        cubesql_port=args.cubesql_port,
+        cubesql_user=args.cubesql_user,
+        cubesql_password=args.cubesql_password,
+        cubesql_database=args.cubesql_database,
+        result_cache_ttl=args.result_cache_ttl,
+        meta_cache_ttl=args.meta_cache_ttl,
+        output_format=args.format,
+        sql_planner=not args.no_sql_planner,
+    )
+    mcp_port = _free_port()
+    app_server = await _serve(mcp.create_starlette_app(), mcp_port)
+
+    rss_before = _peak_rss_mb()
+    samples: Dict[str, List[Dict[str, float]]] = {tool: [] for tool in tools}
+    base_url = f"http://127.0.0.1:{mcp_port}"
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(
+            _session(args.transport, base_url, tools, args.iterations, samples) for _ in range(args.sessions)
+        ))
+    finally:
+        wall = time.perf_counter() - started
+        # SSE handlers are cancelled on shutdown; don't print those as errors.
+        logging.getLogger("uvicorn.error").setLevel(logging.CRITICAL)
+        app_server.should_exit = True
+        cube.should_exit = True
+        await asyncio.sleep(0.2)
+
+    all_samples = [s for tool_samples in samples.values() for s in tool_samples]
+    result = {
+        "revision": _git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "params": {
+            "transport": args.transport,
+            "sessions": args.sessions,
+            "iterations": args.iterations,
+            "tools": tools,
+            "upstream_latency_ms": args.upstream_latency_ms,
+            "result_cache_ttl": args.result_cache_ttl,
+            "meta_cache_ttl": args.meta_cache_ttl,
+            "format": args.format,
+        },
+        "wall_seconds": wall,
+        "peak_rss_mb": _peak_rss_mb(),
+        "rss_before_load_mb": rss_before,
+        "total": _summarize(all_samples, wall),
+        "tools": {tool: _summarize(tool_samples, wall) for tool, tool_samples in samples.items()},
+    }
+    if args.idle_sessions:
+        result["idle_memory"] = {
+            transport: await _idle_memory(transport, args.idle_sessions) for transport in ("sse", "http")
+        }
+    return result
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Return regressions of p95 latency or throughput beyond ``threshold`` (a fraction)."""
+    regressions = []
+    for tool, stats in result["tools"].items():
+        base = baseline.get("tools", {}).get(tool)
+        if not base:
+            continue
+        p95, base_p95 = stats["latency_ms"]["p95"], base["latency_ms"]["p95"]
+        if base_p95 and p95 > base_p95 * (1 + threshold):
+            regressions.append(f"{tool}: p95 {base_p95:.1f}ms -> {p95:.1f}ms")
+        rate, base_rate = stats["calls_per_sec"], base["calls_per_sec"]
+        if base_rate and rate < base_rate * (1 - threshold):
+            regressions.append(f"{tool}: {base_rate:.1f} -> {rate:.1f} calls/sec")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=8, help="Concurrent MCP sessions")
+    parser.add_argument("--transport", choices=["sse", "http"], default="sse",
+                        help="MCP transport: SSE sessions or stateless Streamable HTTP on /mcp")
+    parser.add_argument("--iterations", type=int, default=20, help="Rounds of tool calls per session")
+    parser.add_argument("--tools", nargs="+", choices=list(SCENARIOS), help="Tools to call (default: all)")
+    parser.add_argument("--upstream-latency-ms", type=float, default=5.0,
+                        help="Latency added by the fake Cube API")
+    parser.add_argument("--result-cache-ttl", type=float, default=0.0,
+                        help="Result cache TTL; 0 measures the upstream path")
+    parser.add_argument("--meta-cache-ttl", type=float, default=300.0)
+    parser.add_argument("--format", default="json", help="Output format passed to the server")
+    parser.add_argument("--cubesql-host", help="Postgres loaded with db/init.sql; enables cubejs_cubesql")
+    parser.add_argument("--cubesql-port", type=int, default=5432)
+    parser.add_argument("--cubesql-user", default="cubepostgres")
+    parser.add_argument("--cubesql-password", default="password")
+    parser.add_argument("--cubesql-database", default="titanic")
+    parser.add_argument("--no-sql-planner", action="store_true",
+                        help="Send every cubejs_cubesql query to CubeSQL instead of planning it onto /v1/load")
+    parser.add_argument("--idle-sessions", type=int, default=0,
+                        help="Also measure server memory per idle session over this many sessions, per transport")
+    parser.add_argument("--output", help="Write results JSON to this file")
+    parser.add_argument("--compare", help="Baseline results JSON to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Allowed regression as a fraction (default: 0.2)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, force=True)
+    result = asyncio.run(run(args))
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+    print(text)
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        regressions = compare(result, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,439 @@
+"""
+In-process caches for CubeJS API responses
+"""
+
+import asyncio
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    __slots__ = ("future", "waiters")
+
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one upstream call."""
+
+    def __init__(self) -> None:
+        self._inflight: Dict[Hashable, _Flight] = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Run ``func`` unless a call for ``key`` is already running.
+
+        Returns ``(result, shared)`` where ``shared`` is True if the result
+        came from a call started by someone else. The call is cancelled
+        once every caller waiting for it has been cancelled.
+        """
+        flight = self._inflight.get(key)
+        shared = flight is not None
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(func()))
+            self._inflight[key] = flight
+            flight.future.add_done_callback(lambda _: self._forget(key, flight))
+
+        flight.waiters += 1
+        try:
+            # Shield so one cancelled caller does not cancel the fetch for the others.
+            return await asyncio.shield(flight.future), shared
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.future.done():
+                self._forget(key, flight)
+                flight.future.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def _forget(self, key: Hashable, flight: _Flight) -> None:
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+
+class MetaCache:
+    """Cache for the /v1/meta response.
+
+    Keeps both the parsed schema and its serialized text so a hit costs no
+    JSON encoding. Expired entries are revalidated with ``If-None-Match``
+    when the upstream sent an ETag. ``on_change`` is called with every new
+    schema, so indexes derived from it are rebuilt along with it.
+    """
+
+    def __init__(self, fetch: Callable[[Optional[str]], Awaitable[Optional[Tuple[Any, Optional[str]]]]],
+                 serialize: Callable[[Any], str], ttl: float = 300.0, refresh_interval: float = 0.0,
+                 on_change: Optional[Callable[[Any], None]] = None):
+        # fetch(etag) returns (value, etag), or None if the upstream answered 304.
+        self._fetch = fetch
+        self._serialize = serialize
+        self._on_change = on_change
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.value: Any = None
+        self.text: Optional[str] = None
+        self.etag: Optional[str] = None
+        self.fetched_at = 0.0
+        self.version = 0
+        self._flight = SingleFlight()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "shared": 0,
+            "fetches": 0,
+            "not_modified": 0,
+            "invalidations": 0,
+            "errors": 0,
+        }
+
+    @property
+    def fresh(self) -> bool:
+        return self.text is not None and time.monotonic() - self.fetched_at < self.ttl
+
+    async def get(self) -> Tuple[Any, str]:
+        """Return ``(value, text)``, fetching from upstream if stale."""
+        text = self.text
+        if text is not None and self.fresh:
+            self.stats["hits"] += 1
+            return self.value, text
+
+        self.stats["misses"] += 1
+        return await self.refresh()
+
+    async def refresh(self) -> Tuple[Any, str]:
+        """Fetch from upstream now, sharing the request with concurrent callers."""
+        result: Tuple[Any, str]
+        result, shared = await self._flight.do("meta", self._load)
+        if shared:
+            self.stats["shared"] += 1
+        return result
+
+    def invalidate(self) -> None:
+        """Drop the cached schema; the next get() goes upstream."""
+        self.stats["invalidations"] += 1
+        self.value = None
+        self.text = None
+        self.etag = None
+        self.fetched_at = 0.0
+
+    async def _load(self) -> Tuple[Any, str]:
+        self.stats["fetches"] += 1
+        try:
+            result = await self._fetch(self.etag if self.text is not None else None)
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+
+        if result is None:
+            self.stats["not_modified"] += 1
+            # Only asked for with an ETag, so the cached text is still there.
+            if self.text is None:
+                raise RuntimeError("Metadata answered 304 Not Modified with nothing cached")
+            text = self.text
+        else:
+            self.value, self.etag = result
+            text = self.text = self._serialize(self.value)
+            self.version += 1
+            if self._on_change is not None:
+                self._on_change(self.value)
+        self.fetched_at = time.monotonic()
+        return self.value, text
+
+    def start(self) -> None:
+        """Start refreshing in the background every ``refresh_interval`` seconds."""
+        if self.refresh_interval > 0 and self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning(f"Background metadata refresh failed: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = dict(self.stats)
+        stats.update({
+            "ttl": self.ttl,
+            "cached": self.text is not None,
+            "age_seconds": time.monotonic() - self.fetched_at if self.text is not None else None,
+            "etag": self.etag,
+            "version": self.version,
+        })
+        return stats
+
+
+# Filter operators whose ``values`` form an unordered set.
+_SET_OPERATORS = {"equals", "notEquals", "contains", "notContains", "startsWith", "endsWith"}
+
+# Quoted literals/identifiers are kept verbatim when normalizing SQL.
+_SQL_TOKEN_RE = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|[^'\"]+")
+
+
+def _canonical_filter(f: Any) -> Any:
+    if not isinstance(f, dict):
+        return f
+    if "or" in f or "and" in f:
+        op = "or" if "or" in f else "and"
+        return {op: sorted((_canonical_filter(x) for x in f[op]), key=_dumps)}
+    f = dict(f)
+    if f.get("operator") in _SET_OPERATORS and isinstance(f.get("values"), list):
+        f["values"] = sorted(f["values"], key=_dumps)
+    return f
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def canonical_query(query: Dict[str, Any]) -> str:
+    """Canonical cache key for a CubeJS REST query.
+
+    Only set-valued parts are sorted: segments, the (ANDed) filters and
+    set-valued filter values. Measures, dimensions and time dimensions
+    keep their sequence, which sets the column order and, without an
+    explicit ``order``, the row order; so does ``order`` itself.
+    """
+    canonical = dict(query)
+    if isinstance(canonical.get("segments"), list):
+        canonical["segments"] = sorted(canonical["segments"])
+    if isinstance(canonical.get("filters"), list):
+        canonical["filters"] = sorted((_canonical_filter(f) for f in canonical["filters"]), key=_dumps)
+    if isinstance(canonical.get("order"), dict):
+        canonical["order"] = list(canonical["order"].items())
+    return _dumps(canonical)
+
+
+def canonical_sql(sql: str) -> str:
+    """Canonical cache key for a SQL statement.
+
+    Whitespace is collapsed and keywords/identifiers lower-cased, leaving
+    quoted strings and quoted identifiers untouched.
+    """
+    parts = []
+    for token in _SQL_TOKEN_RE.findall(sql.strip().rstrip(";").strip()):
+        if token[0] in "'\"":
+            parts.append(token)
+        else:
+            parts.append(re.sub(r"\s+", " ", token).lower())
+    return "".join(parts)
+
+
+class ResultCache:
+    """TTL + LRU cache for serialized query results, bounded by total bytes.
+
+    Concurrent identical queries share one upstream call. When ``disk_path``
+    is set, entries are also written to a SQLite file so they survive
+    restarts; memory misses fall back to it.
+    """
+
+    def __init__(self, ttl: float = 60.0, max_bytes: int = 64 * 1024 * 1024,
+                 disk_path: Optional[str] = None, disk_max_bytes: int = 512 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # Anything larger than this would flush most of the cache for one entry.
+        self.max_entry_bytes = max_bytes // 4
+        self.disk_max_bytes = disk_max_bytes
+        self._entries: "OrderedDict[str, Tuple[float, int, str]]" = OrderedDict()
+        self._bytes = 0
+        self._flight = SingleFlight()
+        self._disk: Optional[sqlite3.Connection] = None
+        self._disk_lock = threading.Lock()
+        if disk_path and ttl > 0:
+            self._open_disk(disk_path)
+        self.stats = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "shared": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "uncacheable": 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    async def get_or_load(self, key: str, load: Callable[[], Awaitable[str]]) -> str:
+        """Return the cached text for ``key``, calling ``load`` on a miss."""
+        if not self.enabled:
+            return await load()
+
+        text = self._get_memory(key)
+        if text is not None:
+            self.stats["hits"] += 1
+            return text
+
+        result: str
+        result, shared = await self._flight.do(key, lambda: self._load(key, load))
+        if shared:
+            self.stats["shared"] += 1
+        return result
+
+    async def _load(self, key: str, load: Callable[[], Awaitable[str]]) -> str:
+        if self._disk is not None:
+            loop = asyncio.get_running_loop()
+            row = await loop.run_in_executor(None, self._get_disk, key)
+            if row is not None:
+                self.stats["disk_hits"] += 1
+                expires_at, text = row
+                self._put_memory(key, text, expires_at)
+                return text
+
+        self.stats["misses"] += 1
+        text = await load()
+        expires_at = time.time() + self.ttl
+        self._put_memory(key, text, expires_at)
+        if self._disk is not None:
+            loop = asyncio.get_running_loop()
+            loop.run_in_executor(None, self._put_disk, key, text, expires_at)
+        return text
+
+    def _get_memory(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, size, text = entry
+        if expires_at <= time.time():
+            self.stats["expirations"] += 1
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return text
+
+    def _put_memory(self, key: str, text: str, expires_at: float) -> None:
+        size = len(text.encode("utf-8"))
+        if size > self.max_entry_bytes:
+            self.stats["uncacheable"] += 1
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (expires_at, size, text)
+        self._bytes += size
+        self.stats["stores"] += 1
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.stats["evictions"] += 1
+
+    def _remove(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    async def invalidate(self) -> None:
+        """Drop every cached result, in memory and on disk."""
+        self._entries.clear()
+        self._bytes = 0
+        if self._disk is not None:
+            # Off the event loop: another worker may hold the database lock.
+            await asyncio.to_thread(self._clear_disk)
+
+    def _clear_disk(self) -> None:
+        with self._disk_lock:
+            if self._disk is None:
+                return
+            try:
+                self._disk.execute("DELETE FROM results")
+                self._disk.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to clear the result cache on disk: {e}")
+
+    def _open_disk(self, path: str) -> None:
+        self._disk = sqlite3.connect(path, check_same_thread=False)
+        with self._disk_lock:
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._disk.execute("DELETE FROM results WHERE expires_at <= ?", (time.time(),))
+            self._disk.commit()
+        logger.info(f"Result cache disk tier at {path}")
+
+    def _get_disk(self, key: str) -> Optional[Tuple[float, str]]:
+        now = time.time()
+        with self._disk_lock:
+            if self._disk is None:
+                return None
+            try:
+                row: Optional[Tuple[float, str]] = self._disk.execute(
+                    "SELECT expires_at, value FROM results WHERE key = ? AND expires_at > ?", (key, now)
+                ).fetchone()
+                if row is not None:
+                    self._disk.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+                    self._disk.commit()
+            except sqlite3.Error as e:
+                # e.g. locked by another worker sharing the file; treat as a miss.
+                logger.warning(f"Failed to read result cache entry from disk: {e}")
+                return None
+        return row
+
+    def _put_disk(self, key: str, text: str, expires_at: float) -> None:
+        size = len(text.encode("utf-8"))
+        if size > self.disk_max_bytes:
+            return
+        now = time.time()
+        with self._disk_lock:
+            if self._disk is None:
+                return
+            try:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO results (key, value, size, expires_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, text, size, expires_at, now),
+                )
+                self._disk.execute("DELETE FROM results WHERE expires_at <= ?", (now,))
+                total = self._disk.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+                for old_key, old_size in self._disk.execute(
+                    "SELECT key, size FROM results ORDER BY accessed_at"
+                ).fetchall():
+                    if total <= self.disk_max_bytes:
+                        break
+                    self._disk.execute("DELETE FROM results WHERE key = ?", (old_key,))
+                    total -= old_size
+                self._disk.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to write result cache entry to disk: {e}")
+
+    def close(self) -> None:
+        if self._disk is not None:
+            with self._disk_lock:
+                self._disk.close()
+            self._disk = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = dict(self.stats)
+        stats.update({
+            "ttl": self.ttl,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "inflight": len(self._flight),
+            "disk": self._disk is not None,
+        })
+        return stats
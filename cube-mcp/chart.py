@@ -0,0 +1,213 @@
+"""
+Chart-ready pivoting of tabular results into Plotly traces
+
+Rows are folded into per-(series, x) aggregates as they are fetched, so
+the full result is never materialized; the output holds one value per
+point of each trace.
+"""
+
+import datetime
+import decimal
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from encoding import dumps, plain_value
+
+CHART_TYPES = ("bar", "line", "area", "scatter", "pie")
+AGGREGATIONS = ("sum", "avg", "count", "min", "max")
+GRANULARITIES = ("hour", "day", "week", "month", "quarter", "year")
+
+_TRACE_STYLES: Dict[str, Dict[str, Any]] = {
+    "bar": {"type": "bar"},
+    "line": {"type": "scatter", "mode": "lines"},
+    "area": {"type": "scatter", "mode": "lines", "fill": "tozeroy"},
+    "scatter": {"type": "scatter", "mode": "markers"},
+}
+
+
+def _to_datetime(value: Any) -> Optional[datetime.datetime]:
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day)
+    if isinstance(value, str):
+        try:
+            return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    return None
+
+
+def bucket_time(value: Any, granularity: str) -> Any:
+    """Truncate a date, datetime or ISO string to the start of its ``granularity`` bucket."""
+    dt = _to_datetime(value)
+    if dt is None:
+        return plain_value(value)
+    if granularity == "hour":
+        return dt.replace(minute=0, second=0, microsecond=0).isoformat()
+    day = dt.date()
+    if granularity == "week":
+        day -= datetime.timedelta(days=day.weekday())
+    elif granularity == "month":
+        day = day.replace(day=1)
+    elif granularity == "quarter":
+        day = day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+    elif granularity == "year":
+        day = day.replace(month=1, day=1)
+    return day.isoformat()
+
+
+def _number(value: Any) -> Optional[float]:
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ChartBuilder:
+    """Pivot rows into Plotly traces, one per series and value column.
+
+    Implements the ``add_row``/``finish``/``count`` interface of
+    ``encoding.ResultEncoder`` so it can be fed by the same cursor loop.
+    Points that share a trace and x are aggregated with ``agg``; points
+    missing from a trace are filled with ``fill``.
+    """
+
+    def __init__(self, columns: Sequence[str], x: str, values: Sequence[str],
+                 series: Optional[str] = None, chart_type: str = "bar", agg: str = "sum",
+                 granularity: Optional[str] = None, fill: Any = None):
+        if chart_type not in CHART_TYPES:
+            raise ValueError(f"Unknown chart type: {chart_type}. Expected one of: {', '.join(CHART_TYPES)}")
+        if agg not in AGGREGATIONS:
+            raise ValueError(f"Unknown aggregation: {agg}. Expected one of: {', '.join(AGGREGATIONS)}")
+        if granularity is not None and granularity not in GRANULARITIES:
+            raise ValueError(
+                f"Unknown granularity: {granularity}. Expected one of: {', '.join(GRANULARITIES)}"
+            )
+        if not values:
+            raise ValueError("At least one value column is required")
+        if chart_type == "pie" and (series or len(values) > 1):
+            raise ValueError("Pie charts take one value column and no series")
+
+        self.columns = list(columns)
+        missing = [c for c in [x, *values, *([series] if series else [])] if c not in self.columns]
+        if missing:
+            raise ValueError(
+                f"Unknown column(s): {', '.join(missing)}. Query returned: {', '.join(self.columns)}"
+            )
+        self.x = x
+        self.values = list(values)
+        self.series = series
+        self.chart_type = chart_type
+        self.agg = agg
+        self.granularity = granularity
+        self.fill = fill
+        self.count = 0
+        self._x_index = self.columns.index(x)
+        self._value_index = [self.columns.index(v) for v in self.values]
+        self._series_index = self.columns.index(series) if series else None
+        # x values and series names in first-seen order (dicts keep insertion order).
+        self._xs: Dict[Any, None] = {}
+        self._series: Dict[Any, None] = {}
+        # (series, value column, x) -> [sum or min/max, count]
+        self._cells: Dict[Tuple[Any, int, Any], List[float]] = {}
+
+    def add_row(self, values: Sequence[Any]) -> int:
+        """Fold one row into the traces; returns the approximate bytes it added."""
+        x = values[self._x_index]
+        x = bucket_time(x, self.granularity) if self.granularity else plain_value(x)
+        s = plain_value(values[self._series_index]) if self._series_index is not None else None
+        added = 0
+        if x not in self._xs:
+            self._xs[x] = None
+            added += len(str(x)) + 3
+        self._series.setdefault(s, None)
+
+        agg = self.agg
+        for i, index in enumerate(self._value_index):
+            value = _number(values[index])
+            cell = self._cells.get((s, i, x))
+            if value is None:
+                # Like SQL COUNT(column), nulls are not counted, but the point is.
+                if agg == "count" and cell is None:
+                    self._cells[(s, i, x)] = [0, 0]
+                    added += 12
+                continue
+            if cell is None:
+                self._cells[(s, i, x)] = [1 if agg == "count" else value, 1]
+                added += 12
+            elif agg in ("sum", "avg"):
+                cell[0] += value
+                cell[1] += 1
+            elif agg == "count":
+                cell[0] += 1
+            elif agg == "min":
+                cell[0] = min(cell[0], value)
+            else:
+                cell[0] = max(cell[0], value)
+        self.count += 1
+        return added
+
+    def add_rows(self, rows: Sequence[Sequence[Any]]) -> int:
+        return sum(self.add_row(row) for row in rows)
+
+    def _x_order(self) -> List[Any]:
+        xs = list(self._xs)
+        if self.granularity:
+            # Buckets are ISO strings; sort them chronologically.
+            return sorted(xs, key=lambda v: (v is None, str(v)))
+        return xs
+
+    def _point(self, cell: Optional[List[float]]) -> Any:
+        if cell is None:
+            return self.fill
+        if self.agg == "avg":
+            return cell[0] / cell[1]
+        return cell[0]
+
+    def traces(self) -> List[Dict[str, Any]]:
+        xs = self._x_order()
+        cells = self._cells
+        if self.chart_type == "pie":
+            return [{
+                "type": "pie",
+                "name": self.values[0],
+                "labels": xs,
+                "values": [self._point(cells.get((None, 0, x))) for x in xs],
+            }]
+
+        style = _TRACE_STYLES[self.chart_type]
+        traces = []
+        for s in self._series:
+            for i, value_column in enumerate(self.values):
+                if self.series is None:
+                    name = value_column
+                elif len(self.values) == 1:
+                    name = str(s)
+                else:
+                    name = f"{s} {value_column}"
+                traces.append({
+                    **style,
+                    "name": name,
+                    "x": xs,
+                    "y": [self._point(cells.get((s, i, x))) for x in xs],
+                })
+        return traces
+
+    def finish(self, **extra: Any) -> str:
+        layout: Dict[str, Any] = {
+            "xaxis": {"title": {"text": self.x}},
+            "yaxis": {"title": {"text": self.values[0] if len(self.values) == 1 else ""}},
+        }
+        if self.chart_type == "pie":
+            layout = {}
+        if self.series and self.chart_type == "bar":
+            layout["barmode"] = "group"
+        return dumps({"data": self.traces(), "layout": layout, **extra})
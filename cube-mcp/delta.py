@@ -0,0 +1,356 @@
+"""
+Per-bucket cache for time-series REST queries
+
+A /v1/load query over one time dimension with a granularity and a date
+range returns one group of rows per time bucket, and each
+bucket's rows do not depend on the rest of the range. Rows are kept per
+bucket, so a query whose range moves forward (e.g. the last 30 days by
+day, asked again tomorrow) is answered from the buckets already known
+plus a query for the new or still open ones. Relative ranges ("last 30
+days", "this month") are resolved to dates in the query's timezone first,
+the way Cube resolves them.
+"""
+
+import collections
+import datetime
+import json
+import re
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from cache import canonical_query
+
+GRANULARITIES = ("day", "week", "month", "quarter", "year")
+
+# Range bounds covering whole days: a date, or a timestamp at the start
+# (for the first bound) or end (for the second) of its day.
+_START = re.compile(r"^(\d{4}-\d{2}-\d{2})(?:T00:00(?::00(?:\.0+)?)?Z?)?$")
+_END = re.compile(r"^(\d{4}-\d{2}-\d{2})(?:T23:59(?::59(?:\.9+)?)?Z?)?$")
+
+# Relative ranges: "today", "this month", "last week", "last 7 days".
+_RELATIVE = re.compile(r"^(?:(today|yesterday)|(this|last)\s+(?:(\d+)\s+)?(day|week|month|quarter|year)s?)$")
+
+# Query fields the per-bucket split cannot preserve.
+_UNSUPPORTED_FIELDS = ("limit", "offset", "total", "ungrouped", "renewQuery")
+
+# Cube's default row limit, which also caps queries sent without a limit.
+DEFAULT_ROW_LIMIT = 10000
+
+# Contiguous ranges of missing buckets fetched as separate queries; more
+# than this and the whole span between them is fetched at once.
+_MAX_FETCH_RANGES = 4
+
+
+def bucket_start(day: datetime.date, granularity: str) -> datetime.date:
+    if granularity == "day":
+        return day
+    if granularity == "week":
+        # Cube's weeks start on Monday.
+        return day - datetime.timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    if granularity == "quarter":
+        return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+    return day.replace(month=1, day=1)
+
+
+def shift_buckets(start: datetime.date, granularity: str, count: int) -> datetime.date:
+    """The start of the bucket ``count`` buckets after (or before) the one starting at ``start``."""
+    if granularity == "day":
+        return start + datetime.timedelta(days=count)
+    if granularity == "week":
+        return start + datetime.timedelta(days=7 * count)
+    month = start.month - 1 + count * {"month": 1, "quarter": 3, "year": 12}[granularity]
+    return start.replace(year=start.year + month // 12, month=month % 12 + 1, day=1)
+
+
+def next_bucket(start: datetime.date, granularity: str) -> datetime.date:
+    return shift_buckets(start, granularity, 1)
+
+
+def resolve_relative(date_range: str, today: datetime.date) -> Optional[Tuple[datetime.date, datetime.date]]:
+    """First and last day of a relative ``date_range`` as of ``today``, or None if it is not one.
+
+    As in Cube, "last N <unit>s" ends with the unit before the current one
+    and "this <unit>" covers the whole current unit.
+    """
+    match = _RELATIVE.match(date_range.strip().lower())
+    if not match:
+        return None
+    day, which, count, unit = match.groups()
+    if day is not None:
+        first = today if day == "today" else today - datetime.timedelta(days=1)
+        return first, first
+    current = bucket_start(today, unit)
+    if which == "this":
+        if count is not None:
+            return None
+        return current, next_bucket(current, unit) - datetime.timedelta(days=1)
+    n = int(count) if count is not None else 1
+    if n < 1:
+        return None
+    return shift_buckets(current, unit, -n), current - datetime.timedelta(days=1)
+
+
+class SeriesQuery:
+    """A query the cache can split into buckets; see ``parse``."""
+
+    def __init__(self, query: Dict[str, Any], series: str, dimension: str, granularity: str,
+                 start: datetime.date, end: datetime.date, timezone: str):
+        self.query = query
+        self.series = series
+        self.granularity = granularity
+        # Key of the bucket value in result rows, e.g. "Orders.createdAt.day".
+        self.column = f"{dimension}.{granularity}"
+        self.start = start
+        self.end = end
+        self.timezone = timezone
+        self.buckets: List[datetime.date] = []
+        bucket = bucket_start(start, granularity)
+        while bucket <= end:
+            self.buckets.append(bucket)
+            bucket = next_bucket(bucket, granularity)
+
+    def partial(self, bucket: datetime.date) -> bool:
+        """Whether the range covers only part of ``bucket``."""
+        return bucket < self.start or next_bucket(bucket, self.granularity) - datetime.timedelta(days=1) > self.end
+
+    def subquery(self, first: datetime.date, last: datetime.date, limit: Optional[int] = None) -> Dict[str, Any]:
+        """The query restricted to the buckets from ``first`` to ``last``, with ``limit`` rows at most."""
+        start = max(first, self.start)
+        end = min(next_bucket(last, self.granularity) - datetime.timedelta(days=1), self.end)
+        td = dict(self.query["timeDimensions"][0])
+        td["dateRange"] = [start.isoformat(), end.isoformat()]
+        query = {**self.query, "timeDimensions": [td]}
+        if limit is not None:
+            query["limit"] = limit
+        return query
+
+    @staticmethod
+    def parse(query: Dict[str, Any], cumulative: Iterable[str] = (),
+              today: Optional[datetime.date] = None) -> Optional["SeriesQuery"]:
+        """The bucketed form of ``query``, or None if it cannot be split into buckets.
+
+        That takes exactly one time dimension with a granularity from
+        ``GRANULARITIES`` and a range of whole days (relative ranges are
+        resolved as of ``today``, by default the current date in the
+        query's timezone), no limit or offset, no order other than by the
+        time dimension and no ``cumulative`` (rolling window) measures,
+        whose values depend on rows outside their bucket.
+        """
+        tds = query.get("timeDimensions")
+        if not isinstance(tds, list) or len(tds) != 1 or not isinstance(tds[0], dict):
+            return None
+        td = tds[0]
+        dimension, granularity, date_range = td.get("dimension"), td.get("granularity"), td.get("dateRange")
+        if granularity not in GRANULARITIES or not isinstance(dimension, str):
+            return None
+        if any(field in query for field in _UNSUPPORTED_FIELDS):
+            return None
+        if set(query.get("measures") or []) & set(cumulative):
+            return None
+        order = query.get("order") or {}
+        keys = [key for key, _ in (order.items() if isinstance(order, dict) else order)]
+        if any(key not in (dimension, f"{dimension}.{granularity}") for key in keys):
+            return None
+        timezone = query.get("timezone") or "UTC"
+        if isinstance(date_range, str):
+            if today is None:
+                try:
+                    today = datetime.datetime.now(ZoneInfo(timezone)).date()
+                except (ZoneInfoNotFoundError, ValueError):
+                    return None
+            days = resolve_relative(date_range, today)
+            if days is None:
+                return None
+            start_day, end_day = days
+        else:
+            if not isinstance(date_range, list) or len(date_range) != 2:
+                return None
+            start = _START.match(str(date_range[0]))
+            end = _END.match(str(date_range[1]))
+            if not start or not end:
+                return None
+            try:
+                start_day = datetime.date.fromisoformat(start.group(1))
+                end_day = datetime.date.fromisoformat(end.group(1))
+            except ValueError:
+                return None
+        if end_day < start_day:
+            return None
+
+        # The series is the query without its range and order: all of its
+        # ranges share buckets, and the order is applied when merging.
+        series = canonical_query({
+            **{key: value for key, value in query.items() if key != "order"},
+            "timeDimensions": [{key: value for key, value in td.items() if key != "dateRange"}],
+        })
+        return SeriesQuery(query, series, dimension, granularity, start_day, end_day, timezone)
+
+
+class _Series:
+    __slots__ = ("buckets", "template", "bytes")
+
+    def __init__(self) -> None:
+        # Bucket start -> (time stored, rows, encoded size of the rows).
+        self.buckets: Dict[datetime.date, Tuple[float, List[Dict[str, Any]], int]] = {}
+        self.bytes = 0
+        # Last response without its rows, for answers made of cached buckets only.
+        self.template: Dict[str, Any] = {}
+
+
+class TimeSeriesCache:
+    """Rows of time-series queries per bucket, for ``max_series`` series and ``max_bytes`` at most.
+
+    A bucket is stored once it has ended and ``settle`` more seconds have
+    passed (late data may still arrive until then), and reused for ``ttl``
+    seconds. Open, unsettled and partially covered buckets are fetched
+    every time. Ranges are fetched with ``row_limit`` rows at most; a
+    response that reaches it may be cut short, so it is not split.
+    """
+
+    def __init__(self, ttl: float = 3600.0, settle: float = 3600.0, max_series: int = 256,
+                 max_bytes: int = 32 * 1024 * 1024, row_limit: int = DEFAULT_ROW_LIMIT):
+        self.ttl = ttl
+        self.settle = settle
+        self.max_series = max_series
+        self.max_bytes = max_bytes
+        self.row_limit = row_limit
+        self._series: "collections.OrderedDict[str, _Series]" = collections.OrderedDict()
+        self._bytes = 0
+        self.stats = {
+            "hits": 0,
+            "partial_hits": 0,
+            "misses": 0,
+            "buckets_reused": 0,
+            "buckets_fetched": 0,
+            "evictions": 0,
+            "invalidations": 0,
+            "overflows": 0,
+        }
+
+    def _final(self, sq: SeriesQuery, bucket: datetime.date) -> bool:
+        try:
+            tz = ZoneInfo(sq.timezone)
+        except (ZoneInfoNotFoundError, ValueError):
+            return False
+        end = datetime.datetime.combine(next_bucket(bucket, sq.granularity), datetime.time(), tzinfo=tz)
+        return (datetime.datetime.now(tz) - end).total_seconds() >= self.settle
+
+    def missing(self, sq: SeriesQuery) -> List[datetime.date]:
+        """Buckets of ``sq`` that have to be fetched."""
+        series = self._series.get(sq.series)
+        now = time.monotonic()
+        missing = []
+        for bucket in sq.buckets:
+            entry = series.buckets.get(bucket) if series is not None else None
+            if entry is None or now - entry[0] >= self.ttl or sq.partial(bucket):
+                missing.append(bucket)
+        return missing
+
+    def fetch_ranges(self, sq: SeriesQuery, missing: List[datetime.date]) -> List[Tuple[datetime.date, datetime.date]]:
+        """Group ``missing`` buckets into ``(first, last)`` ranges to fetch one query each."""
+        ranges: List[List[datetime.date]] = []
+        index = {bucket: i for i, bucket in enumerate(sq.buckets)}
+        for bucket in missing:
+            if ranges and index[bucket] == index[ranges[-1][1]] + 1:
+                ranges[-1][1] = bucket
+            else:
+                ranges.append([bucket, bucket])
+        if len(ranges) > _MAX_FETCH_RANGES:
+            return [(missing[0], missing[-1])]
+        return [(first, last) for first, last in ranges]
+
+    def merge(self, sq: SeriesQuery, fetched: List[Tuple[Tuple[datetime.date, datetime.date], Dict[str, Any]]]
+              ) -> Optional[Dict[str, Any]]:
+        """Store the ``fetched`` responses per range and assemble the answer to ``sq``.
+
+        Returns None if a response has rows without a bucket value, which
+        cannot be split, reaches ``row_limit`` rows, so may be incomplete,
+        or a cached bucket was evicted meanwhile.
+        """
+        rows_by_bucket: Dict[datetime.date, List[Dict[str, Any]]] = {}
+        for (first, last), response in fetched:
+            if len(response.get("data", [])) >= self.row_limit:
+                self.stats["overflows"] += 1
+                return None
+            for bucket in sq.buckets[sq.buckets.index(first):sq.buckets.index(last) + 1]:
+                rows_by_bucket[bucket] = []
+            for row in response.get("data", []):
+                value = row.get(sq.column)
+                if not isinstance(value, str):
+                    return None
+                try:
+                    bucket = bucket_start(datetime.date.fromisoformat(value[:10]), sq.granularity)
+                except ValueError:
+                    return None
+                rows_by_bucket.setdefault(bucket, []).append(row)
+
+        series = self._series.get(sq.series)
+        if series is None:
+            series = self._series[sq.series] = _Series()
+            while len(self._series) > self.max_series:
+                self._evict()
+        self._series.move_to_end(sq.series)
+        parts = []
+        for bucket in sq.buckets:
+            if bucket in rows_by_bucket:
+                parts.append(rows_by_bucket[bucket])
+            elif bucket in series.buckets:
+                parts.append(series.buckets[bucket][1])
+            else:
+                # Evicted while its neighbours were fetched.
+                return None
+
+        now = time.monotonic()
+        for bucket, rows in rows_by_bucket.items():
+            if not sq.partial(bucket) and self._final(sq, bucket):
+                size = len(json.dumps(rows, separators=(",", ":"), default=str).encode())
+                old = series.buckets.get(bucket)
+                if old is not None:
+                    series.bytes -= old[2]
+                    self._bytes -= old[2]
+                series.buckets[bucket] = (now, rows, size)
+                series.bytes += size
+                self._bytes += size
+        while self._bytes > self.max_bytes and self._series:
+            # Least recently used first; the series just answered goes last.
+            self._evict()
+        if fetched:
+            series.template = {key: value for key, value in fetched[-1][1].items() if key != "data"}
+            self.stats["partial_hits" if len(rows_by_bucket) < len(sq.buckets) else "misses"] += 1
+        else:
+            self.stats["hits"] += 1
+        self.stats["buckets_fetched"] += len(rows_by_bucket)
+        self.stats["buckets_reused"] += len(sq.buckets) - len(rows_by_bucket)
+
+        order = sq.query.get("order") or {}
+        directions = [d for _, d in (order.items() if isinstance(order, dict) else order)]
+        if directions and directions[0] == "desc":
+            parts.reverse()
+        result = dict(series.template)
+        if isinstance(result.get("query"), dict):
+            result["query"] = {**result["query"], "timeDimensions": sq.query["timeDimensions"]}
+        result["data"] = [row for rows in parts for row in rows]
+        return result
+
+    def _evict(self) -> None:
+        _, series = self._series.popitem(last=False)
+        self._bytes -= series.bytes
+        self.stats["evictions"] += 1
+
+    def invalidate(self) -> None:
+        self.stats["invalidations"] += 1
+        self._series.clear()
+        self._bytes = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "series": len(self._series),
+            "buckets": sum(len(series.buckets) for series in self._series.values()),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+        }
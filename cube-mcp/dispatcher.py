@@ -0,0 +1,355 @@
+"""
+Front dispatcher for running the MCP server in several worker processes
+
+The MCP SSE transport keeps a session in the memory of the process that
+opened its /sse stream, so the messages a client posts must reach that
+same process. Each worker advertises its own message endpoint,
+``/w<N>/messages/``, so posts are routed by path prefix without tracking
+session ids. New SSE streams go to the worker with the fewest open ones.
+Streamable HTTP requests on /mcp are stateless and go to the worker with
+the fewest in flight.
+"""
+
+import asyncio
+import contextlib
+import logging
+import multiprocessing
+import os
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.background import BackgroundTask
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+import uvicorn
+
+from metrics import gauges_from_stats
+
+logger = logging.getLogger(__name__)
+
+# Hop-by-hop and framing headers that must not be copied between connections.
+_SKIP_HEADERS = {"host", "connection", "keep-alive", "transfer-encoding", "content-length", "upgrade"}
+
+
+def worker_prefix(index: int) -> str:
+    """Path prefix of the message endpoint of worker ``index``."""
+    return f"/w{index}"
+
+
+def _add_label(line: str, name: str, value: str) -> str:
+    space = line.find(" ")
+    brace = line.find("{")
+    if brace != -1 and brace < space:
+        return f'{line[:brace + 1]}{name}="{value}",{line[brace + 1:]}'
+    return f'{line[:space]}{{{name}="{value}"}}{line[space:]}'
+
+
+def merge_metrics(texts: Sequence[Tuple[str, str]]) -> str:
+    """Merge the Prometheus text of several workers, labelling every sample with its worker."""
+    families: Dict[str, List[str]] = {}
+    headers: Dict[str, List[str]] = {}
+    for worker, text in texts:
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# "):
+                family = line.split(" ", 3)[2]
+                headers.setdefault(family, [])
+                families.setdefault(family, [])
+                if line not in headers[family]:
+                    headers[family].append(line)
+            elif line.strip() and family is not None:
+                families[family].append(_add_label(line, "worker", worker))
+    lines: List[str] = []
+    for family, samples in families.items():
+        lines.extend(headers[family])
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+def _forward_headers(headers: Any) -> Dict[str, str]:
+    return {key: value for key, value in headers.items() if key.lower() not in _SKIP_HEADERS}
+
+
+class _SSEProxy:
+    """ASGI app relaying an /sse stream from the least busy worker."""
+
+    def __init__(self, dispatcher: "Dispatcher"):
+        self.dispatcher = dispatcher
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        dispatcher = self.dispatcher
+        index = min(range(dispatcher.workers), key=lambda i: dispatcher.streams[i])
+        # Count the stream before connecting so concurrent sessions spread out.
+        dispatcher.streams[index] += 1
+        client = dispatcher.clients[index]
+        request = Request(scope, receive)
+        upstream = client.build_request(
+            "GET", "/sse", params=request.query_params, headers=_forward_headers(request.headers)
+        )
+        try:
+            response = await client.send(upstream, stream=True)
+        except httpx.TransportError as e:
+            dispatcher.streams[index] -= 1
+            dispatcher.stats["worker_errors"] += 1
+            logger.warning(f"Worker {index} unavailable for a new SSE session: {e}")
+            await PlainTextResponse(f"Worker {index} unavailable", status_code=502)(scope, receive, send)
+            return
+
+        dispatcher.stats["sse_sessions"] += 1
+        logger.info(f"SSE session assigned to worker {index}")
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": [(k.encode(), v.encode()) for k, v in _forward_headers(response.headers).items()],
+            })
+
+            async def pump() -> None:
+                async for chunk in response.aiter_raw():
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+
+            async def watch() -> None:
+                while (await receive())["type"] != "http.disconnect":
+                    pass
+
+            tasks = {asyncio.ensure_future(pump()), asyncio.ensure_future(watch())}
+            try:
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                # Either side going away ends the relay; closing the upstream
+                # stream ends the session on the worker.
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+            with contextlib.suppress(Exception):
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            dispatcher.streams[index] -= 1
+            await response.aclose()
+
+
+class Dispatcher:
+    """Runs ``workers`` server processes and routes client traffic to them.
+
+    ``target(index, socket_path)`` is run in each worker process and must
+    serve the MCP app on the Unix socket ``socket_path``, with its message
+    endpoint under ``worker_prefix(index)``. Workers that exit are
+    restarted; their open sessions are lost.
+    """
+
+    def __init__(self, workers: int, target: Callable[[int, str], None], runtime_dir: str):
+        self.workers = workers
+        self.target = target
+        self.runtime_dir = runtime_dir
+        self.sockets = [os.path.join(runtime_dir, f"worker-{i}.sock") for i in range(workers)]
+        self.clients: List[httpx.AsyncClient] = []
+        # Open SSE streams and in-flight /mcp requests per worker.
+        self.streams = [0] * workers
+        self.requests = [0] * workers
+        self._processes: List[Optional[multiprocessing.process.BaseProcess]] = [None] * workers
+        self._monitor_task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.stats = {
+            "sse_sessions": 0,
+            "messages": 0,
+            "http_requests": 0,
+            "restarts": 0,
+            "worker_errors": 0,
+        }
+
+    def _spawn(self, index: int) -> None:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.sockets[index])
+        process = multiprocessing.get_context("spawn").Process(
+            target=self.target, args=(index, self.sockets[index]), name=f"cubejs-mcp-worker-{index}"
+        )
+        process.start()
+        self._processes[index] = process
+        logger.info(f"Started worker {index} (pid {process.pid})")
+
+    async def _wait_ready(self, index: int, timeout: float = 60.0) -> None:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                await self.clients[index].get("/stats")
+                return
+            except httpx.TransportError:
+                process = self._processes[index]
+                if process is None or not process.is_alive():
+                    raise RuntimeError(f"Worker {index} exited during startup")
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Worker {index} did not start within {timeout:g}s")
+                await asyncio.sleep(0.1)
+
+    async def start(self) -> None:
+        self.clients = [
+            httpx.AsyncClient(
+                transport=httpx.AsyncHTTPTransport(uds=path),
+                base_url="http://worker",
+                # SSE streams stay open indefinitely, each holding a connection.
+                timeout=httpx.Timeout(30.0, read=None),
+                limits=httpx.Limits(max_connections=None, max_keepalive_connections=20),
+            )
+            for path in self.sockets
+        ]
+        for index in range(self.workers):
+            self._spawn(index)
+        await asyncio.gather(*(self._wait_ready(index) for index in range(self.workers)))
+        self._monitor_task = asyncio.create_task(self._monitor())
+        logger.info(f"{self.workers} workers ready")
+
+    async def _monitor(self) -> None:
+        while True:
+            await asyncio.sleep(1.0)
+            for index, process in enumerate(self._processes):
+                if self._stopping or process is None or process.is_alive():
+                    continue
+                logger.warning(f"Worker {index} exited with code {process.exitcode}, restarting it")
+                self.stats["restarts"] += 1
+                self._spawn(index)
+
+    async def stop(self) -> None:
+        self._stopping = True
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._monitor_task
+        for process in self._processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        loop = asyncio.get_running_loop()
+        for process in self._processes:
+            if process is None:
+                continue
+            await loop.run_in_executor(None, process.join, 10)
+            if process.is_alive():
+                process.kill()
+        for client in self.clients:
+            await client.aclose()
+
+    async def _each(self, method: str, path: str) -> List[Any]:
+        """Send a request to every worker; a worker's entry is its response or the error."""
+        return await asyncio.gather(
+            *(client.request(method, path) for client in self.clients), return_exceptions=True
+        )
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "workers": self.workers,
+            "alive": sum(1 for p in self._processes if p is not None and p.is_alive()),
+            "open_streams": sum(self.streams),
+            "http_in_flight": sum(self.requests),
+        }
+
+    def create_app(self) -> Starlette:
+        async def handle_message(request: Request) -> Response:
+            index = request.path_params["index"]
+            if index >= self.workers:
+                return PlainTextResponse("Unknown worker", status_code=404)
+            self.stats["messages"] += 1
+            try:
+                response = await self.clients[index].post(
+                    f"{worker_prefix(index)}/messages/",
+                    params=request.query_params,
+                    content=await request.body(),
+                    headers=_forward_headers(request.headers),
+                )
+            except httpx.TransportError as e:
+                self.stats["worker_errors"] += 1
+                logger.warning(f"Worker {index} unavailable for a message: {e}")
+                return PlainTextResponse(f"Worker {index} unavailable", status_code=502)
+            return Response(response.content, status_code=response.status_code,
+                            headers=_forward_headers(response.headers))
+
+        async def handle_mcp(request: Request) -> Response:
+            index = min(range(self.workers), key=lambda i: self.requests[i])
+            self.requests[index] += 1
+            self.stats["http_requests"] += 1
+            client = self.clients[index]
+            upstream = client.build_request(
+                request.method, "/mcp", content=await request.body(), headers=_forward_headers(request.headers)
+            )
+            try:
+                response = await client.send(upstream, stream=True)
+            except httpx.TransportError as e:
+                self.requests[index] -= 1
+                self.stats["worker_errors"] += 1
+                logger.warning(f"Worker {index} unavailable for an /mcp request: {e}")
+                return PlainTextResponse(f"Worker {index} unavailable", status_code=502)
+
+            async def close() -> None:
+                self.requests[index] -= 1
+                await response.aclose()
+
+            # Relayed as it arrives, so batch responses streamed as events reach the client early.
+            return StreamingResponse(response.aiter_raw(), status_code=response.status_code,
+                                     headers=_forward_headers(response.headers), background=BackgroundTask(close))
+
+        async def handle_stats(request: Request) -> JSONResponse:
+            workers = []
+            for response in await self._each("GET", "/stats"):
+                if isinstance(response, Exception):
+                    workers.append({"error": str(response)})
+                else:
+                    workers.append(response.json())
+            return JSONResponse({"dispatcher": self.snapshot(), "workers": workers})
+
+        async def handle_metrics(request: Request) -> PlainTextResponse:
+            texts = [
+                (str(index), response.text)
+                for index, response in enumerate(await self._each("GET", "/metrics"))
+                if not isinstance(response, Exception)
+            ]
+            own = "\n".join(
+                line
+                for gauge in gauges_from_stats("cubejs_mcp_dispatcher", "Worker dispatcher", self.snapshot())
+                for line in gauge.render()
+            )
+            return PlainTextResponse(f"{own}\n{merge_metrics(texts)}", media_type="text/plain; version=0.0.4")
+
+        async def handle_invalidate(request: Request) -> JSONResponse:
+            responses = await self._each("POST", "/cache/invalidate")
+            failed = sum(1 for r in responses if isinstance(r, Exception) or r.status_code != 200)
+            logger.info(f"Caches invalidated on {len(responses) - failed} of {len(responses)} workers")
+            invalidated: List[str] = []
+            for response in responses:
+                if not isinstance(response, Exception) and response.status_code == 200:
+                    invalidated += [name for name in response.json()["invalidated"] if name not in invalidated]
+            return JSONResponse({"invalidated": invalidated, "workers": len(responses) - failed,
+                                 "failed": failed})
+
+        @contextlib.asynccontextmanager
+        async def lifespan(app: Starlette) -> AsyncIterator[None]:
+            await self.start()
+            try:
+                yield
+            finally:
+                await self.stop()
+
+        return Starlette(
+            routes=[
+                Route("/sse", endpoint=_SSEProxy(self)),
+                Route("/w{index:int}/messages/", endpoint=handle_message, methods=["POST"]),
+                Route("/mcp", endpoint=handle_mcp, methods=["GET", "POST", "DELETE"]),
+                Route("/stats", endpoint=handle_stats),
+                Route("/metrics", endpoint=handle_metrics),
+                Route("/cache/invalidate", endpoint=handle_invalidate, methods=["POST"]),
+            ],
+            lifespan=lifespan,
+        )
+
+
+async def run_dispatcher(workers: int, port: int, target: Callable[[int, str], None],
+                         runtime_dir: str) -> None:
+    """Serve the dispatcher on ``port`` in front of ``workers`` worker processes.
+
+    Worker sockets are created in ``runtime_dir``.
+    """
+    logger.info(f"Starting dispatcher on port {port} with {workers} workers")
+    dispatcher = Dispatcher(workers, target, runtime_dir)
+    config = uvicorn.Config(dispatcher.create_app(), host="0.0.0.0", port=port, log_level="info")
+    await uvicorn.Server(config).serve()
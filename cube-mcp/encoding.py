@@ -0,0 +1,165 @@
+"""
+Result encoding for MCP tool outputs
+
+Uses orjson when it is installed and falls back to the standard library.
+Handles the Decimal/date/UUID values asyncpg returns.
+"""
+
+import base64
+import csv
+import datetime
+import decimal
+import io
+import json
+import math
+import uuid
+from typing import Any, Dict, List, Sequence
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None  # type: ignore[assignment]
+
+# "json" keeps the original indented row-of-objects shape.
+FORMATS = ("json", "columnar", "rows", "csv")
+
+
+def _default(o: Any) -> Any:
+    if isinstance(o, decimal.Decimal):
+        if not o.is_finite():
+            # NaN and +/-Infinity have no JSON form.
+            return None
+        return int(o) if o == o.to_integral_value() else float(o)
+    if isinstance(o, (datetime.datetime, datetime.date, datetime.time)):
+        return o.isoformat()
+    if isinstance(o, datetime.timedelta):
+        return o.total_seconds()
+    if isinstance(o, uuid.UUID):
+        return str(o)
+    if isinstance(o, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(o)).decode()
+    if isinstance(o, (set, frozenset)):
+        return list(o)
+    return str(o)
+
+
+def _finite(obj: Any) -> Any:
+    """``obj`` with NaN and +/-Infinity floats replaced by None, as orjson writes them."""
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(value) for value in obj]
+    return obj
+
+
+def dumps(obj: Any, indent: bool = False) -> str:
+    """Serialize ``obj`` to JSON text, compact unless ``indent`` is set."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, default=_default, option=option).decode()
+        except TypeError:
+            # e.g. integers wider than 64 bits; the stdlib handles those.
+            pass
+    obj = _finite(obj)
+    if indent:
+        return json.dumps(obj, indent=2, default=_default, allow_nan=False)
+    return json.dumps(obj, separators=(",", ":"), default=_default, allow_nan=False)
+
+
+def check_format(fmt: str) -> str:
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format: {fmt}. Expected one of: {', '.join(FORMATS)}")
+    return fmt
+
+
+class ResultEncoder:
+    """Incrementally encode a tabular result in one of ``FORMATS``.
+
+    ``json``, ``rows`` and ``csv`` write each row into the output buffer as
+    it is added; ``columnar`` collects values per column and encodes them
+    once at the end. Extra top-level fields (row count, truncation, paging)
+    are passed to ``finish``.
+    """
+
+    def __init__(self, columns: Sequence[str], fmt: str = "json"):
+        self.columns = list(columns)
+        self.fmt = check_format(fmt)
+        self.count = 0
+        self._buf = io.StringIO()
+        self._values: List[List[Any]] = [[] for _ in self.columns]
+        if fmt == "csv":
+            self._csv = csv.writer(self._buf, lineterminator="\n")
+            self._csv.writerow(self.columns)
+
+    def add_row(self, values: Sequence[Any]) -> int:
+        """Add one row of values in column order; returns its encoded size."""
+        fmt = self.fmt
+        if fmt == "json":
+            encoded = dumps(dict(zip(self.columns, values)))
+            self._buf.write(",\n  " if self.count else "\n  ")
+            self._buf.write(encoded)
+        elif fmt == "rows":
+            encoded = dumps(list(values))
+            if self.count:
+                self._buf.write(",")
+            self._buf.write(encoded)
+        elif fmt == "csv":
+            start = self._buf.tell()
+            self._csv.writerow([plain_value(v) for v in values])
+            self.count += 1
+            return self._buf.tell() - start
+        else:
+            for column, value in zip(self._values, values):
+                column.append(value)
+            encoded = dumps(list(values))
+        self.count += 1
+        return len(encoded)
+
+    def add_rows(self, rows: Sequence[Sequence[Any]]) -> int:
+        return sum(self.add_row(row) for row in rows)
+
+    def finish(self, **extra: Any) -> str:
+        fmt = self.fmt
+        if fmt == "csv":
+            # Paging/truncation details go in a leading comment line.
+            header = "".join(f"# {key}: {dumps(value)}\n" for key, value in extra.items())
+            return header + self._buf.getvalue()
+
+        columns = dumps(self.columns)
+        if fmt == "json":
+            tail = "".join(f', "{key}": {dumps(value)}' for key, value in extra.items())
+            rows = self._buf.getvalue()
+            closing = "\n]" if rows else "]"
+            return f'{{"columns": {columns}, "data": [{rows}{closing}{tail}}}'
+
+        tail = "".join(f',"{key}":{dumps(value)}' for key, value in extra.items())
+        if fmt == "rows":
+            return f'{{"columns":{columns},"rows":[{self._buf.getvalue()}]{tail}}}'
+        data = dumps(dict(zip(self.columns, self._values)))
+        return f'{{"columns":{columns},"data":{data}{tail}}}'
+
+
+def encode_rows(columns: Sequence[str], rows: Sequence[Sequence[Any]], fmt: str,
+                **extra: Any) -> str:
+    """Encode a complete tabular result in one call."""
+    encoder = ResultEncoder(columns, fmt)
+    encoder.add_rows(rows)
+    return encoder.finish(**extra)
+
+
+def encode_records(records: Sequence[Dict[str, Any]], fmt: str, **extra: Any) -> str:
+    """Encode a list of row objects, taking the columns from the first row."""
+    columns = list(records[0].keys()) if records else []
+    return encode_rows(columns, [[r.get(c) for c in columns] for r in records], fmt, **extra)
+
+
+def plain_value(value: Any) -> Any:
+    """Convert a database value to a plain JSON scalar (str, number or None)."""
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    return _default(value)
@@ -5,12 +5,20 @@ Exposes meta and load endpoints from CubeJS REST API via SSE
 """
 
 import asyncio
+import base64
+import contextlib
+import functools
+import hashlib
 import json
 import logging
+import shutil
 import sys
-from typing import Any, Dict, List, Optional
+import tempfile
+import time
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Dict, List, Optional, Tuple, Union, cast
 from urllib.parse import urljoin
 
+from anyio.streams.memory import MemoryObjectSendStream
 import asyncpg
 import httpx
 from mcp.server import Server
@@ -18,17 +26,83 @@ from mcp.server.sse import SseServerTransport
 # No specific MCP types needed for handlers
 from starlette.applications import Starlette
 from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse
 from starlette.routing import Mount, Route
+from starlette.types import Message
 import uvicorn
 
+from cache import MetaCache, ResultCache, canonical_query, canonical_sql
+from chart import AGGREGATIONS, CHART_TYPES, GRANULARITIES, ChartBuilder
+from delta import DEFAULT_ROW_LIMIT, SeriesQuery, TimeSeriesCache
+from dispatcher import run_dispatcher, worker_prefix
+from encoding import FORMATS, ResultEncoder, check_format, dumps, encode_records, encode_rows
+from metrics import (
+    Counter, Histogram, Metrics, TracingWriteStream, bind_writer, current_writer, gauges_from_stats,
+    httpx_trace, record_stage, stage, upstream_wait,
+)
+from planner import Plan, Unsupported, has_order_by, plan_sql
+from reduce import REDUCE_STRATEGIES, ReducingEncoder, check_strategy, fit_rows, member_roles
+from resilience import (
+    ContinueWait, UpstreamPolicy, classify_cubesql, classify_http, is_continue_wait,
+)
+from scheduler import Scheduler
+from schema import MEMBER_KINDS, SchemaIndex
+from streamable_http import StatelessHTTPTransport
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Upstream each tool calls, for per-upstream concurrency limits.
+TOOL_UPSTREAMS = {
+    "cubejs_meta": "rest",
+    "cubejs_search_members": "rest",
+    "cubejs_load": "rest",
+    "cubejs_sql": "rest",
+    "cubejs_cubesql": "cubesql",
+    "cubejs_chart_data": "cubesql",
+}
+
+# Tools a cubejs_batch entry may run.
+BATCH_TOOLS = ("cubejs_load", "cubejs_sql", "cubejs_cubesql")
+
+# Tools a warm-up query may run.
+WARMUP_TOOLS = ("cubejs_load", "cubejs_sql", "cubejs_cubesql", "cubejs_chart_data")
+
 class CubeJSMCPServer:
     def __init__(self, base_url: str, api_token: Optional[str] = None, port: int = 8000, 
                  cubesql_host: str = "localhost", cubesql_port: int = 15432, 
-                 cubesql_user: str = "cubesql", cubesql_password: str = "cubesql"):
+                 cubesql_user: str = "cubesql", cubesql_password: str = "cubesql",
+                 cubesql_database: str = "cube",
+                 cubesql_pool_min_size: int = 1, cubesql_pool_max_size: int = 10,
+                 cubesql_pool_max_inactive_lifetime: float = 300.0,
+                 cubesql_pool_acquire_timeout: float = 15.0, cubesql_pool_check_idle: float = 30.0,
+                 cubesql_timeout: float = 15.0,
+                 http_max_connections: int = 100, http_max_keepalive_connections: int = 20,
+                 http_keepalive_expiry: float = 30.0, http2: bool = False,
+                 http_connect_timeout: float = 5.0,
+                 http_timeouts: Optional[Dict[str, float]] = None,
+                 meta_cache_ttl: float = 300.0, meta_refresh_interval: float = 240.0,
+                 result_cache_ttl: float = 60.0, result_cache_max_bytes: int = 64 * 1024 * 1024,
+                 result_cache_path: Optional[str] = None,
+                 result_cache_disk_max_bytes: int = 512 * 1024 * 1024,
+                 load_max_rows: int = 10000, load_max_bytes: int = 8 * 1024 * 1024,
+                 sql_max_rows: int = 10000, sql_max_bytes: int = 8 * 1024 * 1024,
+                 cubesql_fetch_batch_size: int = 500, cubesql_page_size: int = 1000,
+                 cubesql_max_rows: int = 10000, cubesql_max_bytes: int = 8 * 1024 * 1024,
+                 output_format: str = "json", trace_log: bool = False,
+                 max_concurrent_calls: int = 32, max_concurrent_rest_calls: int = 16,
+                 max_concurrent_cubesql_calls: Optional[int] = None,
+                 max_queued_calls: int = 100, queue_timeout: float = 30.0,
+                 batch_max_queries: int = 20, batch_max_parallel: int = 4,
+                 reduce_strategy: str = "auto", reduce_scan_rows: int = 100000,
+                 sql_planner: bool = True, warmup: bool = True,
+                 warmup_queries: Optional[List[Dict[str, Any]]] = None, warmup_timeout: float = 30.0,
+                 prefetch_meta: bool = True, upstream_retries: int = 2, upstream_backoff: float = 0.1,
+                 upstream_backoff_max: float = 2.0, hedge_requests: bool = False,
+                 breaker_failure_threshold: int = 5, breaker_reset_timeout: float = 30.0,
+                 delta_cache_ttl: float = 3600.0, delta_settle: float = 3600.0, delta_max_series: int = 256,
+                 delta_max_bytes: int = 32 * 1024 * 1024, delta_row_limit: int = DEFAULT_ROW_LIMIT):
         self.base_url = base_url.rstrip('/')
         self.api_token = api_token
         self.port = port
@@ -36,6 +110,168 @@ class CubeJSMCPServer:
         self.cubesql_port = cubesql_port
         self.cubesql_user = cubesql_user
         self.cubesql_password = cubesql_password
+        self.cubesql_database = cubesql_database
+        self.cubesql_pool_min_size = cubesql_pool_min_size
+        self.cubesql_pool_max_size = cubesql_pool_max_size
+        self.cubesql_pool_max_inactive_lifetime = cubesql_pool_max_inactive_lifetime
+        self.cubesql_pool_acquire_timeout = cubesql_pool_acquire_timeout
+        # Acquired connections are only checked after the pool sat idle this long.
+        self.cubesql_pool_check_idle = cubesql_pool_check_idle
+        # Connect, prepare and per-batch fetch timeout of CubeSQL calls.
+        self.cubesql_timeout = cubesql_timeout
+        self.http_max_connections = http_max_connections
+        self.http_max_keepalive_connections = http_max_keepalive_connections
+        self.http_keepalive_expiry = http_keepalive_expiry
+        self.http2 = http2
+        self.http_connect_timeout = http_connect_timeout
+        # Read timeout per Cube REST endpoint; meta is cheap, load/SQL can
+        # wait on the warehouse.
+        self.http_timeouts = {"v1/meta": 10.0, "v1/load": 60.0, "v1/cubesql": 120.0}
+        self.http_timeouts.update(http_timeouts or {})
+        self._http_client: Optional[httpx.AsyncClient] = None
+        # Caps on rows read from the SQL API stream; 0 means unlimited.
+        self.load_max_rows = load_max_rows
+        self.load_max_bytes = load_max_bytes
+        self.sql_max_rows = sql_max_rows
+        self.sql_max_bytes = sql_max_bytes
+        self._cubesql_pool: Optional[asyncpg.Pool] = None
+        self.cubesql_fetch_batch_size = cubesql_fetch_batch_size
+        self.cubesql_page_size = cubesql_page_size
+        # Hard budget for a single cubejs_cubesql response; 0 means unlimited.
+        self.cubesql_max_rows = cubesql_max_rows
+        self.cubesql_max_bytes = cubesql_max_bytes
+        self.meta_cache = MetaCache(
+            self._fetch_meta,
+            self._serialize_meta,
+            ttl=meta_cache_ttl,
+            refresh_interval=meta_refresh_interval,
+            on_change=self._on_meta_change,
+        )
+        # Index of the current schema for local query validation, member
+        # search and the SQL planner; rebuilt whenever the schema changes.
+        self.schema_index: Optional[SchemaIndex] = None
+        self._schema_stats = {"rebuilds": 0, "rejected_queries": 0}
+        self.result_cache = ResultCache(
+            ttl=result_cache_ttl,
+            max_bytes=result_cache_max_bytes,
+            disk_path=result_cache_path,
+            disk_max_bytes=result_cache_disk_max_bytes,
+        )
+        # Rows of bucketed time-series loads per time bucket, so a moved date
+        # range only fetches the buckets not seen yet; a ttl of 0 disables it.
+        self.delta_cache = (
+            TimeSeriesCache(ttl=delta_cache_ttl, settle=delta_settle, max_series=delta_max_series,
+                            max_bytes=delta_max_bytes, row_limit=delta_row_limit)
+            if delta_cache_ttl > 0 else None
+        )
+        self._cubesql_pool_lock = asyncio.Lock()
+        self._cubesql_last_release = time.monotonic()
+        self._cubesql_pool_stats = {
+            "acquired": 0,
+            "waiting": 0,
+            "timeouts": 0,
+            "health_checks": 0,
+            "health_check_failures": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+        }
+        # Default result encoding; tools accept a per-call "format" override.
+        self.output_format = check_format(output_format)
+        # What to do with results over their row/byte budget: "auto" downsamples
+        # and summarizes up to reduce_scan_rows rows, "truncate" cuts them off.
+        self.reduce_strategy = check_strategy(reduce_strategy)
+        self.reduce_scan_rows = reduce_scan_rows
+        self.batch_max_queries = batch_max_queries
+        self.batch_max_parallel = batch_max_parallel
+        # Route cubejs_cubesql statements that map onto cube members through /v1/load.
+        self.sql_planner = sql_planner
+        self._planner_stats = {
+            "planned": 0,
+            "unsupported": 0,
+            "rest_errors": 0,
+            "overflows": 0,
+        }
+        # Connect upstream, fetch the schema and run warmup_queries (tool
+        # arguments plus "tool") on startup, so the first session starts warm.
+        self.warmup = warmup
+        self.warmup_queries = [self._check_warmup_query(q) for q in warmup_queries or []]
+        self.warmup_timeout = warmup_timeout
+        # Refresh stale metadata in the background when a session opens.
+        self.prefetch_meta = prefetch_meta
+        self._prefetch_task: Optional[asyncio.Task] = None
+        self._warmup_stats = {
+            "duration_seconds": 0.0,
+            "meta": False,
+            "queries": 0,
+            "query_errors": 0,
+            "timed_out": False,
+            "prefetches": 0,
+            "prefetch_errors": 0,
+        }
+        # Tool calls past the concurrency caps wait here, round-robin across sessions.
+        self.scheduler = Scheduler(
+            max_concurrency=max_concurrent_calls,
+            upstream_limits={
+                "rest": max_concurrent_rest_calls,
+                "cubesql": (max_concurrent_cubesql_calls if max_concurrent_cubesql_calls is not None
+                            else cubesql_pool_max_size),
+            },
+            max_queue=max_queued_calls,
+            queue_timeout=queue_timeout,
+        )
+        self.metrics = Metrics(trace_log=trace_log)
+        self.metrics.add_collector(lambda: gauges_from_stats(
+            "cubejs_mcp_cubesql_pool", "CubeSQL connection pool", self.cubesql_pool_stats()))
+        self.metrics.add_collector(lambda: gauges_from_stats(
+            "cubejs_mcp_meta_cache", "Metadata cache", self.meta_cache.snapshot()))
+        self.metrics.add_collector(lambda: gauges_from_stats(
+            "cubejs_mcp_result_cache", "Result cache", self.result_cache.snapshot()))
+        delta_cache = self.delta_cache
+        if delta_cache is not None:
+            self.metrics.add_collector(lambda: gauges_from_stats(
+                "cubejs_mcp_delta_cache", "Time-series bucket cache", delta_cache.snapshot()))
+        self.metrics.add_collector(lambda: gauges_from_stats(
+            "cubejs_mcp_scheduler", "Tool call scheduler", self.scheduler.snapshot()))
+        self.metrics.add_collector(lambda: gauges_from_stats(
+            "cubejs_mcp_schema_index", "Schema index", self.schema_stats()))
+        self.metrics.add_collector(lambda: gauges_from_stats(
+            "cubejs_mcp_sql_planner", "CubeSQL query planner", self.planner_stats()))
+        self.metrics.add_collector(lambda: gauges_from_stats(
+            "cubejs_mcp_warmup", "Startup warm-up and metadata prefetch", self.warmup_stats()))
+        self.upstream_events = self.metrics.register(Counter(
+            "cubejs_mcp_upstream_events_total",
+            "Upstream retries, hedged requests, circuit breaker trips and rejections, and continue-wait polls",
+            ["upstream", "event", "reason"]))
+        # Retries, continue-wait polling, hedging and a circuit breaker per upstream.
+        self.upstreams = {
+            name: UpstreamPolicy(
+                title,
+                classify,
+                retries=upstream_retries,
+                backoff=upstream_backoff,
+                backoff_max=upstream_backoff_max,
+                failure_threshold=breaker_failure_threshold,
+                reset_timeout=breaker_reset_timeout,
+                hedge=hedge_requests,
+                on_event=functools.partial(self.upstream_events.inc, name),
+            )
+            for name, title, classify in (
+                ("rest", "Cube REST API", classify_http),
+                ("cubesql", "CubeSQL", classify_cubesql),
+            )
+        }
+        self.metrics.add_collector(lambda: [
+            gauge
+            for name, policy in self.upstreams.items()
+            for gauge in gauges_from_stats(
+                f"cubejs_mcp_upstream_{name}", f"Upstream policy for {policy.name}", policy.snapshot())
+        ])
+        self.cubesql_path_calls = self.metrics.register(Counter(
+            "cubejs_mcp_cubesql_path_total", "Full-mode cubejs_cubesql queries by the path that served them",
+            ["path"]))
+        self.cubesql_path_duration = self.metrics.register(Histogram(
+            "cubejs_mcp_cubesql_path_duration_seconds",
+            "Upstream fetch and encoding time of full-mode cubejs_cubesql queries by path", ["path"]))
         self.server = Server("cubejs-mcp-server")
         self._setup_handlers()
 
@@ -44,6 +280,23 @@ class CubeJSMCPServer:
         async def handle_list_tools():
             """List available CubeJS tools."""
             logger.info("Handling list_tools request")
+            format_schema = {
+                "type": "string",
+                "enum": list(FORMATS),
+                "description": (
+                    "Result encoding: 'json' (indented row objects), 'columnar' "
+                    "({columns, data: {column: values}}), 'rows' (compact row arrays) or 'csv'"
+                ),
+            }
+            reduce_schema = {
+                "type": "string",
+                "enum": list(REDUCE_STRATEGIES),
+                "description": (
+                    "What to do when the result exceeds the server's row/byte budget: 'auto' "
+                    "downsamples time series, keeps the top categories plus 'Other' and adds summary "
+                    "statistics; 'truncate' returns the first rows"
+                ),
+            }
             return [
                 {
                     "name": "cubejs_meta",
@@ -54,6 +307,36 @@ class CubeJSMCPServer:
                         "additionalProperties": False,
                     },
                 },
+                {
+                    "name": "cubejs_search_members",
+                    "description": (
+                        "Find measures, dimensions and segments by name, title or description; "
+                        "returns only the matching part of the schema"
+                    ),
+                    "inputSchema": {
+                        "type": "object",
+                        "properties": {
+                            "query": {
+                                "type": "string",
+                                "description": "Words to look for, e.g. 'survived' or 'Passenger.ag'; empty lists every member"
+                            },
+                            "kind": {
+                                "type": "string",
+                                "enum": list(MEMBER_KINDS),
+                                "description": "Only return members of this kind"
+                            },
+                            "cube": {
+                                "type": "string",
+                                "description": "Only return members of this cube"
+                            },
+                            "limit": {
+                                "type": "integer",
+                                "description": "Maximum number of members (default: 20)"
+                            },
+                        },
+                        "additionalProperties": False,
+                    },
+                },
                 {
                     "name": "cubejs_load",
                     "description": "Execute a CubeJS query to load data",
@@ -127,7 +410,9 @@ class CubeJSMCPServer:
                                     }
                                 },
                                 "additionalProperties": False
-                            }
+                            },
+                            "format": format_schema,
+                            "reduce": reduce_schema,
                         },
                         "required": ["query"],
                         "additionalProperties": False,
@@ -142,7 +427,9 @@ class CubeJSMCPServer:
                             "query": {
                                 "type": "string",
                                 "description": "SQL query to execute against the CubeJS data model"
-                            }
+                            },
+                            "format": format_schema,
+                            "reduce": reduce_schema,
                         },
                         "required": ["query"],
                         "additionalProperties": False,
@@ -157,12 +444,127 @@ class CubeJSMCPServer:
                             "query": {
                                 "type": "string",
                                 "description": "SQL query to execute directly against the CubeSQL PostgreSQL endpoint"
-                            }
+                            },
+                            "mode": {
+                                "type": "string",
+                                "enum": ["full", "paged"],
+                                "description": "'full' returns all rows up to the server's row/byte budget; 'paged' returns one page and a nextCursor token, and needs an ORDER BY"
+                            },
+                            "page_size": {
+                                "type": "integer",
+                                "minimum": 1,
+                                "description": "Rows per page in paged mode"
+                            },
+                            "cursor": {
+                                "type": "string",
+                                "description": "nextCursor token from a previous paged call with the same query"
+                            },
+                            "format": format_schema,
+                            "reduce": reduce_schema,
                         },
                         "required": ["query"],
                         "additionalProperties": False,
                     },
                 },
+                {
+                    "name": "cubejs_chart_data",
+                    "description": (
+                        "Run a SQL query against CubeSQL and return Plotly traces instead of rows: "
+                        "rows are pivoted into one trace per series (and value column), aggregated per x "
+                        "and optionally bucketed by time. Returns {data: [traces], layout} ready for "
+                        "Plotly.newPlot; only titles and styling remain to be added"
+                    ),
+                    "inputSchema": {
+                        "type": "object",
+                        "properties": {
+                            "query": {
+                                "type": "string",
+                                "description": "SQL query to execute against the CubeSQL PostgreSQL endpoint"
+                            },
+                            "x": {
+                                "type": "string",
+                                "description": "Column for the x axis (pie: the slice labels)"
+                            },
+                            "values": {
+                                "type": "array",
+                                "items": {"type": "string"},
+                                "minItems": 1,
+                                "description": "Numeric column(s) for the y axis; one trace per column"
+                            },
+                            "series": {
+                                "type": "string",
+                                "description": "Column whose distinct values split the data into separate traces"
+                            },
+                            "chart_type": {
+                                "type": "string",
+                                "enum": list(CHART_TYPES),
+                                "description": "Trace type (default: bar)"
+                            },
+                            "agg": {
+                                "type": "string",
+                                "enum": list(AGGREGATIONS),
+                                "description": "How rows sharing a trace and x are combined (default: sum)"
+                            },
+                            "granularity": {
+                                "type": "string",
+                                "enum": list(GRANULARITIES),
+                                "description": "Bucket a date/time x column to this granularity; buckets are sorted"
+                            },
+                            "fill": {
+                                "type": ["number", "null"],
+                                "description": "Value for x positions a trace has no data for (default: null, a gap)"
+                            },
+                        },
+                        "required": ["query", "x", "values"],
+                        "additionalProperties": False,
+                    },
+                },
+                {
+                    "name": "cubejs_batch",
+                    "description": (
+                        "Run several cubejs_load, cubejs_sql or cubejs_cubesql queries concurrently "
+                        "in one call, e.g. one query per chart trace. Returns a result or an error "
+                        "for each query, in order"
+                    ),
+                    "inputSchema": {
+                        "type": "object",
+                        "properties": {
+                            "queries": {
+                                "type": "array",
+                                "items": {
+                                    "type": "object",
+                                    "properties": {
+                                        "id": {
+                                            "type": "string",
+                                            "description": "Label echoed back with the result (default: the position in the list)"
+                                        },
+                                        "tool": {
+                                            "type": "string",
+                                            "enum": list(BATCH_TOOLS),
+                                            "description": "Tool to run the query with"
+                                        },
+                                        "query": {
+                                            "type": ["object", "string"],
+                                            "description": "CubeJS query object for cubejs_load, SQL text for cubejs_sql and cubejs_cubesql"
+                                        },
+                                    },
+                                    "required": ["tool", "query"],
+                                    "additionalProperties": False,
+                                },
+                                "minItems": 1,
+                                "maxItems": self.batch_max_queries,
+                                "description": "Queries to run"
+                            },
+                            "max_parallel": {
+                                "type": "integer",
+                                "description": f"Queries run at once (at most {self.batch_max_parallel})"
+                            },
+                            "format": format_schema,
+                        },
+                        "required": ["queries"],
+                        "additionalProperties": False,
+                    },
+                },
             ]
 
         @self.server.list_resources()
@@ -180,166 +582,995 @@ class CubeJSMCPServer:
         @self.server.call_tool()
         async def handle_call_tool(name: str, arguments: Dict[str, Any]):
             """Handle tool calls."""
-            logger.info(f"Handling call_tool request: {name}")
-            try:
-                if name == "cubejs_meta":
-                    return await self._get_meta()
-                elif name == "cubejs_load":
-                    query = arguments.get("query")
-                    if not query:
-                        raise ValueError("Query parameter is required")
-                    return await self._load_data(query)
-                elif name == "cubejs_sql":
-                    query = arguments.get("query")
-                    if not query:
-                        raise ValueError("Query parameter is required")
-                    return await self._execute_sql(query)
-                elif name == "cubejs_cubesql":
-                    query = arguments.get("query")
-                    if not query:
-                        raise ValueError("Query parameter is required")
-                    return await self._execute_cubesql(query)
-                else:
-                    raise ValueError(f"Unknown tool: {name}")
-            except Exception as e:
-                logger.error(f"Error handling tool call {name}: {e}")
-                return [{"type": "text", "text": f"Error: {str(e)}"}]
+            with self.metrics.trace_call(name) as trace:
+                logger.info(f"Handling call_tool request: {name} (trace_id={trace.trace_id})")
+                try:
+                    content = await self._call_tool(name, arguments)
+                except Exception as e:
+                    logger.error(f"Error handling tool call {name} (trace_id={trace.trace_id}): {e}")
+                    trace.error = str(e)
+                    content = [{"type": "text", "text": f"Error: {str(e)}"}]
+                trace.response_bytes = sum(len(c["text"].encode("utf-8")) for c in content)
+
+            # The SSE write happens after we return; the session's write
+            # stream records it and emits the trace.
+            writer = current_writer()
+            if writer is not None:
+                writer.expect(self.server.request_context.request_id, trace)
+            else:
+                self.metrics.finish_trace(trace)
+            return content
+
+    async def _call_tool(self, name: str, arguments: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Dispatch a tool call once the scheduler has a slot for it."""
+        if name == "cubejs_batch":
+            # Each query in the batch is scheduled on its own.
+            return await self._run_tool(name, arguments)
+        session = self.server.request_context.session
+        async with self.scheduler.slot(session, TOOL_UPSTREAMS.get(name, "rest")):
+            return await self._run_tool(name, arguments)
+
+    async def _run_tool(self, name: str, arguments: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Dispatch a tool call to its implementation."""
+        if name == "cubejs_meta":
+            return await self._get_meta()
+        elif name == "cubejs_search_members":
+            return await self._search_members(
+                arguments.get("query", ""),
+                kind=arguments.get("kind"),
+                cube=arguments.get("cube"),
+                limit=arguments.get("limit", 20),
+            )
+        elif name == "cubejs_load":
+            query = arguments.get("query")
+            if not query:
+                raise ValueError("Query parameter is required")
+            return await self._load_data(
+                query, self._output_format(arguments), self._reduce_strategy(arguments)
+            )
+        elif name == "cubejs_sql":
+            query = arguments.get("query")
+            if not query:
+                raise ValueError("Query parameter is required")
+            return await self._execute_sql(
+                query, self._output_format(arguments), self._reduce_strategy(arguments)
+            )
+        elif name == "cubejs_cubesql":
+            query = arguments.get("query")
+            if not query:
+                raise ValueError("Query parameter is required")
+            return await self._execute_cubesql(
+                query,
+                mode=arguments.get("mode", "full"),
+                page_size=arguments.get("page_size"),
+                cursor=arguments.get("cursor"),
+                fmt=self._output_format(arguments),
+                strategy=self._reduce_strategy(arguments),
+            )
+        elif name == "cubejs_chart_data":
+            query = arguments.get("query")
+            if not query:
+                raise ValueError("Query parameter is required")
+            if not arguments.get("x") or not arguments.get("values"):
+                raise ValueError("x and values parameters are required")
+            return await self._execute_chart_data(
+                query,
+                x=arguments["x"],
+                values=arguments["values"],
+                series=arguments.get("series"),
+                chart_type=arguments.get("chart_type", "bar"),
+                agg=arguments.get("agg", "sum"),
+                granularity=arguments.get("granularity"),
+                fill=arguments.get("fill"),
+            )
+        elif name == "cubejs_batch":
+            queries = arguments.get("queries")
+            if not queries:
+                raise ValueError("Queries parameter is required")
+            return await self._execute_batch(
+                queries,
+                max_parallel=arguments.get("max_parallel"),
+                fmt=self._output_format(arguments),
+            )
+        else:
+            raise ValueError(f"Unknown tool: {name}")
+
+    def _output_format(self, arguments: Dict[str, Any]) -> str:
+        """Result format requested by a tool call, falling back to the server default."""
+        return check_format(arguments.get("format") or self.output_format)
+
+    def _reduce_strategy(self, arguments: Dict[str, Any]) -> str:
+        """Reduction strategy requested by a tool call, falling back to the server default."""
+        return check_strategy(arguments.get("reduce") or self.reduce_strategy)
+
+    def _get_http_client(self) -> httpx.AsyncClient:
+        """Return the shared keep-alive client for the Cube REST API, creating it on first use."""
+        if self._http_client is None:
+            http2 = self.http2
+            if http2:
+                try:
+                    import h2  # type: ignore[import-not-found]  # noqa: F401
+                except ImportError:
+                    logger.warning("HTTP/2 requested but 'h2' is not installed; falling back to HTTP/1.1")
+                    http2 = False
+
+            headers = {
+                "Content-Type": "application/json",
+            }
+            if self.api_token:
+                headers["Authorization"] = f"Bearer {self.api_token}"
+
+            logger.info(
+                f"Creating HTTP client for {self.base_url} "
+                f"(max_connections={self.http_max_connections}, http2={http2})"
+            )
+            self._http_client = httpx.AsyncClient(
+                headers=headers,
+                http2=http2,
+                limits=httpx.Limits(
+                    max_connections=self.http_max_connections,
+                    max_keepalive_connections=self.http_max_keepalive_connections,
+                    keepalive_expiry=self.http_keepalive_expiry,
+                ),
+                timeout=self._http_timeout("v1/load"),
+            )
+        return self._http_client
+
+    def _http_timeout(self, endpoint: str) -> httpx.Timeout:
+        """Timeout for a Cube REST endpoint."""
+        read = self.http_timeouts.get(endpoint, self.http_timeouts["v1/load"])
+        return httpx.Timeout(read, connect=self.http_connect_timeout)
 
     async def _make_request(self, endpoint: str, method: str = "GET", data: Optional[Dict] = None) -> Dict[str, Any]:
-        """Make HTTP request to CubeJS API."""
+        """Make HTTP request to CubeJS API, polling while Cube answers "Continue wait"."""
+        return await self.upstreams["rest"].call(
+            lambda: self._send_request(endpoint, method, data),
+            endpoint=endpoint,
+            hedge=True,
+            wait_timeout=self.http_timeouts.get(endpoint, self.http_timeouts["v1/load"]),
+        )
+
+    async def _send_request(self, endpoint: str, method: str = "GET", data: Optional[Dict] = None) -> Dict[str, Any]:
         url = urljoin(f"{self.base_url}/", f"cubejs-api/{endpoint}")
         logger.info(f"Making {method} request to: {url}")
-        
-        headers = {
-            "Content-Type": "application/json",
-        }
-        
-        if self.api_token:
-            headers["Authorization"] = f"Bearer {self.api_token}"
 
-        async with httpx.AsyncClient() as client:
+        client = self._get_http_client()
+        timeout = self._http_timeout(endpoint)
+        extensions = {"trace": httpx_trace}
+        with upstream_wait():
             if method == "GET":
-                response = await client.get(url, headers=headers)
+                response = await client.get(url, timeout=timeout, extensions=extensions)
             elif method == "POST":
-                response = await client.post(url, headers=headers, json=data)
+                response = await client.post(url, json=data, timeout=timeout, extensions=extensions)
             else:
                 raise ValueError(f"Unsupported HTTP method: {method}")
 
-            response.raise_for_status()
-            return response.json()
+        response.raise_for_status()
+        with stage("parse"):
+            result = response.json()
+        if is_continue_wait(result):
+            raise ContinueWait()
+        return result
+
+    async def _iter_sql_stream(self, endpoint: str, query: str) -> AsyncGenerator[Tuple[str, Any], None]:
+        """Stream the newline-delimited JSON response of the CubeJS SQL API.
 
-    async def _make_sql_request(self, endpoint: str, query: str) -> Dict[str, Any]:
-        """Make HTTP request to CubeJS SQL API endpoint that returns streaming data."""
+        Yields ``("schema", schema)`` as soon as the schema line arrives and
+        ``("data", rows)`` for every data chunk after that.
+        """
         url = urljoin(f"{self.base_url}/", f"cubejs-api/{endpoint}")
         logger.info(f"Making POST request to SQL endpoint: {url}")
-        
-        headers = {
-            "Content-Type": "application/json",
-        }
-        
-        if self.api_token:
-            headers["Authorization"] = f"Bearer {self.api_token}"
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, headers=headers, json={"query": query})
+        client = self._get_http_client()
+        request = client.build_request(
+            "POST", url, json={"query": query}, timeout=self._http_timeout(endpoint),
+            extensions={"trace": httpx_trace},
+        )
+        with upstream_wait():
+            response = await client.send(request, stream=True)
+        try:
             response.raise_for_status()
-            
-            # Parse the streaming newline-delimited JSON response
-            response_text = response.text
-            lines = response_text.strip().split('\n')
-            
-            parsed_response = {
-                "schema": None,
-                "data": []
-            }
-            
-            for line in lines:
-                if line.strip():
+            lines = response.aiter_lines()
+            while True:
+                with upstream_wait():
                     try:
+                        line = await lines.__anext__()
+                    except StopAsyncIteration:
+                        break
+                if not line.strip():
+                    continue
+                try:
+                    with stage("parse"):
                         json_obj = json.loads(line)
-                        if "schema" in json_obj:
-                            parsed_response["schema"] = json_obj["schema"]
-                        elif "data" in json_obj:
-                            parsed_response["data"].extend(json_obj["data"])
-                    except json.JSONDecodeError as e:
-                        logger.warning(f"Failed to parse JSON line: {line}, error: {e}")
-                        continue
-            
-            return parsed_response
-
-    async def _get_meta(self):
+                except json.JSONDecodeError as e:
+                    logger.warning(f"Failed to parse JSON line: {line[:200]!r}, error: {e}")
+                    continue
+                if is_continue_wait(json_obj):
+                    raise ContinueWait()
+                if "schema" in json_obj:
+                    yield "schema", json_obj["schema"]
+                elif "data" in json_obj:
+                    yield "data", json_obj["data"]
+        finally:
+            await response.aclose()
+
+    async def _make_sql_request(self, endpoint: str, query: str, max_rows: Optional[int] = None,
+                                max_bytes: Optional[int] = None) -> Dict[str, Any]:
+        """Make HTTP request to CubeJS SQL API endpoint that returns streaming data.
+
+        Stops reading once ``max_rows`` rows or ``max_bytes`` bytes of row data
+        (default: ``sql_max_rows``/``sql_max_bytes``) have arrived and marks
+        the result as truncated.
+        """
+        return await self.upstreams["rest"].call(
+            lambda: self._read_sql_stream(endpoint, query, max_rows, max_bytes),
+            endpoint=endpoint,
+            wait_timeout=self.http_timeouts.get(endpoint, self.http_timeouts["v1/load"]),
+        )
+
+    async def _read_sql_stream(self, endpoint: str, query: str, max_rows: Optional[int] = None,
+                               max_bytes: Optional[int] = None) -> Dict[str, Any]:
+        max_rows = self.sql_max_rows if max_rows is None else max_rows
+        max_bytes = self.sql_max_bytes if max_bytes is None else max_bytes
+        rows: List[Any] = []
+        parsed_response: Dict[str, Any] = {
+            "schema": None,
+            "data": rows
+        }
+        size = 0
+        truncated = False
+
+        stream = self._iter_sql_stream(endpoint, query)
+        try:
+            async for kind, value in stream:
+                if kind == "schema":
+                    parsed_response["schema"] = value
+                    continue
+
+                if max_rows and len(rows) + len(value) > max_rows:
+                    value = value[:max_rows - len(rows)]
+                    truncated = True
+                if max_bytes:
+                    for row in value:
+                        size += len(dumps(row))
+                        if size > max_bytes:
+                            truncated = True
+                            break
+                        rows.append(row)
+                else:
+                    rows.extend(value)
+                if truncated:
+                    break
+        finally:
+            # Closing the generator closes the response, so a capped result
+            # does not wait for the rest of the body.
+            await stream.aclose()
+
+        if truncated:
+            logger.info(f"SQL API result truncated at {len(rows)} rows")
+            parsed_response["truncated"] = True
+        return parsed_response
+
+    async def _fetch_meta(self, etag: Optional[str] = None) -> Optional[Tuple[Dict[str, Any], Optional[str]]]:
+        """Fetch /v1/meta, revalidating with If-None-Match when an ETag is known.
+
+        Returns ``(meta, etag)``, or None if the cached copy is still current.
+        """
+        return await self.upstreams["rest"].call(lambda: self._send_meta(etag), endpoint="v1/meta", hedge=True)
+
+    async def _send_meta(self, etag: Optional[str]) -> Optional[Tuple[Dict[str, Any], Optional[str]]]:
+        url = urljoin(f"{self.base_url}/", "cubejs-api/v1/meta")
+        logger.info(f"Making GET request to: {url}")
+
+        headers = {"If-None-Match": etag} if etag else None
+        client = self._get_http_client()
+        with upstream_wait():
+            response = await client.get(
+                url, headers=headers, timeout=self._http_timeout("v1/meta"),
+                extensions={"trace": httpx_trace},
+            )
+        if response.status_code == 304:
+            return None
+
+        response.raise_for_status()
+        with stage("parse"):
+            return response.json(), response.headers.get("ETag")
+
+    def _serialize_meta(self, meta: Dict[str, Any]) -> str:
+        with stage("serialize"):
+            return dumps(meta, indent=True)
+
+    async def _get_meta(self) -> List[Dict[str, Any]]:
         """Get CubeJS metadata."""
         try:
-            result = await self._make_request("v1/meta")
-            return [{"type": "text", "text": json.dumps(result, indent=2)}]
+            _, text = await self.meta_cache.get()
+            return [{"type": "text", "text": text}]
         except Exception as e:
             logger.error(f"Error getting metadata: {e}")
             raise
 
-    async def _load_data(self, query: Dict[str, Any]):
+    def _on_meta_change(self, meta: Dict[str, Any]) -> None:
+        try:
+            self.schema_index = SchemaIndex(meta)
+        except Exception as e:
+            logger.warning(f"Could not index metadata: {e}")
+            return
+        self._schema_stats["rebuilds"] += 1
+        if self.delta_cache is not None:
+            # Cached buckets may hold members that changed meaning.
+            self.delta_cache.invalidate()
+        logger.info(f"Schema index rebuilt: {len(self.schema_index.members)} members")
+
+    async def _get_schema_index(self) -> Optional[SchemaIndex]:
+        """The index of the current schema; the last one built if metadata is unavailable."""
+        try:
+            await self.meta_cache.get()
+        except Exception as e:
+            logger.warning(f"Could not refresh metadata for the schema index: {e}")
+        return self.schema_index
+
+    def schema_stats(self) -> Dict[str, Any]:
+        index = self.schema_index
+        return {
+            **self._schema_stats,
+            "cubes": len(index.cubes) if index else 0,
+            "members": len(index.members) if index else 0,
+        }
+
+    async def _search_members(self, text: str = "", kind: Optional[str] = None, cube: Optional[str] = None,
+                              limit: int = 20) -> List[Dict[str, Any]]:
+        """Search the schema index for members."""
+        try:
+            if kind is not None and kind not in MEMBER_KINDS:
+                raise ValueError(f"Unknown kind: {kind}. Expected one of: {', '.join(MEMBER_KINDS)}")
+            index = await self._get_schema_index()
+            if index is None:
+                raise ValueError("Metadata is not available")
+            members = index.search(text or "", kinds=(kind,) if kind else MEMBER_KINDS, cube=cube, limit=limit)
+            result = index.describe(members)
+            result["matches"] = len(members)
+            return [{"type": "text", "text": dumps(result, indent=True)}]
+        except Exception as e:
+            logger.error(f"Error searching members: {e}")
+            raise
+
+    async def _load_data(self, query: Dict[str, Any], fmt: str = "json",
+                         strategy: str = "auto") -> List[Dict[str, Any]]:
         """Load data using CubeJS query."""
         try:
             # Validate query structure
             self._validate_query(query)
-            
-            result = await self._make_request("v1/load", method="POST", data={"query": query})
-            return [{"type": "text", "text": json.dumps(result, indent=2)}]
+            # Catch unknown members locally instead of with a round-trip to Cube.
+            index = await self._get_schema_index()
+            if index is not None:
+                try:
+                    index.validate_query(query)
+                except ValueError:
+                    self._schema_stats["rejected_queries"] += 1
+                    raise
+
+            async def load() -> str:
+                result = await self._fetch_load(query, index)
+                with stage("serialize"):
+                    data = result.get("data", [])
+                    if fmt == "json":
+                        text = dumps(result, indent=True)
+                    else:
+                        text = encode_records(data, fmt, rowCount=len(data))
+                    columns = list(data[0].keys()) if data else []
+                    rows = [[record.get(c) for c in columns] for record in data]
+                    roles = member_roles([index.column_member(c) for c in columns]) if index is not None else None
+                    fitted = fit_rows(columns, rows, len(text.encode()), self.load_max_rows, self.load_max_bytes,
+                                      strategy, roles=roles)
+                    if fitted is None:
+                        return text
+                    reduced, extra = fitted
+                    logger.info(f"REST API result of {len(data)} rows reduced to {len(reduced)} ({strategy})")
+                    if fmt == "json":
+                        result["data"] = [dict(zip(columns, row)) for row in reduced]
+                        result.update(extra)
+                        return dumps(result, indent=True)
+                    return encode_rows(columns, reduced, fmt, rowCount=len(reduced), **extra)
+
+            text = await self.result_cache.get_or_load(
+                f"load:{fmt}:{strategy}:{canonical_query(query)}", load
+            )
+            return [{"type": "text", "text": text}]
         except Exception as e:
             logger.error(f"Error loading data: {e}")
             raise
 
-    async def _execute_sql(self, query: str):
+    async def _fetch_load(self, query: Dict[str, Any], index: Optional[SchemaIndex]) -> Dict[str, Any]:
+        """/v1/load result of ``query``; bucketed time series reuse the buckets cached by the delta cache."""
+        delta_cache = self.delta_cache
+        sq = None
+        # Without the schema, cumulative measures cannot be told apart; load the query whole.
+        if delta_cache is not None and index is not None:
+            cumulative = [
+                name for name, member in index.members.items()
+                if member.get("cumulative") or member.get("cumulativeTotal")
+            ]
+            sq = SeriesQuery.parse(query, cumulative)
+        if delta_cache is None or sq is None:
+            return await self._make_request("v1/load", method="POST", data={"query": query})
+
+        missing = delta_cache.missing(sq)
+        ranges = delta_cache.fetch_ranges(sq, missing)
+        responses = await asyncio.gather(*(
+            self._make_request("v1/load", method="POST",
+                               data={"query": sq.subquery(first, last, limit=delta_cache.row_limit)})
+            for first, last in ranges
+        ))
+        result = delta_cache.merge(sq, list(zip(ranges, responses)))
+        if result is None:
+            logger.warning("Could not split a time-series result into buckets or it reached the row limit; "
+                           "loading it whole")
+            return await self._make_request("v1/load", method="POST", data={"query": query})
+        if len(missing) < len(sq.buckets):
+            logger.info(f"Time-series load: {len(sq.buckets) - len(missing)} of {len(sq.buckets)} "
+                        f"{sq.granularity} buckets from cache")
+        return result
+
+    async def _execute_sql(self, query: str, fmt: str = "json",
+                           strategy: str = "auto") -> List[Dict[str, Any]]:
         """Execute a SQL query against CubeJS using the SQL API endpoint."""
         try:
-            # The cubesql endpoint returns streaming newline-delimited JSON
-            result = await self._make_sql_request("v1/cubesql", query)
-            return [{"type": "text", "text": json.dumps(result, indent=2)}]
+            async def load() -> str:
+                # The cubesql endpoint returns streaming newline-delimited JSON
+                if strategy == "auto":
+                    # Read past the budget so the whole result can be reduced.
+                    result = await self._make_sql_request(
+                        "v1/cubesql", query, max_rows=self.reduce_scan_rows, max_bytes=0
+                    )
+                else:
+                    result = await self._make_sql_request("v1/cubesql", query)
+                with stage("serialize"):
+                    text = self._encode_sql_result(result, fmt)
+                    columns = [column["name"] for column in result["schema"] or []]
+                    fitted = fit_rows(columns, result["data"], len(text.encode()), self.sql_max_rows,
+                                      self.sql_max_bytes, strategy, complete=not result.get("truncated"))
+                    if fitted is None:
+                        return text
+                    rows, extra = fitted
+                    logger.info(f"SQL API result of {len(result['data'])} rows reduced to {len(rows)} ({strategy})")
+                    result["data"] = rows
+                    result.update(extra)
+                    return self._encode_sql_result(result, fmt)
+
+            text = await self.result_cache.get_or_load(
+                f"sql:{fmt}:{strategy}:{canonical_sql(query)}", load
+            )
+            return [{"type": "text", "text": text}]
         except Exception as e:
             logger.error(f"Error executing SQL query: {e}")
             raise
 
-    async def _execute_cubesql(self, query: str):
+    @staticmethod
+    def _encode_sql_result(result: Dict[str, Any], fmt: str) -> str:
+        if fmt == "json":
+            return dumps(result, indent=True)
+        columns = [column["name"] for column in result["schema"] or []]
+        extra = {key: value for key, value in result.items() if key not in ("schema", "data")}
+        return encode_rows(columns, result["data"], fmt, rowCount=len(result["data"]), **extra)
+
+    async def _execute_cubesql(self, query: str, mode: str = "full", page_size: Optional[int] = None,
+                               cursor: Optional[str] = None, fmt: str = "json",
+                               strategy: str = "auto") -> List[Dict[str, Any]]:
         """Execute a SQL query directly against CubeSQL PostgreSQL endpoint."""
         try:
-            # Connect directly to the CubeSQL PostgreSQL endpoint
-            conn = await asyncpg.connect(
-                host=self.cubesql_host,
-                port=self.cubesql_port,
-                user=self.cubesql_user,
-                password=self.cubesql_password,
-                database="cube",
-                timeout=15
-            )
-            
-            try:
-                # Execute the query
-                rows = await conn.fetch(query, timeout=15)
-                
-                # Convert rows to a list of dictionaries
-                result_data = []
-                for row in rows:
-                    result_data.append(dict(row))
-                
-                # Get column information
-                columns = []
-                if rows:
-                    columns = list(rows[0].keys())
-                
-                result = {
-                    "columns": columns,
-                    "data": result_data,
-                    "rowCount": len(result_data)
-                }
-                
-                return [{"type": "text", "text": json.dumps(result, indent=2)}]
-                
-            finally:
-                await conn.close()
-                
+            sql_key = canonical_sql(query)
+            if mode == "full":
+                async def load() -> str:
+                    plan = await self._plan_cubesql(query)
+                    if plan is not None:
+                        started = time.perf_counter()
+                        text = await self._load_planned(plan, fmt, strategy)
+                        if text is not None:
+                            self._observe_cubesql_path("rest", started)
+                            return text
+
+                    started = time.perf_counter()
+                    if strategy == "auto":
+                        # Scan past the budget; the encoder reduces the result if it is over.
+                        encoder, more = await self._stream_cubesql(
+                            query, fmt, max_rows=self.reduce_scan_rows,
+                            make_encoder=lambda columns: ReducingEncoder(
+                                columns, fmt, self.cubesql_max_rows, self.cubesql_max_bytes
+                            ),
+                        )
+                    else:
+                        encoder, more = await self._stream_cubesql(query, fmt)
+                    with stage("serialize"):
+                        text = encoder.finish(rowCount=encoder.count, truncated=more, path="cubesql")
+                    self._observe_cubesql_path("cubesql", started)
+                    return text
+
+                text = await self.result_cache.get_or_load(f"cubesql:{fmt}:{strategy}:{sql_key}", load)
+            elif mode == "paged":
+                # Each page re-runs the query; only a fixed order keeps pages from overlapping.
+                if not has_order_by(query):
+                    raise ValueError("Paged mode needs a query with an ORDER BY that fixes the row order")
+                if page_size is not None and (isinstance(page_size, bool) or not isinstance(page_size, int)
+                                              or page_size < 1):
+                    raise ValueError(f"page_size must be a positive integer, got {page_size!r}")
+                offset = self._decode_cubesql_cursor(cursor, sql_key) if cursor else 0
+                limit = page_size or self.cubesql_page_size
+
+                async def load() -> str:
+                    encoder, more = await self._stream_cubesql(
+                        query, fmt, offset=offset,
+                        max_rows=min(limit, self.cubesql_max_rows) if self.cubesql_max_rows else limit,
+                    )
+                    next_offset = offset + encoder.count
+                    with stage("serialize"):
+                        return encoder.finish(
+                            rowCount=encoder.count,
+                            offset=offset,
+                            nextCursor=self._encode_cubesql_cursor(sql_key, next_offset) if more else None,
+                        )
+
+                text = await self.result_cache.get_or_load(
+                    f"cubesql:{fmt}:{offset}:{limit}:{sql_key}", load
+                )
+            else:
+                raise ValueError(f"Unknown mode: {mode}")
+            return [{"type": "text", "text": text}]
         except Exception as e:
             logger.error(f"Error executing CubeSQL query: {e}")
             raise
 
+    async def _plan_cubesql(self, query: str) -> Optional[Plan]:
+        """The /v1/load equivalent of ``query``, or None if it has to go to CubeSQL."""
+        if not self.sql_planner:
+            return None
+        index = await self._get_schema_index()
+        if index is None:
+            logger.warning("Cannot plan CubeSQL query without metadata, using CubeSQL")
+            return None
+        try:
+            plan = plan_sql(query, index)
+        except Unsupported as e:
+            self._planner_stats["unsupported"] += 1
+            logger.info(f"CubeSQL query not plannable ({e}), using CubeSQL")
+            return None
+        self._planner_stats["planned"] += 1
+        return plan
+
+    async def _load_planned(self, plan: Plan, fmt: str, strategy: str) -> Optional[str]:
+        """Run a planned query through /v1/load, encoded like a CubeSQL result.
+
+        Returns None if the result should come from CubeSQL after all: the
+        REST call failed, or the result is over the row budget and needs the
+        full scan that reduction works from.
+        """
+        query = dict(plan.query)
+        max_rows = self.cubesql_max_rows
+        if max_rows:
+            # One row past the budget tells us whether more are left; this also
+            # keeps Cube's default row limit from silently cutting the result.
+            query["limit"] = min(query.get("limit", max_rows + 1), max_rows + 1)
+        elif "limit" not in query:
+            return None
+
+        try:
+            result = await self._make_request("v1/load", method="POST", data={"query": query})
+        except Exception as e:
+            self._planner_stats["rest_errors"] += 1
+            logger.warning(f"Planned /v1/load query failed, using CubeSQL: {e}")
+            return None
+
+        with stage("serialize"):
+            rows = plan.rows(result.get("data", []))
+            if max_rows and len(rows) > max_rows and strategy == "auto":
+                self._planner_stats["overflows"] += 1
+                logger.info(f"Planned query returned over {max_rows} rows, using CubeSQL to reduce it")
+                return None
+
+            encoder: Union[ReducingEncoder, ResultEncoder]
+            if strategy == "auto":
+                encoder = ReducingEncoder(plan.columns, fmt, max_rows, self.cubesql_max_bytes,
+                                          roles=member_roles(plan.members))
+            else:
+                encoder = ResultEncoder(plan.columns, fmt)
+            size = 0
+            more = False
+            for row in rows:
+                if max_rows and encoder.count >= max_rows:
+                    more = True
+                    break
+                size += encoder.add_row(row)
+                if self.cubesql_max_bytes and size > self.cubesql_max_bytes:
+                    more = True
+                    break
+            return encoder.finish(rowCount=encoder.count, truncated=more, path="rest")
+
+    def _observe_cubesql_path(self, path: str, started: float) -> None:
+        self.cubesql_path_calls.inc(path)
+        self.cubesql_path_duration.observe(time.perf_counter() - started, path)
+
+    def planner_stats(self) -> Dict[str, Any]:
+        return {**self._planner_stats, "enabled": self.sql_planner}
+
+    async def _execute_chart_data(self, query: str, x: str, values: List[str],
+                                  series: Optional[str] = None, chart_type: str = "bar",
+                                  agg: str = "sum", granularity: Optional[str] = None,
+                                  fill: Any = None) -> List[Dict[str, Any]]:
+        """Execute a CubeSQL query and pivot the rows into Plotly traces."""
+        try:
+            if isinstance(values, str):
+                values = [values]
+            spec = dumps([x, values, series, chart_type, agg, granularity, fill])
+
+            def make_builder(columns: List[str]) -> ChartBuilder:
+                return ChartBuilder(columns, x, values, series=series, chart_type=chart_type,
+                                    agg=agg, granularity=granularity, fill=fill)
+
+            async def load() -> str:
+                # The pivot is far smaller than its input, so scan as for a reduced result.
+                builder, more = await self._stream_cubesql(
+                    query, max_rows=self.reduce_scan_rows, make_encoder=make_builder
+                )
+                with stage("serialize"):
+                    return builder.finish(rowCount=builder.count, truncated=more)
+
+            text = await self.result_cache.get_or_load(f"chart:{spec}:{canonical_sql(query)}", load)
+            return [{"type": "text", "text": text}]
+        except Exception as e:
+            logger.error(f"Error building chart data: {e}")
+            raise
+
+    async def _execute_batch(self, queries: List[Any], max_parallel: Optional[int] = None,
+                             fmt: str = "json") -> List[Dict[str, Any]]:
+        """Run a list of queries concurrently and combine their results.
+
+        Identical queries run once. Each query takes its own scheduler slot,
+        at most ``max_parallel`` at a time, and fails independently.
+        """
+        if not isinstance(queries, list):
+            raise ValueError("queries must be an array")
+        if len(queries) > self.batch_max_queries:
+            raise ValueError(f"A batch can hold at most {self.batch_max_queries} queries, got {len(queries)}")
+        parallel = min(max_parallel or self.batch_max_parallel, self.batch_max_parallel)
+        if parallel < 1:
+            raise ValueError("max_parallel must be at least 1")
+
+        semaphore = asyncio.Semaphore(parallel)
+        session = self.server.request_context.session
+
+        async def run(tool: str, query: Any) -> str:
+            async with semaphore:
+                async with self.scheduler.slot(session, TOOL_UPSTREAMS[tool]):
+                    content = await self._run_tool(tool, {"query": query, "format": fmt})
+                    text: str = content[0]["text"]
+                    return text
+
+        tasks: Dict[str, asyncio.Future] = {}
+        entries: List[Tuple[Any, Optional[str], Optional[asyncio.Future], Optional[str]]] = []
+        for index, item in enumerate(queries):
+            item = item if isinstance(item, dict) else {}
+            item_id = item.get("id", str(index))
+            tool, query = item.get("tool"), item.get("query")
+            if tool not in BATCH_TOOLS:
+                entries.append((item_id, tool, None, f"tool must be one of: {', '.join(BATCH_TOOLS)}"))
+                continue
+            if not query:
+                entries.append((item_id, tool, None, "Query parameter is required"))
+                continue
+            if tool == "cubejs_load":
+                key = f"{tool}:{canonical_query(query) if isinstance(query, dict) else query}"
+            else:
+                key = f"{tool}:{canonical_sql(query) if isinstance(query, str) else query}"
+            if key not in tasks:
+                tasks[key] = asyncio.ensure_future(run(tool, query))
+            entries.append((item_id, tool, tasks[key], None))
+
+        logger.info(f"Running batch of {len(entries)} queries ({len(tasks)} distinct, parallel={parallel})")
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+        parts = []
+        failed = 0
+        for item_id, tool, task, error in entries:
+            if task is not None and task.exception() is not None:
+                error = str(task.exception())
+            head = f'{{"id": {dumps(item_id)}, "tool": {dumps(tool)}'
+            if error is not None or task is None:
+                failed += 1
+                parts.append(f'{head}, "error": {dumps(error)}}}')
+                continue
+            text = task.result()
+            # CSV results are plain text; every other format is JSON and embeds as is.
+            result = dumps(text) if fmt == "csv" else text
+            parts.append(f'{head}, "result": {result}}}')
+
+        body = ",\n".join(parts)
+        text = f'{{"results": [\n{body}\n], "succeeded": {len(entries) - failed}, "failed": {failed}}}'
+        return [{"type": "text", "text": text}]
+
+    async def _stream_cubesql(self, query: str, fmt: str = "json", offset: int = 0,
+                              max_rows: Optional[int] = None,
+                              make_encoder: Optional[Callable[[List[str]], Any]] = None,
+                              ) -> Tuple[ResultEncoder, bool]:
+        """Run a query through a server-side cursor, encoding rows as they are fetched.
+
+        Rows are fetched ``cubesql_fetch_batch_size`` at a time and handed
+        straight to the encoder until ``max_rows`` (default:
+        ``cubesql_max_rows``) or the ``cubesql_max_bytes`` budget is reached. ``make_encoder`` builds something other than a
+        ``ResultEncoder`` from the column names (e.g. a ``ChartBuilder``).
+        Returns the encoder, still to be finished, and whether more rows
+        were left unread. Transient connection failures are retried from
+        the start with a fresh encoder.
+        """
+        return await self.upstreams["cubesql"].call(
+            lambda: self._read_cubesql(query, fmt, offset, max_rows, make_encoder)
+        )
+
+    async def _read_cubesql(self, query: str, fmt: str, offset: int, max_rows: Optional[int],
+                            make_encoder: Optional[Callable[[List[str]], Any]]) -> Tuple[ResultEncoder, bool]:
+        row_budget = (max_rows if max_rows is not None else self.cubesql_max_rows) or None
+        size = 0
+        more = False
+
+        async with self._acquire_cubesql() as conn:
+            # asyncpg cursors only exist inside a transaction.
+            async with conn.transaction():
+                with upstream_wait():
+                    stmt = await conn.prepare(query, timeout=self.cubesql_timeout)
+                    columns = [attr.name for attr in stmt.get_attributes()]
+                    encoder = make_encoder(columns) if make_encoder else ResultEncoder(columns, fmt)
+                    cur = await stmt.cursor()
+                    # Rows before the page are read and dropped; CubeSQL has no MOVE.
+                    skipped = 0
+                    while skipped < offset:
+                        batch = await cur.fetch(min(self.cubesql_fetch_batch_size, offset - skipped),
+                                                timeout=self.cubesql_timeout)
+                        if not batch:
+                            break
+                        skipped += len(batch)
+
+                while not more:
+                    n = self.cubesql_fetch_batch_size
+                    if row_budget is not None:
+                        # One row past the budget tells us whether more are left.
+                        n = min(n, row_budget - encoder.count + 1)
+                    with upstream_wait():
+                        batch = await cur.fetch(n, timeout=self.cubesql_timeout)
+                    if not batch:
+                        break
+                    with stage("serialize"):
+                        for row in batch:
+                            if row_budget is not None and encoder.count >= row_budget:
+                                more = True
+                                break
+                            size += encoder.add_row(tuple(row))
+                            if self.cubesql_max_bytes and size > self.cubesql_max_bytes:
+                                more = True
+                                break
+
+        if more:
+            logger.info(f"CubeSQL result cut at {encoder.count} rows (offset {offset})")
+        return encoder, more
+
+    def _encode_cubesql_cursor(self, sql_key: str, offset: int) -> str:
+        """Continuation token: the next offset, bound to the query it came from."""
+        payload = {"q": hashlib.sha1(sql_key.encode()).hexdigest()[:16], "o": offset}
+        return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+    def _decode_cubesql_cursor(self, cursor: str, sql_key: str) -> int:
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            offset = int(payload["o"])
+            query_hash = payload["q"]
+        except (ValueError, KeyError, TypeError):
+            raise ValueError("Invalid cursor")
+        if query_hash != hashlib.sha1(sql_key.encode()).hexdigest()[:16]:
+            raise ValueError("Cursor does not belong to this query")
+        return offset
+
+    async def _get_cubesql_pool(self) -> asyncpg.Pool:
+        """Return the shared CubeSQL pool, creating it on first use."""
+        if self._cubesql_pool is not None:
+            return self._cubesql_pool
+
+        async with self._cubesql_pool_lock:
+            if self._cubesql_pool is None:
+                logger.info(
+                    f"Creating CubeSQL pool for {self.cubesql_host}:{self.cubesql_port} "
+                    f"(min={self.cubesql_pool_min_size}, max={self.cubesql_pool_max_size})"
+                )
+                self._cubesql_pool = await asyncpg.create_pool(
+                    host=self.cubesql_host,
+                    port=self.cubesql_port,
+                    user=self.cubesql_user,
+                    password=self.cubesql_password,
+                    database=self.cubesql_database,
+                    timeout=self.cubesql_timeout,
+                    min_size=self.cubesql_pool_min_size,
+                    max_size=self.cubesql_pool_max_size,
+                    max_inactive_connection_lifetime=self.cubesql_pool_max_inactive_lifetime,
+                    setup=self._check_cubesql_connection,
+                    # CubeSQL does not implement the session-reset statements
+                    # asyncpg issues on release (RESET ALL, UNLISTEN, ...).
+                    reset=self._reset_cubesql_connection,
+                )
+            return self._cubesql_pool
+
+    async def _check_cubesql_connection(self, conn: asyncpg.Connection) -> None:
+        """Health check run by the pool when it hands out a connection.
+
+        While connections are being released every ``cubesql_pool_check_idle``
+        seconds they are known to work and the round-trip is skipped; after
+        a quiet spell, when the server or a proxy may have dropped them, the
+        connection is checked. Longer-idle ones are closed by the pool anyway
+        (``cubesql_pool_max_inactive_lifetime``).
+        """
+        if time.monotonic() - self._cubesql_last_release < self.cubesql_pool_check_idle:
+            return
+        self._cubesql_pool_stats["health_checks"] += 1
+        await conn.fetchval("SELECT 1", timeout=self.cubesql_timeout)
+
+    async def _reset_cubesql_connection(self, conn: asyncpg.Connection) -> None:
+        """Release hook; queries are stateless so there is nothing to reset."""
+
+    @contextlib.asynccontextmanager
+    async def _acquire_cubesql(self) -> AsyncIterator[asyncpg.Connection]:
+        """Acquire a healthy pooled CubeSQL connection, recording wait time."""
+        pool = await self._get_cubesql_pool()
+        stats = self._cubesql_pool_stats
+        stats["waiting"] += 1
+        started = time.monotonic()
+        try:
+            # A failed health check closes the broken connection, so one
+            # retry is enough to get a freshly connected one.
+            for attempt in range(2):
+                try:
+                    conn = await pool.acquire(timeout=self.cubesql_pool_acquire_timeout)
+                    break
+                except asyncio.TimeoutError:
+                    stats["timeouts"] += 1
+                    raise
+                except (OSError, asyncpg.PostgresError) as e:
+                    stats["health_check_failures"] += 1
+                    if attempt:
+                        raise
+                    logger.warning(f"Discarding unhealthy CubeSQL connection: {e}")
+        finally:
+            stats["waiting"] -= 1
+
+        waited = time.monotonic() - started
+        record_stage("upstream_connect", waited)
+        stats["acquired"] += 1
+        stats["wait_seconds_total"] += waited
+        stats["wait_seconds_max"] = max(stats["wait_seconds_max"], waited)
+        try:
+            yield conn
+        finally:
+            await pool.release(conn)
+            self._cubesql_last_release = time.monotonic()
+
+    def cubesql_pool_stats(self) -> Dict[str, Any]:
+        """Snapshot of CubeSQL pool sizing, wait time and saturation."""
+        stats = dict(self._cubesql_pool_stats)
+        pool = self._cubesql_pool
+        size = pool.get_size() if pool else 0
+        idle = pool.get_idle_size() if pool else 0
+        stats.update({
+            "min_size": self.cubesql_pool_min_size,
+            "max_size": self.cubesql_pool_max_size,
+            "size": size,
+            "idle": idle,
+            "in_use": size - idle,
+            "saturation": (size - idle) / self.cubesql_pool_max_size,
+            "wait_seconds_avg": (
+                stats["wait_seconds_total"] / stats["acquired"] if stats["acquired"] else 0.0
+            ),
+        })
+        return stats
+
+    async def startup(self) -> None:
+        """Open long-lived upstream resources."""
+        self._get_http_client()
+        self.meta_cache.start()
+        if not self.warmup:
+            await self._open_cubesql_pool()
+            return
+
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._warm_up(), self.warmup_timeout)
+        except asyncio.TimeoutError:
+            self._warmup_stats["timed_out"] = True
+            logger.warning(f"Warm-up did not finish within {self.warmup_timeout:g}s; serving anyway")
+        self._warmup_stats["duration_seconds"] = time.perf_counter() - started
+        logger.info(
+            f"Warm-up finished in {self._warmup_stats['duration_seconds']:.2f}s: "
+            f"metadata {'loaded' if self._warmup_stats['meta'] else 'unavailable'}, "
+            f"{self._warmup_stats['queries']} queries ({self._warmup_stats['query_errors']} failed)"
+        )
+
+    async def _warm_up(self) -> None:
+        """Open the CubeSQL pool and the REST connection, index the schema and replay the hot queries."""
+        async def load_meta() -> None:
+            # Also opens the first keep-alive connection to Cube.
+            try:
+                await self.meta_cache.get()
+                self._warmup_stats["meta"] = True
+            except Exception as e:
+                logger.warning(f"Metadata not available at startup: {e}")
+
+        await asyncio.gather(self._open_cubesql_pool(), load_meta())
+        if not self.warmup_queries:
+            return
+
+        # Concurrent like a batch, which also opens several REST connections.
+        semaphore = asyncio.Semaphore(self.batch_max_parallel)
+
+        async def replay(entry: Dict[str, Any]) -> None:
+            tool = entry["tool"]
+            arguments = {key: value for key, value in entry.items() if key != "tool"}
+            async with semaphore:
+                try:
+                    async with self.scheduler.slot("warmup", TOOL_UPSTREAMS[tool]):
+                        await self._run_tool(tool, arguments)
+                    self._warmup_stats["queries"] += 1
+                except Exception as e:
+                    self._warmup_stats["query_errors"] += 1
+                    logger.warning(f"Warm-up query failed ({tool}): {e}")
+
+        await asyncio.gather(*(replay(entry) for entry in self.warmup_queries))
+
+    async def _open_cubesql_pool(self) -> None:
+        try:
+            await self._get_cubesql_pool()
+        except Exception as e:
+            # Cube may still be booting; the pool is retried on first use.
+            logger.warning(f"CubeSQL pool not available at startup: {e}")
+
+    @staticmethod
+    def _check_warmup_query(entry: Any) -> Dict[str, Any]:
+        if not isinstance(entry, dict) or not entry.get("query"):
+            raise ValueError(f"A warm-up query must be an object with 'tool' and 'query', got {entry!r}")
+        if entry.get("tool") not in WARMUP_TOOLS:
+            raise ValueError(
+                f"Unknown warm-up tool: {entry.get('tool')}. Expected one of: {', '.join(WARMUP_TOOLS)}"
+            )
+        return entry
+
+    def prefetch(self) -> None:
+        """Refresh stale metadata in the background, e.g. when a session opens.
+
+        The session's first cubejs_meta or query is then answered from the
+        cache. Concurrent prefetches share one fetch.
+        """
+        if not self.prefetch_meta or self.meta_cache.fresh:
+            return
+        if self._prefetch_task is not None and not self._prefetch_task.done():
+            return
+        self._warmup_stats["prefetches"] += 1
+        self._prefetch_task = asyncio.ensure_future(self._prefetch())
+
+    async def _prefetch(self) -> None:
+        try:
+            await self.meta_cache.get()
+        except Exception as e:
+            self._warmup_stats["prefetch_errors"] += 1
+            logger.warning(f"Metadata prefetch failed: {e}")
+
+    def warmup_stats(self) -> Dict[str, Any]:
+        return {**self._warmup_stats, "hot_queries": len(self.warmup_queries)}
+
+    async def shutdown(self) -> None:
+        """Close long-lived upstream resources."""
+        await self.meta_cache.stop()
+        self.result_cache.close()
+        if self._http_client is not None:
+            logger.info("Closing HTTP client")
+            await self._http_client.aclose()
+            self._http_client = None
+        if self._cubesql_pool is not None:
+            logger.info("Closing CubeSQL pool")
+            await self._cubesql_pool.close()
+            self._cubesql_pool = None
+
     def _validate_query(self, query: Dict[str, Any]) -> None:
         """Validate CubeJS query structure."""
         # Basic validation - ensure query is a dict
@@ -371,51 +1602,126 @@ class CubeJSMCPServer:
                 if not isinstance(f, dict) or not all(key in f for key in ["member", "operator", "values"]):
                     raise ValueError("Each filter must have 'member', 'operator', and 'values' fields")
 
-    def create_starlette_app(self) -> Starlette:
-        """Create a Starlette application that can serve the MCP server with SSE."""
-        sse = SseServerTransport("/messages")
+    def create_starlette_app(self, messages_path: str = "/messages/") -> Starlette:
+        """Create a Starlette application that can serve the MCP server with SSE and Streamable HTTP."""
+        sse = SseServerTransport(messages_path)
+        http = StatelessHTTPTransport(
+            self.server, self.server.create_initialization_options(), on_initialize=self.prefetch
+        )
         
         async def handle_sse(request: Request) -> None:
             logger.info("SSE connection established")
+            disconnected = asyncio.Event()
+
+            self.prefetch()
+
+            async def receive() -> Message:
+                # The SSE response consumes receive(); note when the client goes away.
+                message = await request.receive()
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+                return message
+
             async with sse.connect_sse(
                 request.scope,
-                request.receive,
+                receive,
                 request._send,
             ) as (read_stream, write_stream):
                 logger.info("Starting MCP server run loop")
-                await self.server.run(
+                writer = TracingWriteStream(write_stream, self.metrics)
+                bind_writer(writer)
+                self.metrics.sse_sessions.inc()
+                run = asyncio.ensure_future(self.server.run(
                     read_stream,
-                    write_stream,
+                    # Forwards send() to the stream it wraps.
+                    cast(MemoryObjectSendStream, writer),
                     self.server.create_initialization_options(),
-                )
+                ))
+                watch = asyncio.ensure_future(disconnected.wait())
+                try:
+                    await asyncio.wait({run, watch}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    # On disconnect, cancel the session and with it any
+                    # queued or running upstream work.
+                    for task in (run, watch):
+                        task.cancel()
+                    await asyncio.gather(run, watch, return_exceptions=True)
+                    self.metrics.sse_sessions.dec()
+                    logger.info("SSE session closed")
+
+        async def handle_metrics(request: Request) -> PlainTextResponse:
+            return PlainTextResponse(self.metrics.render(), media_type="text/plain; version=0.0.4")
+
+        async def handle_stats(request: Request) -> JSONResponse:
+            return JSONResponse({
+                "cubesql_pool": self.cubesql_pool_stats(),
+                "meta_cache": self.meta_cache.snapshot(),
+                "schema_index": self.schema_stats(),
+                "result_cache": self.result_cache.snapshot(),
+                "delta_cache": self.delta_cache.snapshot() if self.delta_cache is not None else None,
+                "scheduler": self.scheduler.snapshot(),
+                "sql_planner": self.planner_stats(),
+                "streamable_http": http.snapshot(),
+                "warmup": self.warmup_stats(),
+                "upstreams": {name: policy.snapshot() for name, policy in self.upstreams.items()},
+            })
+
+        async def handle_invalidate(request: Request) -> JSONResponse:
+            self.meta_cache.invalidate()
+            await self.result_cache.invalidate()
+            invalidated = ["meta", "results"]
+            if self.delta_cache is not None:
+                self.delta_cache.invalidate()
+                invalidated.append("delta")
+            logger.info(f"Caches invalidated: {', '.join(invalidated)}")
+            return JSONResponse({"invalidated": invalidated})
+
+        @contextlib.asynccontextmanager
+        async def lifespan(app: Starlette) -> AsyncIterator[None]:
+            await self.startup()
+            try:
+                yield
+            finally:
+                await self.shutdown()
 
         return Starlette(
             debug=True,
             routes=[
                 Route("/sse", endpoint=handle_sse),
-                Mount("/messages", app=sse.handle_post_message),
+                Route("/mcp", endpoint=http.handle_request, methods=["GET", "POST", "DELETE"]),
+                Route("/stats", endpoint=handle_stats),
+                Route("/metrics", endpoint=handle_metrics),
+                Route("/cache/invalidate", endpoint=handle_invalidate, methods=["POST"]),
+                Mount(messages_path, app=sse.handle_post_message),
             ],
+            lifespan=lifespan,
         )
 
-    async def run_sse(self):
-        """Run the MCP server using SSE transport."""
-        logger.info(f"Starting CubeJS MCP Server with SSE transport on port {self.port}")
+    async def run_sse(self, uds: Optional[str] = None, messages_path: str = "/messages/"):
+        """Run the MCP server using SSE transport, on ``uds`` instead of the port if given."""
+        if uds:
+            logger.info(f"Starting CubeJS MCP Server with SSE transport on {uds}")
+        else:
+            logger.info(f"Starting CubeJS MCP Server with SSE transport on port {self.port}")
         
         # Create Starlette app with SSE support
-        starlette_app = self.create_starlette_app()
+        starlette_app = self.create_starlette_app(messages_path)
         
         # Run the server using uvicorn
-        config = uvicorn.Config(
-            starlette_app,
-            host="0.0.0.0",
-            port=self.port,
-            log_level="info"
-        )
+        if uds:
+            config = uvicorn.Config(starlette_app, uds=uds, log_level="info")
+        else:
+            config = uvicorn.Config(
+                starlette_app,
+                host="0.0.0.0",
+                port=self.port,
+                log_level="info"
+            )
         server = uvicorn.Server(config)
         await server.serve()
 
-async def main():
-    """Main entry point."""
+def server_from_env() -> CubeJSMCPServer:
+    """Build the server from environment variables."""
     import os
     
     # Get configuration from environment variables
@@ -428,13 +1734,193 @@ async def main():
     cubesql_port = int(os.getenv("CUBEJS_CUBESQL_PORT", "15432"))
     cubesql_user = os.getenv("CUBEJS_CUBESQL_USER", "cubesql")
     cubesql_password = os.getenv("CUBEJS_CUBESQL_PASSWORD", "cubesql")
+    cubesql_database = os.getenv("CUBEJS_CUBESQL_DATABASE", "cube")
+    cubesql_pool_min_size = int(os.getenv("CUBEJS_CUBESQL_POOL_MIN_SIZE", "1"))
+    cubesql_pool_max_size = int(os.getenv("CUBEJS_CUBESQL_POOL_MAX_SIZE", "10"))
+    cubesql_pool_max_inactive_lifetime = float(os.getenv("CUBEJS_CUBESQL_POOL_MAX_INACTIVE_LIFETIME", "300"))
+    cubesql_pool_acquire_timeout = float(os.getenv("CUBEJS_CUBESQL_POOL_ACQUIRE_TIMEOUT", "15"))
+    cubesql_pool_check_idle = float(os.getenv("CUBEJS_CUBESQL_POOL_CHECK_IDLE", "30"))
+    cubesql_timeout = float(os.getenv("CUBEJS_CUBESQL_TIMEOUT", "15"))
+    cubesql_fetch_batch_size = int(os.getenv("CUBEJS_CUBESQL_FETCH_BATCH_SIZE", "500"))
+    cubesql_page_size = int(os.getenv("CUBEJS_CUBESQL_PAGE_SIZE", "1000"))
+    cubesql_max_rows = int(os.getenv("CUBEJS_CUBESQL_MAX_ROWS", "10000"))
+    cubesql_max_bytes = int(os.getenv("CUBEJS_CUBESQL_MAX_BYTES", str(8 * 1024 * 1024)))
+
+    # Cube REST API client configuration
+    http_max_connections = int(os.getenv("CUBEJS_HTTP_MAX_CONNECTIONS", "100"))
+    http_max_keepalive_connections = int(os.getenv("CUBEJS_HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+    http_keepalive_expiry = float(os.getenv("CUBEJS_HTTP_KEEPALIVE_EXPIRY", "30"))
+    http2 = os.getenv("CUBEJS_HTTP2", "false").lower() in ("1", "true", "yes")
+    http_connect_timeout = float(os.getenv("CUBEJS_HTTP_CONNECT_TIMEOUT", "5"))
+    http_timeouts = {
+        "v1/meta": float(os.getenv("CUBEJS_META_TIMEOUT", "10")),
+        "v1/load": float(os.getenv("CUBEJS_LOAD_TIMEOUT", "60")),
+        "v1/cubesql": float(os.getenv("CUBEJS_SQL_TIMEOUT", "120")),
+    }
+    sql_max_rows = int(os.getenv("CUBEJS_SQL_MAX_ROWS", "10000"))
+    sql_max_bytes = int(os.getenv("CUBEJS_SQL_MAX_BYTES", str(8 * 1024 * 1024)))
+    load_max_rows = int(os.getenv("CUBEJS_LOAD_MAX_ROWS", "10000"))
+    load_max_bytes = int(os.getenv("CUBEJS_LOAD_MAX_BYTES", str(8 * 1024 * 1024)))
+
+    # Oversized results: "auto" downsamples and summarizes, "truncate" cuts them off
+    reduce_strategy = os.getenv("CUBEJS_REDUCE_STRATEGY", "auto")
+    reduce_scan_rows = int(os.getenv("CUBEJS_REDUCE_SCAN_ROWS", "100000"))
+
+    # Metadata cache; a TTL of 0 disables caching
+    meta_cache_ttl = float(os.getenv("CUBEJS_META_CACHE_TTL", "300"))
+    meta_refresh_interval = float(os.getenv("CUBEJS_META_REFRESH_INTERVAL", "240"))
+
+    # Default tool result encoding: json, columnar, rows or csv
+    output_format = os.getenv("CUBEJS_OUTPUT_FORMAT", "json")
+
+    # Tool call concurrency caps (0 = unlimited), queue size and queue-time deadline
+    max_concurrent_calls = int(os.getenv("CUBEJS_MAX_CONCURRENT_CALLS", "32"))
+    max_concurrent_rest_calls = int(os.getenv("CUBEJS_MAX_CONCURRENT_REST_CALLS", "16"))
+    max_concurrent_cubesql_calls = os.getenv("CUBEJS_MAX_CONCURRENT_CUBESQL_CALLS")
+    max_queued_calls = int(os.getenv("CUBEJS_MAX_QUEUED_CALLS", "100"))
+    queue_timeout = float(os.getenv("CUBEJS_QUEUE_TIMEOUT", "30"))
+
+    # cubejs_batch limits
+    batch_max_queries = int(os.getenv("CUBEJS_BATCH_MAX_QUERIES", "20"))
+    batch_max_parallel = int(os.getenv("CUBEJS_BATCH_MAX_PARALLEL", "4"))
+
+    # Structured per-call trace logs (one JSON line per tool call)
+    trace_log = os.getenv("CUBEJS_TRACE_LOG", "false").lower() in ("1", "true", "yes")
+
+    # Query result cache; a TTL of 0 disables caching
+    result_cache_ttl = float(os.getenv("CUBEJS_RESULT_CACHE_TTL", "60"))
+    result_cache_max_bytes = int(os.getenv("CUBEJS_RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    result_cache_path = os.getenv("CUBEJS_RESULT_CACHE_PATH") or None
+    result_cache_disk_max_bytes = int(os.getenv("CUBEJS_RESULT_CACHE_DISK_MAX_BYTES", str(512 * 1024 * 1024)))
+
+    # Route simple cubejs_cubesql statements through the REST /v1/load API
+    sql_planner = os.getenv("CUBEJS_SQL_PLANNER", "true").lower() in ("1", "true", "yes")
+
+    # Startup warm-up, hot queries to replay (a JSON file) and per-session metadata prefetch
+    warmup = os.getenv("CUBEJS_WARMUP", "true").lower() in ("1", "true", "yes")
+    warmup_queries_path = os.getenv("CUBEJS_WARMUP_QUERIES")
+    warmup_timeout = float(os.getenv("CUBEJS_WARMUP_TIMEOUT", "30"))
+    prefetch_meta = os.getenv("CUBEJS_PREFETCH_META", "true").lower() in ("1", "true", "yes")
+
+    # Upstream retries, hedging and circuit breakers
+    upstream_retries = int(os.getenv("CUBEJS_UPSTREAM_RETRIES", "2"))
+    upstream_backoff = float(os.getenv("CUBEJS_UPSTREAM_BACKOFF", "0.1"))
+    upstream_backoff_max = float(os.getenv("CUBEJS_UPSTREAM_BACKOFF_MAX", "2"))
+    hedge_requests = os.getenv("CUBEJS_HEDGE_REQUESTS", "false").lower() in ("1", "true", "yes")
+    breaker_failure_threshold = int(os.getenv("CUBEJS_BREAKER_FAILURE_THRESHOLD", "5"))
+    breaker_reset_timeout = float(os.getenv("CUBEJS_BREAKER_RESET_TIMEOUT", "30"))
+    delta_cache_ttl = float(os.getenv("CUBEJS_DELTA_CACHE_TTL", "3600"))
+    delta_settle = float(os.getenv("CUBEJS_DELTA_SETTLE", "3600"))
+    delta_max_series = int(os.getenv("CUBEJS_DELTA_MAX_SERIES", "256"))
+    delta_max_bytes = int(os.getenv("CUBEJS_DELTA_MAX_BYTES", str(32 * 1024 * 1024)))
+    delta_row_limit = int(os.getenv("CUBEJS_DELTA_ROW_LIMIT", str(DEFAULT_ROW_LIMIT)))
     
     if not base_url:
         logger.error("CUBEJS_BASE_URL environment variable is required")
         sys.exit(1)
+
+    warmup_queries = None
+    if warmup_queries_path:
+        try:
+            with open(warmup_queries_path) as f:
+                warmup_queries = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not read CUBEJS_WARMUP_QUERIES from {warmup_queries_path}: {e}")
+            sys.exit(1)
+        if not isinstance(warmup_queries, list):
+            logger.error(f"CUBEJS_WARMUP_QUERIES must hold a JSON array, got {type(warmup_queries).__name__}")
+            sys.exit(1)
     
-    server = CubeJSMCPServer(base_url, api_token, port, cubesql_host, cubesql_port, cubesql_user, cubesql_password)
-    await server.run_sse()
+    return CubeJSMCPServer(
+        base_url, api_token, port, cubesql_host, cubesql_port, cubesql_user, cubesql_password,
+        cubesql_database=cubesql_database,
+        cubesql_pool_min_size=cubesql_pool_min_size,
+        cubesql_pool_max_size=cubesql_pool_max_size,
+        cubesql_pool_max_inactive_lifetime=cubesql_pool_max_inactive_lifetime,
+        cubesql_pool_acquire_timeout=cubesql_pool_acquire_timeout,
+        cubesql_pool_check_idle=cubesql_pool_check_idle,
+        cubesql_timeout=cubesql_timeout,
+        cubesql_fetch_batch_size=cubesql_fetch_batch_size,
+        cubesql_page_size=cubesql_page_size,
+        cubesql_max_rows=cubesql_max_rows,
+        cubesql_max_bytes=cubesql_max_bytes,
+        http_max_connections=http_max_connections,
+        http_max_keepalive_connections=http_max_keepalive_connections,
+        http_keepalive_expiry=http_keepalive_expiry,
+        http2=http2,
+        http_connect_timeout=http_connect_timeout,
+        http_timeouts=http_timeouts,
+        load_max_rows=load_max_rows,
+        load_max_bytes=load_max_bytes,
+        sql_max_rows=sql_max_rows,
+        sql_max_bytes=sql_max_bytes,
+        meta_cache_ttl=meta_cache_ttl,
+        meta_refresh_interval=meta_refresh_interval,
+        result_cache_ttl=result_cache_ttl,
+        result_cache_max_bytes=result_cache_max_bytes,
+        result_cache_path=result_cache_path,
+        result_cache_disk_max_bytes=result_cache_disk_max_bytes,
+        output_format=output_format,
+        trace_log=trace_log,
+        max_concurrent_calls=max_concurrent_calls,
+        max_concurrent_rest_calls=max_concurrent_rest_calls,
+        max_concurrent_cubesql_calls=(
+            int(max_concurrent_cubesql_calls) if max_concurrent_cubesql_calls else None
+        ),
+        max_queued_calls=max_queued_calls,
+        queue_timeout=queue_timeout,
+        batch_max_queries=batch_max_queries,
+        batch_max_parallel=batch_max_parallel,
+        reduce_strategy=reduce_strategy,
+        reduce_scan_rows=reduce_scan_rows,
+        sql_planner=sql_planner,
+        warmup=warmup,
+        warmup_queries=warmup_queries,
+        warmup_timeout=warmup_timeout,
+        prefetch_meta=prefetch_meta,
+        upstream_retries=upstream_retries,
+        upstream_backoff=upstream_backoff,
+        upstream_backoff_max=upstream_backoff_max,
+        hedge_requests=hedge_requests,
+        breaker_failure_threshold=breaker_failure_threshold,
+        breaker_reset_timeout=breaker_reset_timeout,
+        delta_cache_ttl=delta_cache_ttl,
+        delta_settle=delta_settle,
+        delta_max_series=delta_max_series,
+        delta_max_bytes=delta_max_bytes,
+        delta_row_limit=delta_row_limit,
+    )
+
+
+def _run_worker(index: int, uds: str) -> None:
+    """Entry point of a worker process in multi-worker mode."""
+    server = server_from_env()
+    asyncio.run(server.run_sse(uds=uds, messages_path=f"{worker_prefix(index)}/messages/"))
+
+
+async def main():
+    """Main entry point."""
+    import os
+
+    # Worker processes; above 1, a dispatcher on MCP_PORT routes sessions to them
+    workers = int(os.getenv("MCP_WORKERS", "1"))
+    if workers <= 1:
+        await server_from_env().run_sse()
+        return
+
+    if not os.getenv("CUBEJS_BASE_URL"):
+        logger.error("CUBEJS_BASE_URL environment variable is required")
+        sys.exit(1)
+    port = int(os.getenv("MCP_PORT", "8000"))
+    shared_result_cache = os.getenv("MCP_SHARED_RESULT_CACHE", "true").lower() in ("1", "true", "yes")
+    runtime_dir = tempfile.mkdtemp(prefix="cubejs-mcp-")
+    try:
+        if shared_result_cache and not os.getenv("CUBEJS_RESULT_CACHE_PATH"):
+            # Workers inherit the environment, so they all open this SQLite tier.
+            os.environ["CUBEJS_RESULT_CACHE_PATH"] = os.path.join(runtime_dir, "results.db")
+        await run_dispatcher(workers, port, _run_worker, runtime_dir)
+    finally:
+        shutil.rmtree(runtime_dir, ignore_errors=True)
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
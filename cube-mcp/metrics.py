@@ -0,0 +1,339 @@
+"""
+Prometheus-style metrics and per-call stage tracing for the MCP server
+
+A ``CallTrace`` is bound to the running tool call through a context
+variable, so upstream helpers can record stage timings with ``stage()``
+without threading the trace through every signature.
+"""
+
+import contextlib
+import contextvars
+import json
+import logging
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+trace_logger = logging.getLogger("cubejs_mcp.trace")
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# Stages a tool call is split into.
+STAGES = ("upstream_connect", "upstream_wait", "parse", "serialize", "sse_write")
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+M = TypeVar("M", bound=_Metric)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labels, k)} {v}" for k, v in self._values.items()
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        # Per-bucket counts followed by sum and count.
+        data = self._values.get(labels)
+        if data is None:
+            data = self._values[labels] = [0.0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                data[i] += 1
+        data[-2] += value
+        data[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        names = self.labels + ("le",)
+        for key, data in self._values.items():
+            for bound, count in zip(self.buckets, data):
+                lines.append(f"{self.name}_bucket{_format_labels(names, key + (repr(bound),))} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(names, key + ('+Inf',))} {data[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {data[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {data[-1]}")
+        return lines
+
+
+class CallTrace:
+    """Timing of one tool call, split into ``STAGES``."""
+
+    def __init__(self, tool: str, trace_id: Optional[str] = None):
+        self.tool = tool
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.stages: Dict[str, float] = {}
+        self.response_bytes = 0
+        self.error: Optional[str] = None
+        self._connect_started: Optional[float] = None
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "tool": self.tool,
+            "duration_ms": round((self.duration or 0.0) * 1000, 3),
+            "stages_ms": {stage: round(seconds * 1000, 3) for stage, seconds in self.stages.items()},
+            "response_bytes": self.response_bytes,
+            "error": self.error,
+        }
+
+
+_current_trace: contextvars.ContextVar[Optional[CallTrace]] = contextvars.ContextVar(
+    "cubejs_mcp_trace", default=None
+)
+
+
+def current_trace() -> Optional[CallTrace]:
+    return _current_trace.get()
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Add the time spent in the block to ``name`` on the current call's trace."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - started)
+
+
+def record_stage(name: str, seconds: float) -> None:
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+
+@contextlib.contextmanager
+def upstream_wait() -> Iterator[None]:
+    """Record the block as ``upstream_wait``, minus any connect time measured inside it."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    connect_before = trace.stages.get("upstream_connect", 0.0)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        connect = trace.stages.get("upstream_connect", 0.0) - connect_before
+        trace.add("upstream_wait", time.perf_counter() - started - connect)
+
+
+async def httpx_trace(event_name: str, info: Dict[str, Any]) -> None:
+    """httpcore ``trace`` extension hook that records TCP/TLS connect time."""
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    if event_name == "connection.connect_tcp.started":
+        trace._connect_started = time.perf_counter()
+    elif event_name in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+        if trace._connect_started is not None:
+            now = time.perf_counter()
+            trace.add("upstream_connect", now - trace._connect_started)
+            trace._connect_started = now
+
+
+class Metrics:
+    """Registry of the server's metrics, rendered in the Prometheus text format."""
+
+    def __init__(self, trace_log: bool = False):
+        self.trace_log = trace_log
+        self.tool_calls = Counter("cubejs_mcp_tool_calls_total", "Tool calls", ["tool"])
+        self.tool_errors = Counter("cubejs_mcp_tool_errors_total", "Tool calls that failed", ["tool"])
+        self.tool_duration = Histogram(
+            "cubejs_mcp_tool_duration_seconds", "Tool call latency, excluding the SSE write", ["tool"]
+        )
+        self.stage_duration = Histogram(
+            "cubejs_mcp_stage_duration_seconds", "Time spent per stage of a tool call", ["tool", "stage"]
+        )
+        self.response_bytes = Histogram(
+            "cubejs_mcp_response_bytes", "Size of tool results", ["tool"], buckets=BYTES_BUCKETS
+        )
+        self.in_flight = Gauge("cubejs_mcp_tool_calls_in_flight", "Tool calls being handled", ["tool"])
+        self.sse_sessions = Gauge("cubejs_mcp_sse_sessions_active", "Open SSE sessions")
+        self._metrics: List[_Metric] = [
+            self.tool_calls, self.tool_errors, self.tool_duration, self.stage_duration,
+            self.response_bytes, self.in_flight, self.sse_sessions,
+        ]
+        self._collectors: List[Callable[[], Iterable[_Metric]]] = []
+
+    def register(self, metric: M) -> M:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[_Metric]]) -> None:
+        """Register a callable producing metrics computed at scrape time."""
+        self._collectors.append(collector)
+
+    @contextlib.contextmanager
+    def trace_call(self, tool: str) -> Iterator[CallTrace]:
+        """Track one tool call: counts, in-flight gauge, latency and stage histograms."""
+        trace = CallTrace(tool)
+        token = _current_trace.set(trace)
+        self.tool_calls.inc(tool)
+        self.in_flight.inc(tool)
+        try:
+            yield trace
+        except BaseException as e:
+            trace.error = trace.error or type(e).__name__
+            raise
+        finally:
+            _current_trace.reset(token)
+            self.in_flight.dec(tool)
+            trace.duration = time.perf_counter() - trace.started
+            if trace.error:
+                self.tool_errors.inc(tool)
+            self.tool_duration.observe(trace.duration, tool)
+            self.response_bytes.observe(trace.response_bytes, tool)
+            for name, seconds in trace.stages.items():
+                self.stage_duration.observe(seconds, tool, name)
+
+    def finish_trace(self, trace: CallTrace) -> None:
+        """Log the structured trace once the call is fully done."""
+        if self.trace_log:
+            trace_logger.info(json.dumps(trace.to_dict()))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                for metric in collector():
+                    lines.extend(metric.render())
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+        return "\n".join(lines) + "\n"
+
+
+def gauges_from_stats(prefix: str, help: str, stats: Dict[str, Any]) -> List[Gauge]:
+    """Expose the numeric fields of a /stats snapshot as gauges."""
+    gauges = []
+    for key, value in stats.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        gauge = Gauge(f"{prefix}_{key}", f"{help}: {key}")
+        gauge.set(value)
+        gauges.append(gauge)
+    return gauges
+
+
+class TracingWriteStream:
+    """Wraps an MCP session's write stream to time the SSE write of tool results.
+
+    ``expect()`` registers the trace for a request id; when the response with
+    that id is sent, the send time is recorded as the ``sse_write`` stage.
+    """
+
+    def __init__(self, stream: Any, metrics: Metrics):
+        self._stream = stream
+        self._metrics = metrics
+        self._pending: Dict[Any, CallTrace] = {}
+
+    def expect(self, request_id: Any, trace: CallTrace) -> None:
+        self._pending[request_id] = trace
+
+    async def send(self, message: Any) -> None:
+        trace = self._pending.pop(getattr(message.root, "id", None), None)
+        if trace is None:
+            await self._stream.send(message)
+            return
+        started = time.perf_counter()
+        try:
+            await self._stream.send(message)
+        finally:
+            seconds = time.perf_counter() - started
+            trace.add("sse_write", seconds)
+            self._metrics.stage_duration.observe(seconds, trace.tool, "sse_write")
+            self._metrics.finish_trace(trace)
+
+    async def __aenter__(self) -> "TracingWriteStream":
+        await self._stream.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> Any:
+        for trace in self._pending.values():
+            self._metrics.finish_trace(trace)
+        self._pending.clear()
+        return await self._stream.__aexit__(*exc_info)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._stream, name)
+
+
+_current_writer: contextvars.ContextVar[Optional[TracingWriteStream]] = contextvars.ContextVar(
+    "cubejs_mcp_writer", default=None
+)
+
+
+def bind_writer(writer: TracingWriteStream) -> contextvars.Token:
+    return _current_writer.set(writer)
+
+
+def current_writer() -> Optional[TracingWriteStream]:
+    return _current_writer.get()
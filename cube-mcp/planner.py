@@ -0,0 +1,470 @@
+"""
+Rewrite simple CubeSQL statements into /v1/load queries
+
+Handles single-cube ``SELECT ... FROM cube [WHERE] [GROUP BY] [ORDER BY]
+[LIMIT] [OFFSET]`` statements whose columns map onto the cube's members in
+the /v1/meta schema. Anything else raises ``Unsupported`` and is left to
+CubeSQL.
+"""
+
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from schema import SchemaIndex
+
+_TOKEN = re.compile(r"""
+    \s+
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<quoted>"(?:[^"]|"")+")
+  | (?P<number>-?\d+(?:\.\d+)?)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<op><=|>=|<>|!=|=|<|>)
+  | (?P<punct>[(),.*;])
+""", re.VERBOSE)
+
+_COMPARISONS = {"=": "equals", "!=": "notEquals", "<>": "notEquals",
+                ">": "gt", ">=": "gte", "<": "lt", "<=": "lte"}
+
+# Cube operators that also match NULL, unlike their SQL counterparts.
+_NEGATIONS = {"notEquals", "notContains"}
+
+# SQL aggregate -> Cube measure aggType it can stand for.
+_AGGREGATES = {"sum": "sum", "avg": "avg", "min": "min", "max": "max", "count": "count"}
+
+_CLAUSE_WORDS = {"from", "where", "group", "order", "limit", "offset", "having", "as"}
+_JOINS = ("join", "inner", "left", "right", "full", "cross", "natural")
+# Words that may follow the FROM table, so are not its alias.
+_FOLLOWING_FROM = ("where", "group", "order", "limit", "offset", "having", "union") + _JOINS
+
+# Parentheses and words outside strings, quoted identifiers and comments.
+_SCAN = re.compile(r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|--[^\n]*|/\*.*?\*/|(?P<paren>[()])|(?P<word>[A-Za-z_][A-Za-z0-9_$]*)""",
+                   re.DOTALL)
+
+# Dimension types whose REST values convert losslessly to CubeSQL's.
+_PLANNABLE_TYPES = {"string", "number"}
+
+
+class Unsupported(ValueError):
+    """The statement has no exact /v1/load equivalent."""
+
+
+class Token:
+    __slots__ = ("kind", "value", "text")
+
+    def __init__(self, kind: str, value: str, text: str):
+        self.kind = kind
+        self.value = value  # lower-cased words, unquoted identifiers/strings
+        self.text = text
+
+    def is_word(self, *words: str) -> bool:
+        return self.kind == "word" and self.value in words
+
+
+def tokenize(sql: str) -> List[Token]:
+    tokens = []
+    pos = 0
+    while pos < len(sql):
+        match = _TOKEN.match(sql, pos)
+        if match is None:
+            raise Unsupported(f"unexpected character {sql[pos]!r}")
+        pos = match.end()
+        kind = match.lastgroup
+        if kind is None:
+            continue
+        text = match.group(kind)
+        if kind == "string":
+            value = text[1:-1].replace("''", "'")
+        elif kind == "quoted":
+            value = text[1:-1].replace('""', '"')
+        elif kind == "word":
+            value = text.lower()
+        else:
+            value = text
+        tokens.append(Token(kind, value, text))
+    return tokens
+
+
+class Plan:
+    """A /v1/load query plus how to turn its rows back into the SQL result's columns."""
+
+    def __init__(self, query: Dict[str, Any], columns: List[str], members: List[Dict[str, Any]]):
+        self.query = query
+        self.columns = columns
+        self.members = members
+
+    def rows(self, data: Sequence[Dict[str, Any]]) -> List[List[Any]]:
+        """Convert /v1/load records to rows in SELECT order, with numbers as numbers."""
+        names = [m["name"] for m in self.members]
+        numeric = [m["kind"] == "measure" or m.get("type") == "number" for m in self.members]
+        return [
+            [_to_number(record.get(name)) if is_number else record.get(name)
+             for name, is_number in zip(names, numeric)]
+            for record in data
+        ]
+
+
+def _to_number(value: Any) -> Any:
+    # The REST API returns numbers as strings; CubeSQL returns them as numbers.
+    if not isinstance(value, str):
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+class _Parser:
+    def __init__(self, tokens: List[Token], schema: SchemaIndex):
+        self.tokens = tokens
+        self.pos = 0
+        self.schema = schema
+        self.cube: Optional[Dict[str, Dict[str, Any]]] = None
+        self.aliases: set = set()
+
+    # -- token helpers --------------------------------------------------
+    def peek(self) -> Optional[Token]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def next(self) -> Token:
+        token = self.peek()
+        if token is None:
+            raise Unsupported("unexpected end of statement")
+        self.pos += 1
+        return token
+
+    def accept_word(self, *words: str) -> bool:
+        token = self.peek()
+        if token is not None and token.is_word(*words):
+            self.pos += 1
+            return True
+        return False
+
+    def expect_word(self, word: str) -> None:
+        if not self.accept_word(word):
+            raise Unsupported(f"expected {word.upper()}")
+
+    def accept_punct(self, punct: str) -> bool:
+        token = self.peek()
+        if token is not None and token.kind == "punct" and token.value == punct:
+            self.pos += 1
+            return True
+        return False
+
+    def expect_punct(self, punct: str) -> None:
+        if not self.accept_punct(punct):
+            raise Unsupported(f"expected {punct!r}")
+
+    def identifier(self) -> str:
+        token = self.next()
+        if token.kind == "quoted":
+            return token.value.lower()
+        if token.kind == "word" and token.value not in _CLAUSE_WORDS:
+            return token.value
+        raise Unsupported(f"expected an identifier, got {token.text!r}")
+
+    def output_name(self) -> str:
+        """An output column name: case is kept only when quoted, as in Postgres."""
+        token = self.next()
+        if token.kind == "quoted":
+            return token.value
+        if token.kind == "word" and token.value not in _CLAUSE_WORDS:
+            return token.value
+        raise Unsupported(f"expected an identifier, got {token.text!r}")
+
+    def integer(self) -> int:
+        token = self.next()
+        if token.kind != "number" or not token.value.isdigit():
+            raise Unsupported(f"expected a non-negative integer, got {token.text!r}")
+        return int(token.value)
+
+    # -- grammar ----------------------------------------------------------
+    def column_ref(self) -> str:
+        """``col`` or ``qualifier.col``; returns the lower-cased column name."""
+        name = self.identifier()
+        if self.accept_punct("."):
+            if name not in self.aliases:
+                raise Unsupported(f"unknown table {name!r}")
+            name = self.identifier()
+        return name
+
+    def columns(self) -> Dict[str, Dict[str, Any]]:
+        """Members of the FROM cube by lower-cased short name."""
+        if self.cube is None:
+            raise Unsupported("no cube to resolve columns against")
+        return self.cube
+
+    def member(self, name: str) -> Dict[str, Any]:
+        member = self.columns().get(name)
+        if member is None or member["kind"] == "segment":
+            raise Unsupported(f"{name!r} is not a measure or dimension of the cube")
+        return member
+
+    def expression(self) -> Tuple[Optional[str], Any]:
+        """A select/order expression and its default output name.
+
+        Returns ``(name, ("column", column))`` or ``(None, ("measure",
+        member))``: CubeSQL's names for unaliased aggregates are its own, so
+        aggregates only get the name given with AS.
+        """
+        token = self.peek()
+        following = self.tokens[self.pos + 1] if self.pos + 1 < len(self.tokens) else None
+        if (token is not None and token.kind == "word" and following is not None
+                and following.kind == "punct" and following.value == "("):
+            func = self.next().value
+            self.expect_punct("(")
+            if func == "count" and self.accept_punct("*"):
+                self.expect_punct(")")
+                counts = [m for m in self.columns().values() if m["kind"] == "measure" and m.get("aggType") == "count"]
+                if not counts:
+                    raise Unsupported("COUNT(*) without a count measure")
+                return None, ("measure", counts[0])
+            if self.accept_word("distinct"):
+                raise Unsupported("aggregate DISTINCT")
+            member = self.member(self.column_ref())
+            self.expect_punct(")")
+            if member["kind"] != "measure":
+                raise Unsupported(f"aggregate of dimension {member['name']}")
+            if func != "measure" and _AGGREGATES.get(func) != member.get("aggType"):
+                raise Unsupported(f"{func.upper()}({member['name']}) does not match its aggregation")
+            return None, ("measure", member)
+        name = self.column_ref()
+        last = self.tokens[self.pos - 1]
+        return last.value if last.kind == "quoted" else name, ("column", name)
+
+    def parse(self) -> Plan:
+        self.expect_word("select")
+        if self.accept_word("distinct"):
+            raise Unsupported("SELECT DISTINCT")
+        start = self.pos
+        # The select list needs the cube, so find FROM first.
+        depth = 0
+        while True:
+            token = self.peek()
+            if token is None:
+                break
+            if token.kind == "punct" and token.value in "()":
+                depth += 1 if token.value == "(" else -1
+            elif depth == 0 and token.is_word("from"):
+                break
+            self.pos += 1
+        self.expect_word("from")
+        cube_name = self.identifier()
+        self.cube = self.schema.cubes.get(cube_name)
+        if self.cube is None:
+            raise Unsupported(f"{cube_name!r} is not a cube")
+        self.aliases = {cube_name}
+        token = self.peek()
+        if self.accept_word("as") or (token is not None and token.kind in ("word", "quoted")
+                                      and not token.is_word(*_FOLLOWING_FROM)):
+            self.aliases.add(self.identifier())
+        token = self.peek()
+        if token is not None and (token.is_word(*_JOINS) or (token.kind == "punct" and token.value == ",")):
+            raise Unsupported("joins")
+        clauses_at = self.pos
+
+        self.pos = start
+        items = self.select_list()
+        self.pos = clauses_at
+        return self.clauses(items)
+
+    def select_list(self) -> List[Tuple[str, Dict[str, Any]]]:
+        items = []
+        while True:
+            if self.accept_punct("*"):
+                raise Unsupported("SELECT *")
+            name, (kind, value) = self.expression()
+            member = value if kind == "measure" else self.member(value)
+            if member["kind"] == "dimension" and member.get("type") not in _PLANNABLE_TYPES:
+                raise Unsupported(f"{member.get('type')} dimension {member['name']}")
+            if member["kind"] == "measure" and kind == "column":
+                raise Unsupported(f"measure {member['name']} without MEASURE()")
+            token = self.peek()
+            if self.accept_word("as") or (token is not None and token.kind == "quoted"):
+                name = self.output_name()
+            if name is None:
+                raise Unsupported(f"aggregate of {member['name']} without an alias")
+            items.append((name, member))
+            if not self.accept_punct(","):
+                break
+        token = self.peek()
+        if token is None or not token.is_word("from"):
+            raise Unsupported("unsupported select expression")
+        names = [name for name, _ in items]
+        if len(set(names)) != len(names):
+            raise Unsupported("output column names repeat")
+        return items
+
+    def resolve(self, items: List[Tuple[str, Dict[str, Any]]], outputs_first: bool) -> Dict[str, Any]:
+        """Resolve a GROUP BY/ORDER BY reference: position, output name or expression.
+
+        As in Postgres, a bare name is looked up among the output columns
+        first in ORDER BY (``outputs_first``) and among the input columns
+        first in GROUP BY.
+        """
+        token = self.peek()
+        if token is not None and token.kind == "number":
+            index = self.integer()
+            if not 1 <= index <= len(items):
+                raise Unsupported(f"position {index} is out of range")
+            return items[index - 1][1]
+        name, (kind, value) = self.expression()
+        if kind == "measure":
+            measure: Dict[str, Any] = value
+            return measure
+        if not outputs_first:
+            member = self.columns().get(value)
+            if member is not None and member["kind"] != "segment":
+                return member
+        for output, member in items:
+            if output == name:
+                return member
+        return self.member(value)
+
+    def condition(self, filters: List[Dict[str, Any]]) -> None:
+        token = self.peek()
+        if token is not None and token.kind == "punct" and token.value == "(":
+            raise Unsupported("parenthesized condition")
+        member = self.member(self.column_ref())
+        if member["kind"] != "dimension":
+            raise Unsupported(f"WHERE on measure {member['name']}")
+        name = member["name"]
+        if self.accept_word("is"):
+            negated = self.accept_word("not")
+            self.expect_word("null")
+            filters.append({"member": name, "operator": "set" if negated else "notSet"})
+            return
+        negated = self.accept_word("not")
+        if self.accept_word("in"):
+            self.expect_punct("(")
+            values = [self.literal()]
+            while self.accept_punct(","):
+                values.append(self.literal())
+            self.expect_punct(")")
+            self.append(filters, name, "notEquals" if negated else "equals", values)
+            return
+        token = self.peek()
+        if token is not None and token.is_word("like"):
+            # Cube's contains is case-insensitive, so only ILIKE maps onto it.
+            raise Unsupported("LIKE (only ILIKE maps onto contains)")
+        if self.accept_word("ilike"):
+            pattern = self.next()
+            if pattern.kind != "string":
+                raise Unsupported("ILIKE without a string pattern")
+            value = pattern.value
+            inner = value[1:-1]
+            if not (value.startswith("%") and value.endswith("%") and len(value) > 2
+                    and not any(c in inner for c in "%_\\")):
+                raise Unsupported("ILIKE pattern other than '%text%'")
+            self.append(filters, name, "notContains" if negated else "contains", [inner])
+            return
+        if negated:
+            raise Unsupported("NOT before a comparison")
+        op = self.next()
+        if op.kind != "op":
+            raise Unsupported(f"unsupported condition near {op.text!r}")
+        operator = _COMPARISONS[op.value]
+        if operator in ("gt", "gte", "lt", "lte") and member.get("type") != "number":
+            raise Unsupported(f"range comparison on {member.get('type')} dimension")
+        self.append(filters, name, operator, [self.literal()])
+
+    @staticmethod
+    def append(filters: List[Dict[str, Any]], name: str, operator: str, values: List[str]) -> None:
+        filters.append({"member": name, "operator": operator, "values": values})
+        if operator in _NEGATIONS:
+            # Cube keeps NULL rows for negated filters, SQL drops them.
+            filters.append({"member": name, "operator": "set"})
+
+    def literal(self) -> str:
+        token = self.next()
+        if token.kind in ("string", "number"):
+            return token.value
+        raise Unsupported(f"expected a literal, got {token.text!r}")
+
+    def clauses(self, items: List[Tuple[str, Dict[str, Any]]]) -> Plan:
+        query: Dict[str, Any] = {}
+        dimensions = [m["name"] for _, m in items if m["kind"] == "dimension"]
+        measures = [m["name"] for _, m in items if m["kind"] == "measure"]
+        if len(set(dimensions + measures)) != len(items):
+            raise Unsupported("the same member is selected twice")
+        if dimensions:
+            query["dimensions"] = dimensions
+        if measures:
+            query["measures"] = measures
+
+        if self.accept_word("where"):
+            filters: List[Dict[str, Any]] = []
+            self.condition(filters)
+            while self.accept_word("and"):
+                self.condition(filters)
+            token = self.peek()
+            if token is not None and token.is_word("or"):
+                raise Unsupported("OR in WHERE")
+            query["filters"] = filters
+
+        grouped = set()
+        if self.accept_word("group"):
+            self.expect_word("by")
+            grouped.add(self.resolve(items, outputs_first=False)["name"])
+            while self.accept_punct(","):
+                grouped.add(self.resolve(items, outputs_first=False)["name"])
+        if grouped != set(dimensions):
+            # /v1/load always groups by every selected dimension.
+            raise Unsupported("GROUP BY does not match the selected dimensions")
+
+        if self.accept_word("having"):
+            raise Unsupported("HAVING")
+
+        if self.accept_word("order"):
+            self.expect_word("by")
+            order = []
+            while True:
+                member = self.resolve(items, outputs_first=True)
+                if member["name"] not in dimensions + measures:
+                    raise Unsupported(f"ORDER BY {member['name']}, which is not selected")
+                direction = "desc" if self.accept_word("desc") else "asc"
+                if direction == "asc":
+                    self.accept_word("asc")
+                if self.accept_word("nulls"):
+                    raise Unsupported("NULLS FIRST/LAST")
+                order.append([member["name"], direction])
+                if not self.accept_punct(","):
+                    break
+            query["order"] = order
+
+        if self.accept_word("limit"):
+            query["limit"] = self.integer()
+        if self.accept_word("offset"):
+            query["offset"] = self.integer()
+        self.accept_punct(";")
+        token = self.peek()
+        if token is not None:
+            raise Unsupported(f"unsupported clause near {token.text!r}")
+
+        return Plan(query, [name for name, _ in items], [member for _, member in items])
+
+
+def plan_sql(sql: str, schema: SchemaIndex) -> Plan:
+    """Translate ``sql`` into a /v1/load query, or raise ``Unsupported``."""
+    return _Parser(tokenize(sql), schema).parse()
+
+
+def has_order_by(sql: str) -> bool:
+    """Whether ``sql`` ends in an ORDER BY of its own, not just one inside a subquery or window."""
+    depth = 0
+    previous = None
+    for match in _SCAN.finditer(sql):
+        if match.group("paren"):
+            depth += 1 if match.group("paren") == "(" else -1
+            previous = None
+        elif match.group("word"):
+            word = match.group("word").lower()
+            if depth == 0 and previous == "order" and word == "by":
+                return True
+            previous = word
+        else:
+            previous = None
+    return False
@@ -0,0 +1,379 @@
+"""
+Server-side reduction of results that exceed a tool's row/byte budget
+
+Instead of cutting an oversized result at its first N rows, time series
+are downsampled (largest-triangle-three-buckets when there is a numeric
+measure, evenly spaced rows otherwise), categories are cut to the top N
+plus an "Other" row, and summary statistics of the full result are
+attached.
+"""
+
+import datetime
+import decimal
+import random
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from encoding import ResultEncoder
+
+REDUCE_STRATEGIES = ("auto", "truncate")
+
+OTHER_LABEL = "Other"
+
+# Measure aggregations whose values over a set of rows add up.
+_ADDITIVE = ("count", "sum")
+
+# ``ReducingEncoder`` keeps this many times the row budget (and at least
+# _MIN_RESERVOIR rows) to reduce from; past that it keeps a sample.
+RESERVOIR_FACTOR = 4
+_MIN_RESERVOIR = 10000
+
+Row = Sequence[Any]
+
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, decimal.Decimal) and not value.is_finite():
+        return None
+    if isinstance(value, (int, float, decimal.Decimal)):
+        return float(value)
+    if isinstance(value, str):
+        # The REST API returns measures as strings.
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+
+def _timestamp(value: Any) -> Optional[float]:
+    if isinstance(value, datetime.datetime):
+        return value.timestamp() if value.tzinfo else value.replace(tzinfo=datetime.timezone.utc).timestamp()
+    if isinstance(value, datetime.date):
+        return float(value.toordinal() * 86400)
+    if isinstance(value, str) and len(value) >= 10 and value[4] == "-" and value[7] == "-":
+        try:
+            return _timestamp(datetime.datetime.fromisoformat(value.replace("Z", "+00:00")))
+        except ValueError:
+            return None
+    return None
+
+
+def check_strategy(strategy: str) -> str:
+    if strategy not in REDUCE_STRATEGIES:
+        raise ValueError(f"Unknown reduce strategy: {strategy}. Expected one of: {', '.join(REDUCE_STRATEGIES)}")
+    return strategy
+
+
+def member_roles(members: Sequence[Optional[Dict[str, Any]]]) -> List[Optional[str]]:
+    """Role of each result column from its /v1/meta member, or None if it has none.
+
+    Time dimensions are "time", other dimensions "dimension", count and
+    sum measures "additive" and the remaining measures "measure".
+    """
+    roles: List[Optional[str]] = []
+    for member in members:
+        if member is None:
+            roles.append(None)
+        elif member.get("kind") == "dimension":
+            roles.append("time" if member.get("type") == "time" else "dimension")
+        elif member.get("kind") == "measure":
+            additive = (member.get("aggType") or member.get("type")) in _ADDITIVE
+            roles.append("additive" if additive else "measure")
+        else:
+            roles.append(None)
+    return roles
+
+
+def _column_kind(rows: Sequence[Row], index: int, sample: int = 50) -> str:
+    """Classify a column as "time", "number", "category" or "empty" from its first values."""
+    kinds = set()
+    for row in rows:
+        value = row[index]
+        if value is None:
+            continue
+        if _timestamp(value) is not None:
+            kinds.add("time")
+        elif _number(value) is not None:
+            kinds.add("number")
+        else:
+            kinds.add("category")
+        if len(kinds) > 1 or sample <= 0:
+            break
+        sample -= 1
+    if not kinds:
+        return "empty"
+    return kinds.pop() if len(kinds) == 1 else "category"
+
+
+class _Summary:
+    """Running count/min/max/mean of every column holding numbers."""
+
+    def __init__(self, columns: Sequence[str]):
+        self.columns = list(columns)
+        # Per column: [count, total, min, max], or None before its first number.
+        self._stats: List[Optional[List[float]]] = [None] * len(self.columns)
+
+    def add(self, row: Row) -> None:
+        for index, value in enumerate(row):
+            number = _number(value)
+            if number is None:
+                continue
+            stats = self._stats[index]
+            if stats is None:
+                self._stats[index] = [1, number, number, number]
+            else:
+                stats[0] += 1
+                stats[1] += number
+                stats[2] = min(stats[2], number)
+                stats[3] = max(stats[3], number)
+
+    def result(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            column: {"count": int(stats[0]), "min": stats[2], "max": stats[3], "mean": stats[1] / stats[0]}
+            for column, stats in zip(self.columns, self._stats) if stats is not None
+        }
+
+
+def summarize(columns: Sequence[str], rows: Sequence[Row]) -> Dict[str, Dict[str, Any]]:
+    """count/min/max/mean of every column holding numbers."""
+    summary = _Summary(columns)
+    for row in rows:
+        summary.add(row)
+    return summary.result()
+
+
+def _even(rows: Sequence[Row], target: int) -> List[Row]:
+    """``target`` evenly spaced rows, keeping the first and the last."""
+    if target >= len(rows):
+        return list(rows)
+    if target <= 1:
+        return list(rows[:target])
+    step = (len(rows) - 1) / (target - 1)
+    return [rows[round(i * step)] for i in range(target)]
+
+
+def _lttb(rows: Sequence[Row], target: int, x_index: int, y_index: int) -> List[Row]:
+    """Largest-triangle-three-buckets downsampling on the (x, y) columns."""
+    n = len(rows)
+    if target >= n or target < 3:
+        return _even(rows, target)
+    xs = []
+    for i, row in enumerate(rows):
+        x = _timestamp(row[x_index])
+        if x is None:
+            x = _number(row[x_index])
+        xs.append(float(i) if x is None else x)
+    ys = [_number(row[y_index]) for row in rows]
+    # Points with a y value, by index; the others are skipped below.
+    points = {k: y for k, y in enumerate(ys) if y is not None}
+
+    sampled = [rows[0]]
+    a = 0
+    every = (n - 2) / (target - 2)
+    for i in range(target - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        # Average of the next bucket is the third vertex of the triangle.
+        next_points = [(xs[k], points[k]) for k in range(end, min(int((i + 2) * every) + 1, n))
+                       if k in points]
+        if next_points:
+            avg_x = sum(p[0] for p in next_points) / len(next_points)
+            avg_y = sum(p[1] for p in next_points) / len(next_points)
+        else:
+            avg_x, avg_y = xs[min(end, n - 1)], 0.0
+
+        # Rows without a y value are only picked if the whole bucket has none.
+        best, best_area = start, -1.0
+        ax, ay = xs[a], points.get(a, 0.0)
+        for j in range(start, min(end, n - 1)):
+            if j not in points:
+                continue
+            area = abs((ax - avg_x) * (points[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append(rows[best])
+        a = best
+    sampled.append(rows[-1])
+    return sampled
+
+
+def _top_n(columns: Sequence[str], rows: Sequence[Row], target: int, label_index: int,
+           value_index: int, additive: Sequence[int] = ()) -> List[Row]:
+    """The ``target - 1`` largest rows by the value column plus an "Other" row.
+
+    The "Other" row sums each ``additive`` column (counts, sums) over the
+    remaining rows and leaves every other cell empty. Without additive
+    columns there is nothing to sum, and the ``target`` largest rows are
+    returned alone.
+    """
+    ranked = sorted(rows, key=lambda row: _number(row[value_index]) or 0.0, reverse=True)
+    if not additive:
+        return ranked[:target]
+    top, rest = ranked[:max(target - 1, 1)], ranked[max(target - 1, 1):]
+    if not rest:
+        return top
+    other: List[Any] = [None] * len(columns)
+    other[label_index] = OTHER_LABEL
+    for index in additive:
+        values = [_number(row[index]) for row in rest]
+        if any(v is not None for v in values):
+            total = float(sum(v for v in values if v is not None))
+            other[index] = int(total) if total.is_integer() else total
+    return top + [tuple(other)]
+
+
+def downsample(columns: Sequence[str], rows: Sequence[Row], target: int,
+               roles: Optional[Sequence[Optional[str]]] = None) -> Tuple[List[Row], str]:
+    """Reduce ``rows`` to at most ``target`` rows; returns the rows and the method used.
+
+    With ``roles`` (see ``member_roles``), a time dimension makes a time
+    series (LTTB on the first measure) and otherwise a dimension makes
+    categories (top N by the first measure plus an "Other" row of the
+    additive measures). Without them the first column decides: time
+    values give a time series on the first numeric column, text gives the
+    top N by it, with no "Other" row as nothing is known to add up.
+    Anything else, numeric x values included, is sampled evenly.
+    """
+    if not rows or not columns:
+        return list(rows[:target]), "truncate"
+    if roles is not None:
+        x = next((i for i, role in enumerate(roles) if role == "time"), None)
+        measure = next((i for i, role in enumerate(roles) if role in ("additive", "measure")), None)
+        label = next((i for i, role in enumerate(roles) if role == "dimension"), None)
+        if measure is not None and x is not None:
+            return _lttb(rows, target, x, measure), "lttb"
+        if measure is not None and label is not None:
+            additive = [i for i, role in enumerate(roles) if role == "additive"]
+            return _top_n(columns, rows, target, label, measure, additive), "top_n"
+        return _even(rows, target), "even"
+    kinds = [_column_kind(rows, i) for i in range(len(columns))]
+    measure = next((i for i in range(1, len(columns)) if kinds[i] == "number"), None)
+    if kinds[0] == "time" and measure is not None:
+        return _lttb(rows, target, 0, measure), "lttb"
+    if kinds[0] == "category" and measure is not None:
+        return _top_n(columns, rows, target, 0, measure), "top_n"
+    return _even(rows, target), "even"
+
+
+def target_rows(count: int, size: int, max_rows: int, max_bytes: int) -> int:
+    """Rows of an encoded result of ``count`` rows and ``size`` bytes that fit both budgets."""
+    target = count
+    if max_rows:
+        target = min(target, max_rows)
+    if max_bytes and size > max_bytes and count:
+        target = min(target, max(1, int(max_bytes / (size / count))))
+    return target
+
+
+def over_budget(count: int, size: int, max_rows: int, max_bytes: int) -> bool:
+    return bool((max_rows and count > max_rows) or (max_bytes and size > max_bytes))
+
+
+def fit_rows(columns: Sequence[str], rows: Sequence[Row], size: int, max_rows: int, max_bytes: int,
+             strategy: str = "auto", complete: bool = True, roles: Optional[Sequence[Optional[str]]] = None
+             ) -> Optional[Tuple[List[Row], Dict[str, Any]]]:
+    """Bring a result that exceeds its budget back within it.
+
+    ``size`` is the encoded size of all ``rows``; ``complete`` is False if
+    the rows were themselves cut short; ``roles`` are the columns' roles
+    from the schema, if known (see ``downsample``). Returns None when the result fits,
+    otherwise the rows to return and the extra fields describing the cut:
+    ``truncated`` for the "truncate" strategy, ``reduced`` and ``summary``
+    for "auto".
+    """
+    if not over_budget(len(rows), size, max_rows, max_bytes):
+        return None
+    target = target_rows(len(rows), size, max_rows, max_bytes)
+    if strategy == "truncate":
+        return list(rows[:target]), {"truncated": True}
+    return _reduce(columns, rows, target, roles, len(rows), complete, summarize(columns, rows))
+
+
+def _reduce(columns: Sequence[str], rows: Sequence[Row], target: int, roles: Optional[Sequence[Optional[str]]],
+            from_rows: int, complete: bool, summary: Dict[str, Dict[str, Any]]
+            ) -> Tuple[List[Row], Dict[str, Any]]:
+    reduced, method = downsample(columns, rows, target, roles)
+    return reduced, {
+        "reduced": {"method": method, "fromRows": from_rows, "toRows": len(reduced), "complete": complete},
+        "summary": summary,
+    }
+
+
+class ReducingEncoder:
+    """``ResultEncoder`` that reduces the result instead of cutting it off.
+
+    Rows are encoded as they arrive while they fit ``max_rows`` and
+    ``max_bytes``, and kept so that, if the budget is exceeded, ``finish``
+    can downsample the result and summarize it. Past ``reservoir`` rows
+    (by default ``RESERVOIR_FACTOR`` times ``max_rows``) a uniform sample of
+    that size is kept instead, in arrival order, and the reduction is
+    reported as not complete; the summary still covers every row.
+    """
+
+    def __init__(self, columns: Sequence[str], fmt: str, max_rows: int, max_bytes: int,
+                 roles: Optional[Sequence[Optional[str]]] = None, reservoir: Optional[int] = None):
+        self.columns = list(columns)
+        self.roles = roles
+        self.fmt = fmt
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.reservoir = reservoir or max(RESERVOIR_FACTOR * max_rows, _MIN_RESERVOIR)
+        self.count = 0
+        self._encoder: Optional[ResultEncoder] = ResultEncoder(columns, fmt)
+        self._rows: List[Row] = []
+        # Arrival position of each kept row, once sampling has started.
+        self._positions: List[int] = []
+        # Rows read but not kept, summarized as they go.
+        self._dropped = _Summary(columns)
+        # Seeded, so the same result is always reduced the same way.
+        self._random = random.Random(0)
+        self._size = 0
+
+    def add_row(self, values: Row) -> int:
+        """Add one row; returns its encoded size, estimated once over budget."""
+        self.count += 1
+        self._keep(values)
+        if self._encoder is not None:
+            size = self._encoder.add_row(values)
+            if over_budget(self.count, self._size + size, self.max_rows, self.max_bytes):
+                self._encoder = None
+        else:
+            # Estimate from the rows encoded so far; no need to encode the rest.
+            size = self._size // max(self.count - 1, 1)
+        self._size += size
+        return size
+
+    def _keep(self, values: Row) -> None:
+        if len(self._rows) < self.reservoir:
+            self._rows.append(values)
+            return
+        if not self._positions:
+            self._positions = list(range(len(self._rows)))
+        slot = self._random.randrange(self.count)
+        if slot < self.reservoir:
+            self._dropped.add(self._rows[slot])
+            self._rows[slot] = values
+            self._positions[slot] = self.count - 1
+        else:
+            self._dropped.add(values)
+
+    def add_rows(self, rows: Sequence[Row]) -> int:
+        return sum(self.add_row(row) for row in rows)
+
+    def finish(self, truncated: bool = False, **extra: Any) -> str:
+        if self._encoder is not None:
+            return self._encoder.finish(**extra, truncated=truncated)
+        kept = self._rows
+        if self._positions:
+            kept = [row for _, row in sorted(zip(self._positions, self._rows), key=lambda pair: pair[0])]
+        summary = self._dropped
+        for row in kept:
+            summary.add(row)
+        target = target_rows(self.count, self._size, self.max_rows, self.max_bytes)
+        rows, info = _reduce(self.columns, kept, target, self.roles, self.count,
+                             not truncated and not self._positions, summary.result())
+        encoder = ResultEncoder(self.columns, self.fmt)
+        encoder.add_rows(rows)
+        extra["rowCount"] = encoder.count
+        return encoder.finish(**extra, truncated=truncated, **info)
@@ -0,0 +1,332 @@
+"""
+Retries, hedging and circuit breaking for the calls to one upstream
+
+``UpstreamPolicy.call()`` runs an upstream call with:
+- polling while Cube answers "Continue wait" (the query is still running)
+- jittered exponential-backoff retries of transient failures (connection
+  errors, 502/503/504), for calls that are safe to repeat
+- optional hedging: a second identical request when the first is slower
+  than the recent p95 for its endpoint, the first answer winning
+- a circuit breaker that fails fast once the upstream keeps failing, and
+  lets one probe call through after a cool-down
+"""
+
+import asyncio
+import collections
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+import asyncpg  # type: ignore[import-untyped]
+import httpx
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Body of a Cube response for a query that is still running.
+CONTINUE_WAIT = "Continue wait"
+
+BREAKER_STATES = ("closed", "half_open", "open")
+
+# Reason of a call that ran out of time on this side (a slow query, a
+# saturated pool): neither retried nor counted for or against the upstream.
+TIMEOUT = "timeout"
+
+# HTTP statuses of a gateway or an upstream that is briefly unavailable.
+_TRANSIENT_STATUSES = {502, 503, 504}
+
+
+class ContinueWait(Exception):
+    """Cube is still running the query; the same request should be sent again."""
+
+
+class CircuitOpen(RuntimeError):
+    """The upstream failed repeatedly and calls to it are refused for now."""
+
+
+def is_continue_wait(result: Any) -> bool:
+    return isinstance(result, dict) and result.get("error") == CONTINUE_WAIT
+
+
+def classify_http(error: BaseException) -> Tuple[Optional[str], bool]:
+    """``(reason, retryable)`` for an error of a Cube REST call.
+
+    The reason is None when the error does not mean the upstream is
+    failing (e.g. a 400 for a bad query). Read timeouts count against the
+    upstream but are not retried, as the query may still be running.
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        if status in _TRANSIENT_STATUSES:
+            return f"http_{status}", True
+        return None, False
+    if isinstance(error, (httpx.ConnectTimeout, httpx.PoolTimeout)):
+        return "connect_timeout", True
+    if isinstance(error, httpx.TimeoutException):
+        return "read_timeout", False
+    if isinstance(error, httpx.TransportError):
+        return "connection", True
+    return None, False
+
+
+def classify_cubesql(error: BaseException) -> Tuple[Optional[str], bool]:
+    """``(reason, retryable)`` for an error of a CubeSQL call; see ``classify_http``.
+
+    Pool acquire and query timeouts are ``TIMEOUT``. They are checked
+    first, as ``TimeoutError`` is an ``OSError`` since Python 3.10.
+    """
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+        return TIMEOUT, False
+    if isinstance(error, (asyncpg.CannotConnectNowError, asyncpg.TooManyConnectionsError)):
+        return "unavailable", True
+    if isinstance(error, (OSError, asyncpg.ConnectionDoesNotExistError)):
+        return "connection", True
+    return None, False
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures for ``reset_timeout`` seconds.
+
+    Once the cool-down has passed, one probe call is let through: its
+    success closes the breaker, its failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self._probing or time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def acquire(self) -> bool:
+        """Whether a call may go ahead; True if it is the half-open probe."""
+        if self.opened_at is None:
+            return False
+        if self.state == "open" or self._probing:
+            raise CircuitOpen(
+                f"circuit open after {self.failures} consecutive failures, "
+                f"retrying in {max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at)):.0f}s"
+            )
+        self._probing = True
+        return True
+
+    def release(self, probe: bool) -> None:
+        if probe:
+            self._probing = False
+
+    def success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+
+    def failure(self, probe: bool = False) -> bool:
+        """Record a failure; True if it opened the breaker."""
+        self.failures += 1
+        if self.opened_at is not None:
+            if probe:
+                # A failed probe starts a new cool-down.
+                self.opened_at = time.monotonic()
+            return probe
+        if self.failure_threshold and self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+
+class UpstreamPolicy:
+    """Retries, continue-wait polling, hedging and a circuit breaker for one upstream.
+
+    ``classify`` maps an error to ``(reason, retryable)``; see
+    ``classify_http``. ``on_event(event, reason)`` is called for every
+    retry, hedge, trip, rejection, timeout and continue-wait poll, e.g. to
+    count them in metrics.
+    """
+
+    def __init__(self, name: str, classify: Callable[[BaseException], Tuple[Optional[str], bool]],
+                 retries: int = 2, backoff: float = 0.1, backoff_max: float = 2.0,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0, hedge: bool = False,
+                 hedge_min_samples: int = 20, hedge_budget: float = 0.1,
+                 on_event: Optional[Callable[[str, str], None]] = None):
+        self.name = name
+        self.classify = classify
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        # Hedged requests may add at most this fraction of extra requests.
+        self.hedge_budget = hedge_budget
+        self.on_event = on_event
+        # Recent latencies of single requests per endpoint, for the hedge delay.
+        self._latencies: Dict[str, Deque[float]] = {}
+        self.stats = {
+            "calls": 0,
+            "requests": 0,
+            "failures": 0,
+            "retries": 0,
+            "continue_waits": 0,
+            "timeouts": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+            "trips": 0,
+            "rejected": 0,
+        }
+
+    def _event(self, event: str, reason: str = "") -> None:
+        if self.on_event is not None:
+            self.on_event(event, reason)
+
+    def _delay(self, attempt: int) -> float:
+        # Full jitter: spreads out the retries of callers that failed together.
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+
+    async def call(self, fn: Callable[[], Awaitable[T]], endpoint: str = "", idempotent: bool = True,
+                   hedge: bool = False, wait_timeout: Optional[float] = None) -> T:
+        """Run ``fn`` under the policy.
+
+        ``fn`` may raise ``ContinueWait`` to be polled again, for up to
+        ``wait_timeout`` seconds. Only ``idempotent`` calls are retried,
+        and only ``hedge`` calls to endpoints with enough latency samples
+        are hedged.
+        """
+        self.stats["calls"] += 1
+        attempt = 0
+        while True:
+            try:
+                probe = self.breaker.acquire()
+            except CircuitOpen as e:
+                self.stats["rejected"] += 1
+                self._event("rejected")
+                raise CircuitOpen(f"{self.name} unavailable: {e}") from None
+            try:
+                result = await self._poll(fn, endpoint, hedge and self.hedge, wait_timeout)
+            except (ContinueWait, CircuitOpen):
+                raise
+            except Exception as e:
+                reason, retryable = self.classify(e)
+                if reason is None:
+                    # The upstream answered; the call itself was bad.
+                    self.breaker.success()
+                    raise
+                if reason == TIMEOUT:
+                    self.stats["timeouts"] += 1
+                    self._event("timeout", reason)
+                    raise
+                self.stats["failures"] += 1
+                if self.breaker.failure(probe):
+                    self.stats["trips"] += 1
+                    self._event("trip", reason)
+                    logger.warning(f"Circuit for {self.name} opened after {self.breaker.failures} "
+                                   f"consecutive failures (last: {reason}: {e})")
+                    raise
+                if not (retryable and idempotent) or attempt >= self.retries or probe:
+                    raise
+                attempt += 1
+                self.stats["retries"] += 1
+                self._event("retry", reason)
+                delay = self._delay(attempt)
+                logger.warning(f"Retrying {self.name} call in {delay:.2f}s "
+                               f"(attempt {attempt + 1} of {self.retries + 1}, {reason}: {e})")
+                await asyncio.sleep(delay)
+                continue
+            finally:
+                self.breaker.release(probe)
+            self.breaker.success()
+            return result
+
+    async def _poll(self, fn: Callable[[], Awaitable[T]], endpoint: str, hedge: bool,
+                    wait_timeout: Optional[float]) -> T:
+        deadline = time.monotonic() + wait_timeout if wait_timeout else None
+        polls = 0
+        while True:
+            try:
+                return await (self._hedged(fn, endpoint) if hedge else self._timed(fn, endpoint))
+            except ContinueWait:
+                self.stats["continue_waits"] += 1
+                self._event("continue_wait")
+                delay = min(self.backoff_max, self.backoff * 2 ** polls)
+                if deadline is not None and time.monotonic() + delay > deadline:
+                    raise ContinueWait(
+                        f"{self.name} query still running after {wait_timeout:g}s of polling"
+                    ) from None
+                polls += 1
+                await asyncio.sleep(delay)
+
+    async def _timed(self, fn: Callable[[], Awaitable[T]], endpoint: str) -> T:
+        self.stats["requests"] += 1
+        started = time.perf_counter()
+        result = await fn()
+        self._observe(endpoint, time.perf_counter() - started)
+        return result
+
+    def _observe(self, endpoint: str, seconds: float) -> None:
+        samples = self._latencies.get(endpoint)
+        if samples is None:
+            samples = self._latencies[endpoint] = collections.deque(maxlen=200)
+        samples.append(seconds)
+
+    def hedge_delay(self, endpoint: str) -> Optional[float]:
+        """The recent p95 latency of ``endpoint``, or None if it should not be hedged yet."""
+        samples = self._latencies.get(endpoint)
+        if not samples or len(samples) < self.hedge_min_samples:
+            return None
+        if self.stats["hedges"] >= self.hedge_budget * self.stats["requests"]:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    async def _hedged(self, fn: Callable[[], Awaitable[T]], endpoint: str) -> T:
+        delay = self.hedge_delay(endpoint)
+        if delay is None:
+            return await self._timed(fn, endpoint)
+
+        self.stats["requests"] += 1
+        started = time.perf_counter()
+        first = asyncio.ensure_future(fn())
+        pending = {first}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                self.stats["requests"] += 1
+                self.stats["hedges"] += 1
+                self._event("hedge")
+                second = asyncio.ensure_future(fn())
+                pending.add(second)
+            error: Optional[BaseException] = None
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self.stats["hedge_wins"] += 1
+                            self._event("hedge_win")
+                        self._observe(endpoint, time.perf_counter() - started)
+                        return task.result()
+                    error = task.exception()
+                if not pending and error is not None:
+                    raise error
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    def snapshot(self) -> Dict[str, Any]:
+        state = self.breaker.state
+        return {
+            **self.stats,
+            "state": state,
+            # 0 closed, 1 half-open, 2 open; numeric for the gauge.
+            "breaker_state": BREAKER_STATES.index(state),
+            "consecutive_failures": self.breaker.failures,
+        }
@@ -0,0 +1,172 @@
+"""
+Admission control for tool calls
+
+Caps concurrent tool calls globally and per upstream (Cube REST API vs
+CubeSQL), queues the excess in a bounded queue and hands free slots to
+waiting SSE sessions round-robin, so one busy session cannot starve the
+others.
+"""
+
+import asyncio
+import contextlib
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Deque, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(RuntimeError):
+    """Raised when a tool call is rejected or waits too long for a slot."""
+
+
+class _Waiter:
+    __slots__ = ("session", "upstream", "future", "enqueued_at")
+
+    def __init__(self, session: Hashable, upstream: str):
+        self.session = session
+        self.upstream = upstream
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+
+
+class Scheduler:
+    """Concurrency limiter with per-session fair queueing.
+
+    Each session has a FIFO queue; when a slot frees up, sessions are
+    visited in round-robin order and the first whose head call fits the
+    global and per-upstream limits gets it. A limit of 0 means unlimited.
+    """
+
+    def __init__(self, max_concurrency: int = 0, upstream_limits: Optional[Dict[str, int]] = None,
+                 max_queue: int = 0, queue_timeout: float = 0.0):
+        self.max_concurrency = max_concurrency
+        self.upstream_limits = dict(upstream_limits or {})
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._active = 0
+        self._active_by_upstream: Dict[str, int] = {}
+        # Session -> its queued calls; order of keys is the round-robin order.
+        self._queues: "OrderedDict[Hashable, Deque[_Waiter]]" = OrderedDict()
+        self._queued = 0
+        self.stats = {
+            "admitted": 0,
+            "queued": 0,
+            "rejected": 0,
+            "timed_out": 0,
+            "cancelled": 0,
+            "max_wait_seconds": 0.0,
+            "total_wait_seconds": 0.0,
+        }
+
+    def _fits(self, upstream: str) -> bool:
+        if self.max_concurrency and self._active >= self.max_concurrency:
+            return False
+        limit = self.upstream_limits.get(upstream, 0)
+        return not limit or self._active_by_upstream.get(upstream, 0) < limit
+
+    def _grant(self, upstream: str) -> None:
+        self._active += 1
+        self._active_by_upstream[upstream] = self._active_by_upstream.get(upstream, 0) + 1
+        self.stats["admitted"] += 1
+
+    def _release(self, upstream: str) -> None:
+        self._active -= 1
+        self._active_by_upstream[upstream] -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        """Hand free slots to queued calls, one session at a time."""
+        progress = True
+        while progress and self._queued:
+            progress = False
+            for session in list(self._queues):
+                queue = self._queues[session]
+                waiter = queue[0]
+                if not self._fits(waiter.upstream):
+                    continue
+                queue.popleft()
+                self._queued -= 1
+                if queue:
+                    self._queues.move_to_end(session)
+                else:
+                    del self._queues[session]
+                self._grant(waiter.upstream)
+                waited = time.monotonic() - waiter.enqueued_at
+                self.stats["total_wait_seconds"] += waited
+                self.stats["max_wait_seconds"] = max(self.stats["max_wait_seconds"], waited)
+                waiter.future.set_result(None)
+                progress = True
+
+    def _remove(self, waiter: _Waiter) -> None:
+        queue = self._queues.get(waiter.session)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        self._queued -= 1
+        if not queue:
+            del self._queues[waiter.session]
+        # The removed call may have been blocking the head of its session.
+        self._wake()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, session: Hashable, upstream: str) -> AsyncIterator[None]:
+        """Hold a slot for ``upstream`` on behalf of ``session`` for the block."""
+        if not self._queued and self._fits(upstream):
+            self._grant(upstream)
+        else:
+            await self._wait(session, upstream)
+        try:
+            yield
+        finally:
+            self._release(upstream)
+
+    async def _wait(self, session: Hashable, upstream: str) -> None:
+        if self.max_queue and self._queued >= self.max_queue:
+            self.stats["rejected"] += 1
+            logger.warning(f"Rejecting {upstream} tool call: {self._queued} calls queued")
+            raise Overloaded(
+                f"Server busy: {self._queued} tool calls already queued, try again later"
+            )
+
+        waiter = _Waiter(session, upstream)
+        self._queues.setdefault(session, deque()).append(waiter)
+        self._queued += 1
+        self.stats["queued"] += 1
+        self._wake()
+        if waiter.future.done():
+            return
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout or None)
+        except asyncio.TimeoutError:
+            if waiter.future.done():
+                return
+            self._remove(waiter)
+            self.stats["timed_out"] += 1
+            logger.warning(f"{upstream} tool call timed out after {self.queue_timeout:g}s in the queue")
+            raise Overloaded(
+                f"Timed out after {self.queue_timeout:g}s waiting for a {upstream} slot, try again later"
+            ) from None
+        except asyncio.CancelledError:
+            if waiter.future.done():
+                # Granted just as we were cancelled; give the slot back.
+                self._release(upstream)
+            else:
+                self._remove(waiter)
+            self.stats["cancelled"] += 1
+            raise
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "active": self._active,
+            "waiting": self._queued,
+            "sessions_waiting": len(self._queues),
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            **{f"active_{upstream}": n for upstream, n in self._active_by_upstream.items()},
+            **{f"limit_{upstream}": n for upstream, n in self.upstream_limits.items()},
+        }
@@ -0,0 +1,208 @@
+"""
+In-memory index of the cubes and members in a /v1/meta response
+
+Used to validate REST queries locally (with did-you-mean suggestions
+from a trigram index), to resolve SQL identifiers for the query planner
+and to search the schema without sending all of it to the client.
+"""
+
+import bisect
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set
+
+MEMBER_KINDS = ("measure", "dimension", "segment")
+
+# Query fields naming members, and the kinds of member each accepts.
+_QUERY_FIELDS = {
+    "measures": ("measure",),
+    "dimensions": ("dimension",),
+    "segments": ("segment",),
+}
+
+# Minimum trigram similarity for a name to be suggested.
+_SUGGEST_THRESHOLD = 0.3
+
+
+def _trigrams(text: str) -> Set[str]:
+    padded = f"  {text.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _similarity(a: Set[str], b: Set[str]) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def _short(name: str) -> str:
+    return name.split(".", 1)[-1]
+
+
+class SchemaIndex:
+    """Cubes, measures, dimensions and segments of one /v1/meta response."""
+
+    def __init__(self, meta: Dict[str, Any]):
+        # Full member name -> member (its meta entry plus "kind" and "cube").
+        self.members: Dict[str, Dict[str, Any]] = {}
+        # Lower-cased cube name -> lower-cased short member name -> member.
+        self.cubes: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.cube_info: Dict[str, Dict[str, Any]] = {}
+        for cube in meta.get("cubes", []):
+            members = {}
+            for kind in MEMBER_KINDS:
+                for entry in cube.get(f"{kind}s", []):
+                    member = {**entry, "kind": kind, "cube": cube["name"]}
+                    self.members[entry["name"]] = member
+                    members[entry["name"].split(".", 1)[-1].lower()] = member
+            self.cubes[cube["name"].lower()] = members
+            self.cube_info[cube["name"]] = {
+                key: value for key, value in cube.items() if key not in ("measures", "dimensions", "segments")
+            }
+
+        self._by_lower = {name.lower(): name for name in self.members}
+        # Sorted lower-cased names, for prefix lookups.
+        self._sorted = sorted(self._by_lower)
+        # Trigrams of the short names ("count" of "Orders.count"), which the
+        # members of a cube do not all share.
+        self._grams: Dict[str, Set[str]] = {}
+        self._postings: Dict[str, Set[str]] = {}
+        for name in self.members:
+            grams = _trigrams(_short(name))
+            self._grams[name] = grams
+            for gram in grams:
+                self._postings.setdefault(gram, set()).add(name)
+
+    def column_member(self, column: str) -> Optional[Dict[str, Any]]:
+        """Member of a /v1/load result column, e.g. "Orders.createdAt" for "Orders.createdAt.day"."""
+        member = self.members.get(column)
+        if member is None and column.count(".") == 2:
+            member = self.members.get(column.rsplit(".", 1)[0])
+        return member
+
+    def with_prefix(self, prefix: str) -> List[str]:
+        prefix = prefix.lower()
+        start = bisect.bisect_left(self._sorted, prefix)
+        names = []
+        for lower in self._sorted[start:]:
+            if not lower.startswith(prefix):
+                break
+            names.append(self._by_lower[lower])
+        return names
+
+    def suggest(self, name: str, kinds: Sequence[str] = MEMBER_KINDS, limit: int = 3) -> List[str]:
+        """Member names of the given kinds that look most like ``name``.
+
+        Names ``name`` is a prefix of come first, then names sharing the
+        most trigrams with it.
+        """
+        found = [n for n in self.with_prefix(name) if self.members[n]["kind"] in kinds][:limit]
+        # Stay within the named cube if there is one.
+        cube = name.split(".", 1)[0].lower() if "." in name else None
+        if cube not in self.cubes:
+            cube = None
+        grams = _trigrams(_short(name))
+        candidates: Set[str] = set()
+        for gram in grams:
+            candidates |= self._postings.get(gram, set())
+        scored = []
+        for candidate in candidates:
+            member = self.members[candidate]
+            if member["kind"] not in kinds or (cube and member["cube"].lower() != cube):
+                continue
+            score = _similarity(grams, self._grams[candidate])
+            if score >= _SUGGEST_THRESHOLD:
+                scored.append((-score, candidate))
+        found += [candidate for _, candidate in sorted(scored) if candidate not in found]
+        return found[:limit]
+
+    def _check(self, name: Any, kinds: Sequence[str], field: str, errors: List[str]) -> None:
+        if not isinstance(name, str):
+            errors.append(f"{field} entries must be member names, got {name!r}")
+            return
+        member = self.members.get(name)
+        if member is not None and member["kind"] in kinds:
+            return
+        wanted = " or ".join(kinds)
+        if member is not None:
+            errors.append(f"{name} is a {member['kind']}, not a {wanted} (in {field})")
+            return
+        suggestions = self.suggest(name, kinds)
+        message = f"Unknown {wanted} {name} (in {field})"
+        if suggestions:
+            message += f". Did you mean: {', '.join(suggestions)}?"
+        errors.append(message)
+
+    def _check_filters(self, filters: Iterable[Any], errors: List[str]) -> None:
+        for f in filters:
+            if not isinstance(f, dict):
+                continue
+            if "or" in f or "and" in f:
+                self._check_filters(f.get("or", f.get("and")) or [], errors)
+            elif "member" in f:
+                self._check(f["member"], ("measure", "dimension"), "filters", errors)
+            elif "dimension" in f:
+                self._check(f["dimension"], ("dimension",), "filters", errors)
+
+    def validate_query(self, query: Dict[str, Any]) -> None:
+        """Raise ``ValueError`` listing every member of ``query`` the schema does not have."""
+        errors: List[str] = []
+        for field, kinds in _QUERY_FIELDS.items():
+            for name in query.get(field) or []:
+                self._check(name, kinds, field, errors)
+        for td in query.get("timeDimensions") or []:
+            if isinstance(td, dict):
+                self._check(td.get("dimension"), ("dimension",), "timeDimensions", errors)
+        self._check_filters(query.get("filters") or [], errors)
+        order = query.get("order") or {}
+        for item in order.items() if isinstance(order, dict) else order:
+            if isinstance(item, (list, tuple)) and item:
+                self._check(item[0], ("measure", "dimension"), "order", errors)
+        if errors:
+            raise ValueError("; ".join(errors))
+
+    def search(self, text: str = "", kinds: Sequence[str] = MEMBER_KINDS, cube: Optional[str] = None,
+               limit: int = 20) -> List[Dict[str, Any]]:
+        """Members matching ``text`` by name, title or description, best matches first.
+
+        Exact and prefix matches on the member name rank first, then
+        substring matches on name, title or description, then names that
+        are merely similar.
+        """
+        words = text.lower().split()
+        cube = cube.lower() if cube else None
+        grams = _trigrams(_short(text)) if text else set()
+        ranked = []
+        for name, member in self.members.items():
+            if member["kind"] not in kinds or (cube and member["cube"].lower() != cube):
+                continue
+            if not words:
+                ranked.append((0, 0.0, name))
+                continue
+            short = _short(name).lower()
+            lower = name.lower()
+            haystack = " ".join(
+                str(member.get(key) or "") for key in ("name", "title", "shortTitle", "description")
+            ).lower()
+            if text.lower() in (short, lower):
+                rank = 0
+            elif short.startswith(text.lower()) or lower.startswith(text.lower()):
+                rank = 1
+            elif all(word in haystack for word in words):
+                rank = 2
+            else:
+                similarity = _similarity(grams, self._grams[name])
+                if similarity < _SUGGEST_THRESHOLD:
+                    continue
+                ranked.append((3, -similarity, name))
+                continue
+            ranked.append((rank, 0.0, name))
+        ranked.sort()
+        return [self.members[name] for _, _, name in ranked[:limit]]
+
+    def describe(self, members: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """Group ``members`` by cube, in the shape of a /v1/meta response."""
+        cubes: Dict[str, Dict[str, Any]] = {}
+        for member in members:
+            cube = cubes.get(member["cube"])
+            if cube is None:
+                cube = cubes[member["cube"]] = {**self.cube_info[member["cube"]]}
+            entry = {key: value for key, value in member.items() if key not in ("kind", "cube")}
+            cube.setdefault(f"{member['kind']}s", []).append(entry)
+        return {"cubes": list(cubes.values())}
@@ -0,0 +1,191 @@
+"""
+Stateless Streamable HTTP transport for the MCP server
+
+Each POST carries one JSON-RPC message, or a batch of them, and is
+answered in the same HTTP response: there is no long-lived event stream
+and no per-session state on the server. Requests of a batch run
+concurrently; when the client accepts ``text/event-stream``, each
+response is sent as an event as soon as it is ready. Batches are refused
+under protocol revisions that dropped them.
+"""
+
+import asyncio
+import json
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Union, cast
+
+from mcp import types
+from mcp.server import Server, request_ctx
+from mcp.server.models import InitializationOptions
+from mcp.server.session import ServerSession
+from mcp.shared.context import RequestContext
+from mcp.shared.exceptions import McpError
+from pydantic import ValidationError
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response, StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+# Revisions whose initialize handshake this transport answers; the last is
+# offered to clients asking for anything else.
+PROTOCOL_VERSIONS = ("2024-11-05", "2025-03-26", "2025-06-18")
+DEFAULT_PROTOCOL_VERSION = "2025-03-26"
+# 2025-06-18 dropped JSON-RPC batching; clients send the negotiated
+# revision in the MCP-Protocol-Version header, 2025-03-26 if absent.
+BATCH_PROTOCOL_VERSIONS = ("2024-11-05", "2025-03-26")
+
+
+class HTTPClient:
+    """Stands in for the MCP session of a stateless request.
+
+    Requests from the same client (its ``Mcp-Session-Id`` header, else its
+    address) compare equal, so the scheduler queues them together.
+    """
+
+    __slots__ = ("key",)
+
+    def __init__(self, key: str):
+        self.key = key
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, HTTPClient) and other.key == self.key
+
+    def __hash__(self) -> int:
+        return hash(self.key)
+
+
+def _error(request_id: Any, code: int, message: str) -> Dict[str, Any]:
+    return {"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": message}}
+
+
+class StatelessHTTPTransport:
+    """Serves the handlers registered on ``server`` over stateless Streamable HTTP."""
+
+    def __init__(self, server: Server, init_options: InitializationOptions,
+                 on_initialize: Optional[Callable[[], None]] = None):
+        self.server = server
+        self.init_options = init_options
+        # Called when a client initializes, as a new SSE session would.
+        self.on_initialize = on_initialize
+        self.stats = {"requests": 0, "batches": 0, "notifications": 0, "errors": 0}
+
+    def _initialize(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        requested = params.get("protocolVersion")
+        return {
+            "protocolVersion": requested if requested in PROTOCOL_VERSIONS else DEFAULT_PROTOCOL_VERSION,
+            "capabilities": self.init_options.capabilities.model_dump(
+                by_alias=True, mode="json", exclude_none=True
+            ),
+            "serverInfo": {"name": self.init_options.server_name, "version": self.init_options.server_version},
+        }
+
+    async def _dispatch(self, message: Dict[str, Any], client: HTTPClient) -> Dict[str, Any]:
+        """Run one JSON-RPC request through the server's handlers; returns the response message."""
+        request_id = message["id"]
+        method = message["method"]
+        params = message.get("params") or {}
+        if method == "initialize":
+            if self.on_initialize is not None:
+                self.on_initialize()
+            return {"jsonrpc": "2.0", "id": request_id, "result": self._initialize(params)}
+        if method == "ping":
+            return {"jsonrpc": "2.0", "id": request_id, "result": {}}
+
+        try:
+            request = types.ClientRequest.model_validate({"method": method, "params": message.get("params")})
+        except ValidationError:
+            known = any(
+                method in cast(Any, t).model_fields["method"].annotation.__args__
+                for t in self.server.request_handlers
+            )
+            if not known:
+                return _error(request_id, types.METHOD_NOT_FOUND, "Method not found")
+            return _error(request_id, types.INVALID_PARAMS, f"Invalid params for {method}")
+        handler = self.server.request_handlers.get(type(request.root))
+        if handler is None:
+            return _error(request_id, types.METHOD_NOT_FOUND, "Method not found")
+
+        meta = params.get("_meta")
+        token = request_ctx.set(RequestContext(
+            request_id, types.RequestParams.Meta.model_validate(meta) if meta else None,
+            cast(ServerSession, client)
+        ))
+        response: Union[types.ServerResult, types.ErrorData]
+        try:
+            response = await handler(request.root)
+        except McpError as err:
+            response = err.error
+        except Exception as err:
+            response = types.ErrorData(code=0, message=str(err), data=None)
+        finally:
+            request_ctx.reset(token)
+
+        if isinstance(response, types.ErrorData):
+            self.stats["errors"] += 1
+            return {"jsonrpc": "2.0", "id": request_id,
+                    "error": response.model_dump(by_alias=True, mode="json", exclude_none=True)}
+        return {"jsonrpc": "2.0", "id": request_id,
+                "result": response.model_dump(by_alias=True, mode="json", exclude_none=True)}
+
+    async def handle_request(self, request: Request) -> Response:
+        if request.method != "POST":
+            # Stateless: there is no server-initiated stream to GET and no session to DELETE.
+            return PlainTextResponse("Method Not Allowed", status_code=405, headers={"Allow": "POST"})
+        try:
+            body = json.loads(await request.body())
+        except ValueError:
+            logger.warning("Rejected a Streamable HTTP request with an invalid JSON body")
+            return Response(json.dumps(_error(None, types.PARSE_ERROR, "Parse error")), status_code=400,
+                            media_type="application/json")
+
+        batch = isinstance(body, list)
+        version = request.headers.get("mcp-protocol-version", DEFAULT_PROTOCOL_VERSION)
+        if batch and version not in BATCH_PROTOCOL_VERSIONS:
+            logger.warning(f"Rejected a JSON-RPC batch under protocol version {version}")
+            return Response(
+                json.dumps(_error(None, types.INVALID_REQUEST, f"Protocol version {version} does not allow batches")),
+                status_code=400, media_type="application/json",
+            )
+        client = HTTPClient(
+            request.headers.get("mcp-session-id") or (request.client.host if request.client else "")
+        )
+        ready: List[Dict[str, Any]] = []
+        pending: List[Dict[str, Any]] = []
+        for message in body if batch else [body]:
+            if not isinstance(message, dict) or message.get("jsonrpc") != "2.0":
+                ready.append(_error(None, types.INVALID_REQUEST, "Invalid request"))
+            elif "method" in message and "id" in message:
+                pending.append(message)
+            else:
+                # Notifications (e.g. notifications/initialized) and client responses need no reply.
+                self.stats["notifications"] += 1
+        if not pending and not ready:
+            return Response(status_code=202)
+        self.stats["requests"] += len(pending)
+        if batch:
+            self.stats["batches"] += 1
+
+        accept = request.headers.get("accept", "")
+        if batch and len(pending) > 1 and "text/event-stream" in accept:
+            return StreamingResponse(self._stream(pending, ready, client), media_type="text/event-stream",
+                                     headers={"Cache-Control": "no-cache"})
+
+        responses = ready + list(await asyncio.gather(*(self._dispatch(m, client) for m in pending)))
+        payload: Union[Dict[str, Any], List[Dict[str, Any]]] = responses if batch else responses[0]
+        return Response(json.dumps(payload), media_type="application/json")
+
+    async def _stream(self, pending: List[Dict[str, Any]], ready: List[Dict[str, Any]],
+                      client: HTTPClient) -> AsyncIterator[str]:
+        for message in ready:
+            yield f"event: message\ndata: {json.dumps(message)}\n\n"
+        tasks = [asyncio.ensure_future(self._dispatch(m, client)) for m in pending]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield f"event: message\ndata: {json.dumps(await next_done)}\n\n"
+        finally:
+            # The client went away; stop the requests still running.
+            for task in tasks:
+                task.cancel()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return dict(self.stats)
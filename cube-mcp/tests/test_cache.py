@@ -0,0 +1,87 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from cache import ResultCache, canonical_query, canonical_sql
+
+
+def test_member_order_is_part_of_the_key():
+    a = {"measures": ["Orders.count", "Orders.total"], "limit": 5}
+    b = {"measures": ["Orders.total", "Orders.count"], "limit": 5}
+    assert canonical_query(a) != canonical_query(b)
+    assert canonical_query({"dimensions": ["A.x", "A.y"]}) != canonical_query({"dimensions": ["A.y", "A.x"]})
+    td = [{"dimension": "A.t", "granularity": "day"}, {"dimension": "A.u", "granularity": "month"}]
+    assert canonical_query({"timeDimensions": td}) != canonical_query({"timeDimensions": td[::-1]})
+
+
+def test_order_sequence_is_kept():
+    a = {"measures": ["A.m"], "order": {"A.m": "desc", "A.x": "asc"}}
+    b = {"measures": ["A.m"], "order": {"A.x": "asc", "A.m": "desc"}}
+    assert canonical_query(a) != canonical_query(b)
+
+
+def test_set_valued_parts_are_sorted():
+    f1 = {"member": "A.x", "operator": "equals", "values": ["b", "a"]}
+    f2 = {"member": "A.y", "operator": "gt", "values": ["3"]}
+    a = {"measures": ["A.m"], "segments": ["A.s2", "A.s1"], "filters": [f1, f2]}
+    b = {"filters": [f2, {**f1, "values": ["a", "b"]}], "segments": ["A.s1", "A.s2"], "measures": ["A.m"]}
+    assert canonical_query(a) == canonical_query(b)
+
+
+def test_ordered_filter_values_are_kept():
+    a = {"filters": [{"member": "A.t", "operator": "inDateRange", "values": ["2024-01-01", "2024-02-01"]}]}
+    b = {"filters": [{"member": "A.t", "operator": "inDateRange", "values": ["2024-02-01", "2024-01-01"]}]}
+    assert canonical_query(a) != canonical_query(b)
+
+
+def test_boolean_filters_are_sorted_recursively():
+    x = {"member": "A.x", "operator": "equals", "values": ["1"]}
+    y = {"member": "A.y", "operator": "equals", "values": ["2"]}
+    assert canonical_query({"filters": [{"or": [x, y]}]}) == canonical_query({"filters": [{"or": [y, x]}]})
+
+
+def test_canonical_sql():
+    assert canonical_sql("SELECT  a\n FROM t;") == canonical_sql("select a from T")
+    assert canonical_sql("SELECT 'A'") != canonical_sql("SELECT 'a'")
+
+
+class _LockedDisk:
+    """Stands in for a SQLite connection another worker holds the lock of."""
+
+    def execute(self, *args):
+        raise sqlite3.OperationalError("database is locked")
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_invalidate_clears_memory_and_disk(tmp_path):
+    cache = ResultCache(disk_path=str(tmp_path / "results.db"))
+
+    async def load():
+        return "text"
+
+    await cache.get_or_load("key", load)
+    await asyncio.sleep(0.05)  # the disk write runs in the background
+    assert cache._get_disk("key") is not None
+    await cache.invalidate()
+    assert cache.snapshot()["entries"] == 0
+    assert cache._get_disk("key") is None
+    cache.close()
+    # Reads after close are misses.
+    assert cache._get_disk("key") is None
+
+
+@pytest.mark.asyncio
+async def test_invalidate_survives_a_locked_disk(tmp_path):
+    cache = ResultCache(disk_path=str(tmp_path / "results.db"))
+    cache.close()
+    cache._disk = _LockedDisk()
+    cache._entries["key"] = (float("inf"), 4, "text")
+    await cache.invalidate()
+    assert cache.snapshot()["entries"] == 0
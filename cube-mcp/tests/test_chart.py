@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from chart import ChartBuilder, bucket_time
+
+COLUMNS = ["day", "region", "amount"]
+ROWS = [
+    ("2024-01-01T08:00:00", "north", 10),
+    ("2024-01-01T17:30:00", "north", None),
+    ("2024-01-01T12:00:00", "south", 4),
+    ("2024-01-02T09:00:00", "north", 6),
+    ("2024-01-02T10:00:00", "north", 2),
+    ("2024-01-02T11:00:00", "south", None),
+]
+
+
+def chart(agg, **options):
+    builder = ChartBuilder(COLUMNS, "day", ["amount"], series="region", agg=agg, granularity="day", **options)
+    builder.add_rows(ROWS)
+    return {trace["name"]: trace["y"] for trace in json.loads(builder.finish())["data"]}
+
+
+@pytest.mark.parametrize("agg, expected", [
+    ("sum", {"north": [10, 8], "south": [4, None]}),
+    ("avg", {"north": [10, 4], "south": [4, None]}),
+    ("min", {"north": [10, 2], "south": [4, None]}),
+    ("max", {"north": [10, 6], "south": [4, None]}),
+    # Nulls are not counted, but a point with only nulls is there with 0.
+    ("count", {"north": [1, 2], "south": [1, 0]}),
+])
+def test_aggregations_skip_nulls(agg, expected):
+    assert chart(agg) == expected
+
+
+def test_missing_points_are_filled():
+    builder = ChartBuilder(COLUMNS, "day", ["amount"], series="region", granularity="day", fill=0)
+    builder.add_rows([row for row in ROWS if row[2] is not None])
+    assert {trace["name"]: trace["y"] for trace in builder.traces()} == {"north": [10, 8], "south": [4, 0]}
+
+
+@pytest.mark.parametrize("granularity, expected", [
+    ("hour", "2024-05-15T13:00:00"),
+    ("week", "2024-05-13"),
+    ("quarter", "2024-04-01"),
+])
+def test_bucket_time(granularity, expected):
+    assert bucket_time("2024-05-15T13:45:10Z", granularity).startswith(expected)
+
+
+def test_unknown_columns_are_rejected():
+    with pytest.raises(ValueError, match="Unknown column"):
+        ChartBuilder(COLUMNS, "day", ["total"])
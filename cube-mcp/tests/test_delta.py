@@ -0,0 +1,179 @@
+import datetime
+
+import pytest
+
+from delta import SeriesQuery, TimeSeriesCache, bucket_start, next_bucket, resolve_relative
+
+D = datetime.date
+TODAY = D(2024, 5, 15)  # a Wednesday
+
+
+def series_query(date_range, granularity="day", **extra):
+    return {
+        "measures": ["Orders.count"],
+        "timeDimensions": [{"dimension": "Orders.createdAt", "granularity": granularity, "dateRange": date_range}],
+        **extra,
+    }
+
+
+def response(days, granularity="day"):
+    return {
+        "query": {},
+        "data": [{f"Orders.createdAt.{granularity}": f"{day.isoformat()}T00:00:00.000", "Orders.count": day.day}
+                 for day in days],
+    }
+
+
+@pytest.mark.parametrize("granularity, day, start, following", [
+    ("day", D(2024, 5, 15), D(2024, 5, 15), D(2024, 5, 16)),
+    ("week", D(2024, 5, 15), D(2024, 5, 13), D(2024, 5, 20)),
+    ("month", D(2024, 12, 31), D(2024, 12, 1), D(2025, 1, 1)),
+    ("quarter", D(2024, 11, 5), D(2024, 10, 1), D(2025, 1, 1)),
+    ("year", D(2024, 5, 15), D(2024, 1, 1), D(2025, 1, 1)),
+])
+def test_buckets(granularity, day, start, following):
+    assert bucket_start(day, granularity) == start
+    assert next_bucket(start, granularity) == following
+
+
+@pytest.mark.parametrize("date_range, expected", [
+    ("today", (D(2024, 5, 15), D(2024, 5, 15))),
+    ("yesterday", (D(2024, 5, 14), D(2024, 5, 14))),
+    ("this week", (D(2024, 5, 13), D(2024, 5, 19))),
+    ("this month", (D(2024, 5, 1), D(2024, 5, 31))),
+    ("this quarter", (D(2024, 4, 1), D(2024, 6, 30))),
+    ("this year", (D(2024, 1, 1), D(2024, 12, 31))),
+    ("last week", (D(2024, 5, 6), D(2024, 5, 12))),
+    ("last month", (D(2024, 4, 1), D(2024, 4, 30))),
+    ("last quarter", (D(2024, 1, 1), D(2024, 3, 31))),
+    ("last year", (D(2023, 1, 1), D(2023, 12, 31))),
+    ("last 7 days", (D(2024, 5, 8), D(2024, 5, 14))),
+    ("Last 2 weeks", (D(2024, 4, 29), D(2024, 5, 12))),
+    ("last 6 months", (D(2023, 11, 1), D(2024, 4, 30))),
+    ("last 1 year", (D(2023, 1, 1), D(2023, 12, 31))),
+    ("last 0 days", None),
+    ("this 2 weeks", None),
+    ("next week", None),
+    ("from 7 days ago to now", None),
+])
+def test_resolve_relative(date_range, expected):
+    assert resolve_relative(date_range, TODAY) == expected
+
+
+def test_parse_resolves_relative_ranges():
+    sq = SeriesQuery.parse(series_query("last 7 days"), today=TODAY)
+    assert (sq.start, sq.end) == (D(2024, 5, 8), D(2024, 5, 14))
+    assert len(sq.buckets) == 7
+    # Fetched ranges are absolute.
+    assert sq.subquery(D(2024, 5, 13), D(2024, 5, 14))["timeDimensions"][0]["dateRange"] == ["2024-05-13", "2024-05-14"]
+    # Relative and absolute forms of a range share buckets.
+    absolute = SeriesQuery.parse(series_query(["2024-05-08", "2024-05-14"]))
+    assert sq.series == absolute.series
+
+
+def test_parse_current_day_in_query_timezone():
+    sq = SeriesQuery.parse(series_query("today", timezone="Pacific/Kiritimati"))
+    assert sq.start == datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=14))).date()
+    assert SeriesQuery.parse(series_query("today", timezone="Not/AZone")) is None
+
+
+@pytest.mark.parametrize("query", [
+    series_query(["2024-05-01", "2024-05-31"], limit=10),
+    series_query(["2024-05-01", "2024-05-31"], offset=10),
+    series_query(["2024-05-01", "2024-05-31"], order={"Orders.count": "desc"}),
+    series_query(["2024-05-01", "2024-05-31"], granularity="hour"),
+    series_query(["2024-05-01T06:00:00", "2024-05-31"]),
+    series_query(["2024-05-31", "2024-05-01"]),
+    series_query("from 7 days ago to now"),
+    {"measures": ["Orders.count"], "timeDimensions": [{"dimension": "Orders.createdAt", "dateRange": "today"}]},
+])
+def test_parse_rejects(query):
+    assert SeriesQuery.parse(query, today=TODAY) is None
+
+
+def test_parse_rejects_cumulative_measures():
+    query = series_query(["2024-05-01", "2024-05-31"])
+    assert SeriesQuery.parse(query) is not None
+    assert SeriesQuery.parse(query, cumulative=["Orders.count"]) is None
+
+
+def test_partial_edges_are_always_fetched():
+    cache = TimeSeriesCache(settle=0)
+    # Mid-week to mid-week: both edge weeks are partial.
+    sq = SeriesQuery.parse(series_query(["2024-04-03", "2024-04-24"], granularity="week"))
+    weeks = sq.buckets
+    assert weeks[0] == D(2024, 4, 1) and sq.partial(weeks[0]) and sq.partial(weeks[-1])
+    cache.merge(sq, [((weeks[0], weeks[-1]), response(weeks, "week"))])
+    assert cache.missing(sq) == [weeks[0], weeks[-1]]
+    # Partial edges are fetched with the range's own bounds.
+    assert sq.subquery(weeks[0], weeks[0])["timeDimensions"][0]["dateRange"] == ["2024-04-03", "2024-04-07"]
+
+
+def test_moving_range_reuses_cached_buckets():
+    cache = TimeSeriesCache(settle=0)
+    first = SeriesQuery.parse(series_query(["2024-05-01", "2024-05-10"]))
+    assert cache.missing(first) == first.buckets
+    result = cache.merge(first, [((first.buckets[0], first.buckets[-1]), response(first.buckets))])
+    assert len(result["data"]) == 10
+
+    second = SeriesQuery.parse(series_query(["2024-05-03", "2024-05-12"], order={"Orders.createdAt": "desc"}))
+    missing = cache.missing(second)
+    assert missing == [D(2024, 5, 11), D(2024, 5, 12)]
+    ranges = cache.fetch_ranges(second, missing)
+    assert ranges == [(D(2024, 5, 11), D(2024, 5, 12))]
+    result = cache.merge(second, [(ranges[0], response(missing))])
+    assert [row["Orders.count"] for row in result["data"]] == list(range(12, 2, -1))
+    assert cache.stats["partial_hits"] == 1 and cache.stats["buckets_reused"] == 8
+
+
+def test_open_buckets_are_not_stored():
+    cache = TimeSeriesCache(settle=3600)
+    today = datetime.date.today()
+    sq = SeriesQuery.parse(series_query([today.isoformat(), today.isoformat()]))
+    cache.merge(sq, [((today, today), response([today]))])
+    assert cache.missing(sq) == [today]
+
+
+def test_fetch_ranges_groups_contiguous_buckets():
+    sq = SeriesQuery.parse(series_query(["2024-05-01", "2024-05-31"]))
+    cache = TimeSeriesCache()
+    days = [D(2024, 5, d) for d in (1, 2, 5, 6, 7, 20)]
+    assert cache.fetch_ranges(sq, days) == [(days[0], days[1]), (days[2], days[4]), (days[5], days[5])]
+    scattered = [D(2024, 5, d) for d in (1, 3, 5, 7, 9)]
+    assert cache.fetch_ranges(sq, scattered) == [(scattered[0], scattered[-1])]
+
+
+def test_rows_without_bucket_values_are_not_split():
+    cache = TimeSeriesCache(settle=0)
+    sq = SeriesQuery.parse(series_query(["2024-05-01", "2024-05-02"]))
+    assert cache.merge(sq, [((sq.buckets[0], sq.buckets[-1]), {"data": [{"Orders.count": 3}]})]) is None
+
+
+def test_ranges_at_the_row_limit_are_not_cached():
+    cache = TimeSeriesCache(settle=0, row_limit=5)
+    sq = SeriesQuery.parse(series_query(["2024-05-01", "2024-05-10"]))
+    assert sq.subquery(sq.buckets[0], sq.buckets[-1], limit=cache.row_limit)["limit"] == 5
+    # Five rows reach the limit, which may have cut more: not split, not stored.
+    short = response(sq.buckets[:5])
+    assert cache.merge(sq, [((sq.buckets[0], sq.buckets[-1]), short)]) is None
+    assert cache.stats["overflows"] == 1
+    assert cache.missing(sq) == sq.buckets
+    assert cache.merge(sq, [((sq.buckets[0], sq.buckets[3]), response(sq.buckets[:4])),
+                            ((sq.buckets[4], sq.buckets[-1]), response(sq.buckets[4:8]))]) is not None
+
+
+def test_bytes_bound_evicts_least_recent_series():
+    one_series = len(response([D(2024, 5, d) for d in range(1, 11)])["data"]) * 60
+    cache = TimeSeriesCache(settle=0, max_bytes=int(one_series * 1.5))
+    queries = []
+    for measure in ("Orders.count", "Orders.total"):
+        sq = SeriesQuery.parse({**series_query(["2024-05-01", "2024-05-10"]), "measures": [measure]})
+        cache.merge(sq, [((sq.buckets[0], sq.buckets[-1]), response(sq.buckets))])
+        queries.append(sq)
+    snapshot = cache.snapshot()
+    assert snapshot["series"] == 1 and 0 < snapshot["bytes"] <= cache.max_bytes
+    assert cache.stats["evictions"] == 1
+    assert cache.missing(queries[0]) == queries[0].buckets
+    assert cache.missing(queries[1]) == []
+    cache.invalidate()
+    assert cache.snapshot()["bytes"] == 0
@@ -0,0 +1,142 @@
+import asyncio
+
+import httpx
+import pytest
+import pytest_asyncio
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+import uvicorn
+
+from dispatcher import Dispatcher, merge_metrics, worker_prefix
+
+
+def worker_app(index, gate):
+    """Stand-in for a worker: says which worker answered."""
+    async def stats(request):
+        return JSONResponse({"worker": index})
+
+    async def message(request):
+        return JSONResponse({"worker": index, "body": (await request.body()).decode()}, status_code=202)
+
+    async def mcp(request):
+        await gate.wait()
+        return JSONResponse({"worker": index})
+
+    async def invalidate(request):
+        return JSONResponse({"invalidated": ["schema", "results"] if index == 0 else ["schema", "delta"]})
+
+    return Starlette(routes=[
+        Route("/stats", endpoint=stats),
+        Route(f"{worker_prefix(index)}/messages/", endpoint=message, methods=["POST"]),
+        Route("/mcp", endpoint=mcp, methods=["POST"]),
+        Route("/cache/invalidate", endpoint=invalidate, methods=["POST"]),
+    ])
+
+
+class _Running:
+    """Process stand-in for a worker served in this event loop."""
+
+    pid = 0
+    exitcode = None
+
+    def __init__(self, server, task):
+        self.server = server
+        self.task = task
+
+    def is_alive(self):
+        return not self.task.done()
+
+    def terminate(self):
+        self.server.should_exit = True
+
+    kill = terminate
+
+    def join(self, timeout=None):
+        pass
+
+
+@pytest_asyncio.fixture
+async def dispatcher(tmp_path, monkeypatch):
+    gate = asyncio.Event()
+    dispatcher = Dispatcher(2, target=None, runtime_dir=str(tmp_path))
+
+    def spawn(index):
+        config = uvicorn.Config(worker_app(index, gate), uds=dispatcher.sockets[index], log_level="warning",
+                                lifespan="off")
+        server = uvicorn.Server(config)
+        dispatcher._processes[index] = _Running(server, asyncio.create_task(server.serve()))
+
+    monkeypatch.setattr(dispatcher, "_spawn", spawn)
+    dispatcher.gate = gate
+    await dispatcher.start()
+    yield dispatcher
+    gate.set()
+    await dispatcher.stop()
+    await asyncio.gather(*(process.task for process in dispatcher._processes))
+
+
+def front(dispatcher):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=dispatcher.create_app()), base_url="http://front")
+
+
+@pytest.mark.asyncio
+async def test_messages_reach_the_worker_of_their_prefix(dispatcher):
+    async with front(dispatcher) as client:
+        for index in (1, 0, 1):
+            response = await client.post(f"/w{index}/messages/?session_id=abc", content=b"{}")
+            assert response.status_code == 202
+            assert response.json() == {"worker": index, "body": "{}"}
+        assert (await client.post("/w2/messages/", content=b"{}")).status_code == 404
+    assert dispatcher.stats["messages"] == 3
+
+
+@pytest.mark.asyncio
+async def test_mcp_requests_go_to_the_least_busy_worker(dispatcher):
+    async with front(dispatcher) as client:
+        calls = [asyncio.create_task(client.post("/mcp", content=b"{}")) for _ in range(2)]
+        for _ in range(50):
+            if sum(dispatcher.requests) == 2:
+                break
+            await asyncio.sleep(0.01)
+        # Both held in flight at once, one on each worker.
+        assert dispatcher.requests == [1, 1]
+        dispatcher.gate.set()
+        responses = await asyncio.gather(*calls)
+    assert sorted(response.json()["worker"] for response in responses) == [0, 1]
+    assert dispatcher.requests == [0, 0]
+
+
+@pytest.mark.asyncio
+async def test_stats_and_invalidate_cover_every_worker(dispatcher):
+    async with front(dispatcher) as client:
+        stats = (await client.get("/stats")).json()
+        assert stats["workers"] == [{"worker": 0}, {"worker": 1}]
+        assert stats["dispatcher"]["alive"] == 2
+        invalidated = (await client.post("/cache/invalidate")).json()
+    assert invalidated == {"invalidated": ["schema", "results", "delta"], "workers": 2, "failed": 0}
+
+
+@pytest.mark.asyncio
+async def test_unavailable_worker_is_a_bad_gateway(dispatcher):
+    process = dispatcher._processes[1]
+    process.terminate()
+    await process.task
+    async with front(dispatcher) as client:
+        response = await client.post("/w1/messages/", content=b"{}")
+        assert response.status_code == 502
+        assert (await client.post("/w0/messages/", content=b"{}")).status_code == 202
+    assert dispatcher.stats["worker_errors"] == 1
+
+
+def test_merge_metrics_labels_each_worker():
+    text = "# HELP up Up\n# TYPE up gauge\nup 1\nreq{path=\"/mcp\"} 3\n"
+    merged = merge_metrics([("0", text), ("1", text)])
+    assert merged.splitlines() == [
+        "# HELP up Up",
+        "# TYPE up gauge",
+        'up{worker="0"} 1',
+        'req{worker="0",path="/mcp"} 3',
+        'up{worker="1"} 1',
+        'req{worker="1",path="/mcp"} 3',
+    ]
@@ -0,0 +1,56 @@
+import decimal
+import json
+
+import pytest
+
+import encoding
+from encoding import ResultEncoder, dumps, plain_value
+
+D = decimal.Decimal
+
+
+def strict_loads(text):
+    def reject(constant):
+        raise ValueError(f"invalid JSON constant {constant}")
+    return json.loads(text, parse_constant=reject)
+
+
+@pytest.fixture(params=["orjson", "stdlib"])
+def backend(request, monkeypatch):
+    if request.param == "stdlib":
+        monkeypatch.setattr(encoding, "orjson", None)
+    elif encoding.orjson is None:
+        pytest.skip("orjson is not installed")
+    return request.param
+
+
+def test_decimals(backend):
+    assert json.loads(dumps([D("3"), D("3.50"), D("-0.25")])) == [3, 3.5, -0.25]
+
+
+@pytest.mark.parametrize("value", [D("Infinity"), D("-Infinity"), D("NaN"), D("sNaN")])
+def test_non_finite_decimals_encode_as_null(backend, value):
+    assert json.loads(dumps({"x": value})) == {"x": None}
+    assert plain_value(value) is None
+
+
+def test_non_finite_decimals_in_rows(backend):
+    encoder = ResultEncoder(["a", "b"], "rows")
+    encoder.add_rows([(D("1.5"), D("Infinity")), (D("NaN"), 2)])
+    assert json.loads(encoder.finish())["rows"] == [[1.5, None], [None, 2]]
+    encoder = ResultEncoder(["a"], "csv")
+    encoder.add_row((D("-Infinity"),))
+    assert encoder.finish() == "a\n\"\"\n"
+
+
+@pytest.mark.parametrize("value", [float("nan"), float("inf"), float("-inf")])
+def test_non_finite_floats_encode_as_null(backend, value):
+    text = dumps({"x": value, "rows": [[1.5, value]], "t": (value,)}, indent=True)
+    assert strict_loads(text) == {"x": None, "rows": [[1.5, None]], "t": [None]}
+    encoder = ResultEncoder(["a"], "json")
+    encoder.add_row((value,))
+    assert strict_loads(encoder.finish(summary={"mean": value}))["summary"] == {"mean": None}
+
+
+def test_wide_integers_fall_back_to_stdlib(backend):
+    assert strict_loads(dumps({"n": 2 ** 70, "x": float("nan")})) == {"n": 2 ** 70, "x": None}
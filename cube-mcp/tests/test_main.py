@@ -0,0 +1,82 @@
+import json
+
+import pytest
+from mcp.server import request_ctx
+from mcp.shared.context import RequestContext
+
+from main import CubeJSMCPServer
+
+
+@pytest.fixture
+def server():
+    # Nothing listens on port 1: any upstream call fails fast.
+    return CubeJSMCPServer(base_url="http://127.0.0.1:1", cubesql_host="127.0.0.1", cubesql_port=1)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("page_size", [-1, 0, 1.5, True, "10"])
+async def test_paged_cubesql_rejects_bad_page_sizes(server, page_size):
+    with pytest.raises(ValueError, match="page_size must be a positive integer"):
+        await server._execute_cubesql("SELECT a FROM t ORDER BY a", mode="paged", page_size=page_size)
+
+
+@pytest.mark.asyncio
+async def test_paged_cubesql_needs_order_by(server):
+    with pytest.raises(ValueError, match="ORDER BY"):
+        await server._execute_cubesql("SELECT a FROM t", mode="paged", page_size=10)
+
+
+@pytest.mark.asyncio
+async def test_batch_isolates_failing_queries(server, monkeypatch):
+    calls = []
+
+    async def run_tool(name, arguments):
+        calls.append((name, arguments["query"]))
+        if arguments["query"] == "SELECT broken":
+            raise RuntimeError("column broken does not exist")
+        return [{"type": "text", "text": json.dumps({"data": [arguments["query"]]})}]
+
+    monkeypatch.setattr(server, "_run_tool", run_tool)
+    token = request_ctx.set(RequestContext(1, None, "session"))
+    try:
+        content = await server._execute_batch([
+            {"id": "a", "tool": "cubejs_sql", "query": "SELECT 1"},
+            {"id": "b", "tool": "cubejs_nope", "query": "SELECT 1"},
+            {"id": "c", "tool": "cubejs_sql", "query": "SELECT broken"},
+            {"tool": "cubejs_load"},
+            {"id": "e", "tool": "cubejs_sql", "query": "select  1"},
+        ])
+    finally:
+        request_ctx.reset(token)
+    result = json.loads(content[0]["text"])
+    assert result["succeeded"] == 2 and result["failed"] == 3
+    by_id = {entry["id"]: entry for entry in result["results"]}
+    assert by_id["a"]["result"] == {"data": ["SELECT 1"]}
+    assert by_id["b"]["error"].startswith("tool must be one of")
+    assert by_id["c"]["error"] == "column broken does not exist"
+    assert by_id["3"]["error"] == "Query parameter is required"
+    # The same statement, spelt differently, ran once.
+    assert by_id["e"]["result"] == by_id["a"]["result"]
+    assert calls == [("cubejs_sql", "SELECT 1"), ("cubejs_sql", "SELECT broken")]
+
+
+class _Connection:
+    def __init__(self):
+        self.queries = []
+
+    async def fetchval(self, query, timeout=None):
+        self.queries.append((query, timeout))
+        return 1
+
+
+@pytest.mark.asyncio
+async def test_pooled_connections_are_checked_only_after_the_pool_idled(server, monkeypatch):
+    conn = _Connection()
+    server._cubesql_last_release = 1000.0
+    monkeypatch.setattr("main.time.monotonic", lambda: 1000.0 + server.cubesql_pool_check_idle / 2)
+    await server._check_cubesql_connection(conn)
+    assert conn.queries == []
+    monkeypatch.setattr("main.time.monotonic", lambda: 1000.0 + server.cubesql_pool_check_idle)
+    await server._check_cubesql_connection(conn)
+    assert conn.queries == [("SELECT 1", server.cubesql_timeout)]
+    assert server.cubesql_pool_stats()["health_checks"] == 1
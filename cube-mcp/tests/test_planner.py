@@ -0,0 +1,120 @@
+import pytest
+
+from planner import Unsupported, has_order_by, plan_sql
+from schema import SchemaIndex
+
+META = {"cubes": [{
+    "name": "Passenger",
+    "measures": [
+        {"name": "Passenger.count", "type": "number", "aggType": "count"},
+        {"name": "Passenger.survivedCount", "type": "number", "aggType": "sum"},
+    ],
+    "dimensions": [
+        {"name": "Passenger.sex", "type": "string"},
+        {"name": "Passenger.name", "type": "string"},
+        {"name": "Passenger.pclass", "type": "number"},
+        {"name": "Passenger.boarded", "type": "time"},
+    ],
+    "segments": [],
+}]}
+
+
+@pytest.fixture(scope="module")
+def schema():
+    return SchemaIndex(META)
+
+
+def test_select_group_order_limit(schema):
+    plan = plan_sql("SELECT sex, MEASURE(count) AS n FROM Passenger GROUP BY 1 ORDER BY n DESC LIMIT 5", schema)
+    assert plan.query == {
+        "dimensions": ["Passenger.sex"],
+        "measures": ["Passenger.count"],
+        "order": [["Passenger.count", "desc"]],
+        "limit": 5,
+    }
+    assert plan.columns == ["sex", "n"]
+
+
+@pytest.mark.parametrize("where, filters", [
+    ("sex = 'male'", [{"member": "Passenger.sex", "operator": "equals", "values": ["male"]}]),
+    ("pclass IN (1, 2)", [{"member": "Passenger.pclass", "operator": "equals", "values": ["1", "2"]}]),
+    ("pclass >= 2", [{"member": "Passenger.pclass", "operator": "gte", "values": ["2"]}]),
+    ("sex IS NULL", [{"member": "Passenger.sex", "operator": "notSet"}]),
+    ("sex IS NOT NULL", [{"member": "Passenger.sex", "operator": "set"}]),
+    ("name ILIKE '%john%'", [{"member": "Passenger.name", "operator": "contains", "values": ["john"]}]),
+    # Negations exclude NULLs in SQL but not in Cube, hence the extra set filter.
+    ("sex <> 'male'", [{"member": "Passenger.sex", "operator": "notEquals", "values": ["male"]},
+                       {"member": "Passenger.sex", "operator": "set"}]),
+    ("sex != 'male'", [{"member": "Passenger.sex", "operator": "notEquals", "values": ["male"]},
+                       {"member": "Passenger.sex", "operator": "set"}]),
+    ("pclass NOT IN (1, 2)", [{"member": "Passenger.pclass", "operator": "notEquals", "values": ["1", "2"]},
+                              {"member": "Passenger.pclass", "operator": "set"}]),
+    ("name NOT ILIKE '%john%'", [{"member": "Passenger.name", "operator": "notContains", "values": ["john"]},
+                                 {"member": "Passenger.name", "operator": "set"}]),
+])
+def test_where(schema, where, filters):
+    plan = plan_sql(f"SELECT sex, MEASURE(count) AS n FROM Passenger WHERE {where} GROUP BY 1", schema)
+    assert plan.query["filters"] == filters
+
+
+@pytest.mark.parametrize("sql", [
+    # Case-sensitive, unlike Cube's contains.
+    "SELECT sex, MEASURE(count) AS n FROM Passenger WHERE name LIKE '%John%' GROUP BY 1",
+    "SELECT sex, MEASURE(count) AS n FROM Passenger WHERE name NOT LIKE '%John%' GROUP BY 1",
+    "SELECT sex, MEASURE(count) AS n FROM Passenger WHERE name ILIKE 'John%' GROUP BY 1",
+    "SELECT sex, MEASURE(count) AS n FROM Passenger WHERE sex = 'male' OR pclass = 1 GROUP BY 1",
+    "SELECT sex, MEASURE(count) AS n FROM Passenger WHERE sex > 'a' GROUP BY 1",
+    "SELECT boarded, MEASURE(count) AS n FROM Passenger GROUP BY 1",
+    # CubeSQL names unaliased aggregates itself.
+    "SELECT sex, MEASURE(count), MEASURE(survivedCount) FROM Passenger GROUP BY 1",
+    "SELECT sex, COUNT(*) FROM Passenger GROUP BY 1",
+    # Output names must not repeat.
+    "SELECT sex, MEASURE(count) AS n, MEASURE(survivedCount) AS n FROM Passenger GROUP BY 1",
+    "SELECT sex, name AS sex, MEASURE(count) AS n FROM Passenger GROUP BY 1, 2",
+    "SELECT * FROM Passenger",
+    "SELECT sex, count FROM Passenger GROUP BY 1",
+])
+def test_unsupported(schema, sql):
+    with pytest.raises(Unsupported):
+        plan_sql(sql, schema)
+
+
+def test_rows_convert_numbers(schema):
+    plan = plan_sql("SELECT pclass, MEASURE(count) AS n FROM Passenger GROUP BY 1", schema)
+    assert plan.rows([{"Passenger.pclass": "1", "Passenger.count": "10"}]) == [[1, 10]]
+
+
+def test_output_names(schema):
+    plan = plan_sql('SELECT p.sex, "Pclass", MEASURE(count) AS "Total" FROM Passenger p GROUP BY 1, 2', schema)
+    assert plan.columns == ["sex", "Pclass", "Total"]
+
+
+def test_group_by_prefers_input_columns(schema):
+    # "sex" is an input column and the output name of name; GROUP BY means the input column.
+    sql = "SELECT name AS sex, MEASURE(count) AS n FROM Passenger GROUP BY sex"
+    with pytest.raises(Unsupported, match="GROUP BY"):
+        plan_sql(sql, schema)
+    # An output name that is not an input column still resolves.
+    plan = plan_sql("SELECT name AS who, MEASURE(count) AS n FROM Passenger GROUP BY who", schema)
+    assert plan.query["dimensions"] == ["Passenger.name"]
+
+
+def test_order_by_prefers_output_names(schema):
+    plan = plan_sql("SELECT sex, name AS pclass, pclass AS x, MEASURE(count) AS n FROM Passenger "
+                    "GROUP BY 1, 2, 3 ORDER BY pclass", schema)
+    assert plan.query["order"] == [["Passenger.name", "asc"]]
+
+
+@pytest.mark.parametrize("sql, expected", [
+    ("SELECT name FROM Passenger ORDER BY name", True),
+    ("select name from Passenger order\n  by name limit 10;", True),
+    ("SELECT name FROM (SELECT name FROM Passenger ORDER BY name) t ORDER BY 1", True),
+    ("SELECT name FROM Passenger", False),
+    ("SELECT name FROM (SELECT name FROM Passenger ORDER BY name) t", False),
+    ("SELECT name, ROW_NUMBER() OVER (ORDER BY fare) FROM Passenger", False),
+    ("SELECT 'order by' AS x FROM Passenger", False),
+    ('SELECT "order" FROM Passenger -- ORDER BY name', False),
+    ("SELECT name FROM Passenger /* ORDER BY name */", False),
+])
+def test_has_order_by(sql, expected):
+    assert has_order_by(sql) is expected
@@ -0,0 +1,117 @@
+import decimal
+
+import json
+
+from reduce import OTHER_LABEL, ReducingEncoder, downsample, fit_rows, member_roles
+from schema import SchemaIndex
+
+META = {"cubes": [{
+    "name": "Passenger",
+    "measures": [
+        {"name": "Passenger.count", "type": "number", "aggType": "count"},
+        {"name": "Passenger.avgFare", "type": "number", "aggType": "avg"},
+    ],
+    "dimensions": [
+        {"name": "Passenger.name", "type": "string"},
+        {"name": "Passenger.pclass", "type": "number"},
+        {"name": "Passenger.boarded", "type": "time"},
+    ],
+    "segments": [],
+}]}
+
+
+def roles(columns):
+    index = SchemaIndex(META)
+    return member_roles([index.column_member(column) for column in columns])
+
+
+def test_member_roles():
+    columns = ["Passenger.boarded.day", "Passenger.pclass", "Passenger.count", "Passenger.avgFare", "extra"]
+    assert roles(columns) == ["time", "dimension", "additive", "measure", None]
+
+
+def test_other_row_sums_only_additive_measures():
+    columns = ["Passenger.name", "Passenger.pclass", "Passenger.count", "Passenger.avgFare"]
+    rows = [(f"p{i}", i % 3 + 1, i, 10.0 + i) for i in range(10)]
+    reduced, method = downsample(columns, rows, 4, roles(columns))
+    assert method == "top_n"
+    assert [row[0] for row in reduced[:3]] == ["p9", "p8", "p7"]
+    # The rest: counts 0..6 add up; pclass and the average do not.
+    assert reduced[3] == (OTHER_LABEL, None, sum(range(7)), None)
+
+
+def test_schema_picks_the_measure_over_a_numeric_dimension():
+    columns = ["Passenger.name", "Passenger.pclass", "Passenger.avgFare"]
+    rows = [(f"p{i}", 3 - i % 3, float(i)) for i in range(10)]
+    reduced, _ = downsample(columns, rows, 3, roles(columns))
+    # Ranked by the average fare, not pclass; no additive measure, so no "Other" row.
+    assert [row[0] for row in reduced] == ["p9", "p8", "p7"]
+
+
+def test_schema_time_axis_need_not_be_first():
+    columns = ["Passenger.count", "Passenger.boarded.day"]
+    rows = [(i % 7, f"2024-01-{i + 1:02d}T00:00:00.000") for i in range(30)]
+    reduced, method = downsample(columns, rows, 10, roles(columns))
+    assert method == "lttb"
+    assert len(reduced) == 10 and reduced[0] == rows[0] and reduced[-1] == rows[-1]
+
+
+def test_without_schema_no_other_row_is_made_up():
+    columns = ["name", "pclass"]
+    rows = [(f"p{i}", i) for i in range(10)]
+    reduced, method = downsample(columns, rows, 4)
+    assert method == "top_n"
+    assert reduced == [rows[9], rows[8], rows[7], rows[6]]
+
+
+def test_fit_rows_passes_roles():
+    columns = ["Passenger.name", "Passenger.count"]
+    rows = [(f"p{i}", i) for i in range(10)]
+    assert fit_rows(columns, rows, 100, 20, 0) is None
+    reduced, extra = fit_rows(columns, rows, 100, 3, 0, roles=roles(columns))
+    assert reduced[-1] == (OTHER_LABEL, sum(range(8)))
+    assert extra["reduced"] == {"method": "top_n", "fromRows": 10, "toRows": 3, "complete": True}
+    assert extra["summary"]["Passenger.count"]["max"] == 9
+
+
+def test_non_finite_decimals_are_not_numbers():
+    rows = [(decimal.Decimal(v),) for v in ("1", "NaN", "sNaN", "Infinity", "3")]
+    assert fit_rows(["x"], rows, 1000, 2, 0)[1]["summary"]["x"] == {"count": 2, "min": 1.0, "max": 3.0, "mean": 2.0}
+
+
+def test_without_schema_numeric_x_is_not_a_time_axis():
+    columns = ["pclass", "fare"]
+    rows = [(i, float(i % 7)) for i in range(30)]
+    reduced, method = downsample(columns, rows, 10)
+    assert method == "even"
+    assert len(reduced) == 10
+    time_rows = [(f"2024-01-{i + 1:02d}T00:00:00.000", float(i % 7)) for i in range(30)]
+    assert downsample(columns, time_rows, 10)[1] == "lttb"
+
+
+def test_reducing_encoder_reports_sizes_past_the_budget():
+    encoder = ReducingEncoder(["a", "b"], "json", 0, 200)
+    sizes = [encoder.add_row((i, f"value {i}")) for i in range(50)]
+    assert all(size > 0 for size in sizes)
+    # The caller stops reading once the reported sizes pass the byte budget.
+    assert sum(sizes) > 200
+
+
+def test_reducing_encoder_keeps_a_bounded_sample():
+    encoder = ReducingEncoder(["a", "b"], "json", 10, 0, reservoir=40)
+    for i in range(1000):
+        encoder.add_row((f"2024-01-01T00:{i // 60:02d}:{i % 60:02d}.000", i))
+    assert len(encoder._rows) == 40
+    result = json.loads(encoder.finish())
+    assert len(result["data"]) == 10
+    # Sampled rows stay in arrival order.
+    assert [row["b"] for row in result["data"]] == sorted(row["b"] for row in result["data"])
+    assert result["reduced"]["fromRows"] == 1000 and result["reduced"]["complete"] is False
+    assert result["summary"]["b"] == {"count": 1000, "min": 0.0, "max": 999.0, "mean": 499.5}
+
+
+def test_reducing_encoder_under_the_reservoir_is_complete():
+    encoder = ReducingEncoder(["a", "b"], "json", 10, 0, reservoir=40)
+    encoder.add_rows([(f"p{i}", i) for i in range(30)])
+    result = json.loads(encoder.finish())
+    assert result["reduced"]["complete"] is True and result["reduced"]["method"] == "top_n"
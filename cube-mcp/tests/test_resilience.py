@@ -0,0 +1,85 @@
+import asyncio
+
+import httpx
+import pytest
+
+from resilience import TIMEOUT, CircuitOpen, UpstreamPolicy, classify_cubesql, classify_http
+
+
+def _policy(classify, **kwargs):
+    events = []
+    policy = UpstreamPolicy("test", classify, backoff=0, failure_threshold=2,
+                            on_event=lambda event, reason: events.append((event, reason)), **kwargs)
+    return policy, events
+
+
+def test_classify_cubesql_timeouts_before_os_errors():
+    assert issubclass(TimeoutError, OSError)
+    assert classify_cubesql(asyncio.TimeoutError()) == (TIMEOUT, False)
+    assert classify_cubesql(TimeoutError()) == (TIMEOUT, False)
+    assert classify_cubesql(ConnectionRefusedError()) == ("connection", True)
+    assert classify_cubesql(ValueError()) == (None, False)
+
+
+def test_classify_http():
+    request = httpx.Request("POST", "http://cube/v1/load")
+    status = lambda code: httpx.HTTPStatusError("", request=request, response=httpx.Response(code))
+    assert classify_http(status(503)) == ("http_503", True)
+    assert classify_http(status(400)) == (None, False)
+    assert classify_http(httpx.ConnectTimeout("")) == ("connect_timeout", True)
+    assert classify_http(httpx.ReadTimeout("")) == ("read_timeout", False)
+    assert classify_http(httpx.ConnectError("")) == ("connection", True)
+
+
+@pytest.mark.asyncio
+async def test_cubesql_timeouts_are_not_retried_or_counted():
+    policy, events = _policy(classify_cubesql, retries=2)
+    runs = 0
+
+    async def slow():
+        nonlocal runs
+        runs += 1
+        raise asyncio.TimeoutError()
+
+    for _ in range(3):
+        with pytest.raises(asyncio.TimeoutError):
+            await policy.call(slow)
+    assert runs == 3
+    assert policy.breaker.state == "closed"
+    assert policy.breaker.failures == 0
+    assert policy.stats["timeouts"] == 3
+    assert events == [("timeout", TIMEOUT)] * 3
+
+
+@pytest.mark.asyncio
+async def test_connection_errors_retry_then_open_breaker():
+    policy, events = _policy(classify_cubesql, retries=1)
+    runs = 0
+
+    async def refused():
+        nonlocal runs
+        runs += 1
+        raise ConnectionRefusedError()
+
+    with pytest.raises(ConnectionRefusedError):
+        await policy.call(refused)
+    # One retry, and the second failure reaches the threshold.
+    assert runs == 2
+    assert policy.breaker.state == "open"
+    with pytest.raises(CircuitOpen):
+        await policy.call(refused)
+    assert runs == 2
+    assert ("trip", "connection") in events and ("rejected", "") in events
+
+
+@pytest.mark.asyncio
+async def test_bad_query_does_not_count_against_breaker():
+    policy, _ = _policy(classify_cubesql)
+
+    async def bad():
+        raise ValueError("syntax error")
+
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            await policy.call(bad)
+    assert policy.breaker.state == "closed"
@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+
+from scheduler import Overloaded, Scheduler
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_free_slots_go_to_sessions_round_robin():
+    scheduler = Scheduler(max_concurrency=1)
+    order = []
+    gate = asyncio.Event()
+
+    async def call(session, n):
+        async with scheduler.slot(session, "rest"):
+            order.append((session, n))
+            await gate.wait()
+
+    first = asyncio.create_task(call("busy", 0))
+    await settle()
+    # One session queues three calls before another queues one.
+    tasks = [asyncio.create_task(call("busy", n)) for n in (1, 2, 3)]
+    await settle()
+    tasks.append(asyncio.create_task(call("quiet", 1)))
+    await settle()
+    assert scheduler.snapshot()["waiting"] == 4 and scheduler.snapshot()["sessions_waiting"] == 2
+    gate.set()
+    await asyncio.gather(first, *tasks)
+    # The quiet session does not wait behind the whole busy queue.
+    assert order == [("busy", 0), ("busy", 1), ("quiet", 1), ("busy", 2), ("busy", 3)]
+    assert scheduler.stats["admitted"] == 5 and scheduler.stats["queued"] == 4
+
+
+@pytest.mark.asyncio
+async def test_upstream_limits_let_other_upstreams_through():
+    scheduler = Scheduler(upstream_limits={"cubesql": 1})
+    gate = asyncio.Event()
+    admitted = []
+
+    async def call(session, upstream):
+        async with scheduler.slot(session, upstream):
+            admitted.append(upstream)
+            await gate.wait()
+
+    tasks = [asyncio.create_task(call("a", "cubesql")), asyncio.create_task(call("a", "cubesql")),
+             asyncio.create_task(call("b", "rest"))]
+    await settle()
+    # The second CubeSQL call waits; the REST call behind it does not.
+    assert admitted == ["cubesql", "rest"]
+    gate.set()
+    await asyncio.gather(*tasks)
+    assert admitted == ["cubesql", "rest", "cubesql"]
+    assert scheduler.snapshot()["active"] == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiters_leave_the_queue():
+    scheduler = Scheduler(max_concurrency=1)
+    gate = asyncio.Event()
+    admitted = []
+
+    async def call(session):
+        async with scheduler.slot(session, "rest"):
+            admitted.append(session)
+            await gate.wait()
+
+    holder = asyncio.create_task(call("a"))
+    await settle()
+    cancelled = asyncio.create_task(call("b"))
+    waiting = asyncio.create_task(call("c"))
+    await settle()
+    cancelled.cancel()
+    await settle()
+    assert cancelled.cancelled()
+    assert scheduler.snapshot()["waiting"] == 1 and scheduler.stats["cancelled"] == 1
+    gate.set()
+    await asyncio.gather(holder, waiting)
+    assert admitted == ["a", "c"]
+    snapshot = scheduler.snapshot()
+    assert snapshot["active"] == 0 and snapshot["waiting"] == 0 and snapshot["sessions_waiting"] == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_holder_releases_its_slot():
+    scheduler = Scheduler(max_concurrency=1)
+    holding = asyncio.Event()
+
+    async def hold():
+        async with scheduler.slot("a", "rest"):
+            holding.set()
+            await asyncio.Event().wait()
+
+    holder = asyncio.create_task(hold())
+    await holding.wait()
+    holder.cancel()
+    await settle()
+    async with scheduler.slot("b", "rest"):
+        assert scheduler.snapshot()["active"] == 1
+    assert scheduler.snapshot()["active"] == 0
+
+
+@pytest.mark.asyncio
+async def test_full_queue_and_queue_timeout_raise_overloaded():
+    scheduler = Scheduler(max_concurrency=1, max_queue=1, queue_timeout=0.05)
+    gate = asyncio.Event()
+
+    async def call(session):
+        async with scheduler.slot(session, "rest"):
+            await gate.wait()
+
+    holder = asyncio.create_task(call("a"))
+    await settle()
+    queued = asyncio.create_task(call("b"))
+    await settle()
+    with pytest.raises(Overloaded, match="already queued"):
+        await call("c")
+    with pytest.raises(Overloaded, match="Timed out"):
+        await queued
+    assert scheduler.stats["rejected"] == 1 and scheduler.stats["timed_out"] == 1
+    assert scheduler.snapshot()["waiting"] == 0
+    gate.set()
+    await holder
@@ -0,0 +1,94 @@
+import pytest
+
+from schema import SchemaIndex
+
+META = {"cubes": [
+    {
+        "name": "Orders",
+        "title": "Orders",
+        "measures": [
+            {"name": "Orders.count", "title": "Orders Count"},
+            {"name": "Orders.totalAmount", "title": "Orders Total Amount", "description": "Sum of order value"},
+            {"name": "Orders.amountRefunded", "title": "Orders Amount Refunded"},
+        ],
+        "dimensions": [
+            {"name": "Orders.status", "title": "Orders Status"},
+            {"name": "Orders.createdAt", "title": "Orders Created At", "type": "time"},
+            {"name": "Orders.customerId", "title": "Orders Customer Id"},
+        ],
+        "segments": [{"name": "Orders.completed", "title": "Orders Completed"}],
+    },
+    {
+        "name": "Customers",
+        "title": "Customers",
+        "measures": [{"name": "Customers.count", "title": "Customers Count"}],
+        "dimensions": [
+            {"name": "Customers.status", "title": "Customers Status"},
+            {"name": "Customers.city", "title": "Customers City"},
+        ],
+        "segments": [],
+    },
+]}
+
+
+@pytest.fixture
+def index():
+    return SchemaIndex(META)
+
+
+def names(members):
+    return [member["name"] for member in members]
+
+
+def test_search_ranks_exact_then_prefix_then_substring(index):
+    # "amount": a prefix of amountRefunded, in the title of totalAmount, and
+    # only similar to "count" (shares "oun", "unt", "nt ").
+    assert names(index.search("amount")) == ["Orders.amountRefunded", "Orders.totalAmount",
+                                             "Customers.count", "Orders.count"]
+    assert names(index.search("Orders.count"))[0] == "Orders.count"
+    assert names(index.search("count")) == ["Customers.count", "Orders.count"]
+    assert names(index.search("order value")) == ["Orders.totalAmount"]
+
+
+def test_search_falls_back_to_trigram_similarity(index):
+    # Misspelt: no name contains it, the trigrams still match, closest first.
+    assert names(index.search("custmerid")) == ["Orders.customerId"]
+    assert names(index.search("staus"))[:2] == ["Customers.status", "Orders.status"]
+    assert index.search("zzzz") == []
+
+
+def test_search_filters_by_kind_and_cube(index):
+    assert names(index.search("status", cube="customers")) == ["Customers.status"]
+    assert names(index.search("count", kinds=("dimension",))) == []
+    assert names(index.search(kinds=("segment",))) == ["Orders.completed"]
+    assert len(index.search(limit=3)) == 3
+
+
+def test_suggestions_stay_in_the_named_cube(index):
+    assert index.suggest("Orders.stats") == ["Orders.status"]
+    assert index.suggest("Orders.crea") == ["Orders.createdAt"]
+    assert index.suggest("Customers.counts", kinds=("measure",)) == ["Customers.count"]
+
+
+def test_validate_query_suggests_members(index):
+    with pytest.raises(ValueError) as err:
+        index.validate_query({
+            "measures": ["Orders.countt", "Orders.status"],
+            "filters": [{"or": [{"member": "Orders.staus", "operator": "set", "values": []}]}],
+        })
+    message = str(err.value)
+    assert "Unknown measure Orders.countt (in measures). Did you mean: Orders.count?" in message
+    assert "Orders.status is a dimension, not a measure (in measures)" in message
+    assert "Did you mean: Orders.status?" in message
+    index.validate_query({"measures": ["Orders.count"], "timeDimensions": [{"dimension": "Orders.createdAt"}]})
+
+
+def test_column_member(index):
+    assert index.column_member("Orders.createdAt.day")["kind"] == "dimension"
+    assert index.column_member("Orders.nope") is None
+
+
+def test_describe_groups_by_cube(index):
+    described = index.describe(index.search("status"))
+    assert [cube["name"] for cube in described["cubes"]] == ["Customers", "Orders"]
+    assert described["cubes"][0]["dimensions"] == [{"name": "Customers.status", "title": "Customers Status"}]
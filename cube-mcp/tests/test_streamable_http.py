@@ -0,0 +1,128 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from mcp import types
+from mcp.server import Server
+from starlette.applications import Starlette
+from starlette.routing import Route
+
+from streamable_http import DEFAULT_PROTOCOL_VERSION, StatelessHTTPTransport
+
+
+@pytest.fixture
+def transport():
+    server = Server("test")
+
+    @server.list_tools()
+    async def list_tools():
+        return [types.Tool(name="whoami", description="", inputSchema={"type": "object"})]
+
+    @server.call_tool()
+    async def call_tool(name, arguments):
+        if name == "sleep":
+            await asyncio.sleep(arguments["seconds"])
+        return [types.TextContent(type="text", text=server.request_context.session.key)]
+
+    initialized = []
+    transport = StatelessHTTPTransport(server, server.create_initialization_options(),
+                                       on_initialize=lambda: initialized.append(True))
+    transport.initialized = initialized
+    return transport
+
+
+def client_for(transport):
+    app = Starlette(routes=[Route("/mcp", endpoint=transport.handle_request, methods=["GET", "POST", "DELETE"])])
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+def request(request_id, method, params=None):
+    return {"jsonrpc": "2.0", "id": request_id, "method": method, **({"params": params} if params else {})}
+
+
+def call(request_id, name, **arguments):
+    return request(request_id, "tools/call", {"name": name, "arguments": arguments})
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("requested, expected", [
+    ("2025-06-18", "2025-06-18"),
+    ("2024-11-05", "2024-11-05"),
+    ("1999-01-01", DEFAULT_PROTOCOL_VERSION),
+])
+async def test_initialize_negotiates_a_version(transport, requested, expected):
+    async with client_for(transport) as client:
+        response = await client.post("/mcp", json=request(1, "initialize", {"protocolVersion": requested}))
+    result = response.json()["result"]
+    assert result["protocolVersion"] == expected and result["serverInfo"]["name"] == "test"
+    assert transport.initialized == [True]
+
+
+@pytest.mark.asyncio
+async def test_calls_are_keyed_by_session_header(transport):
+    async with client_for(transport) as client:
+        response = await client.post("/mcp", json=call(1, "whoami"), headers={"Mcp-Session-Id": "s-1"})
+        assert response.json()["result"]["content"][0]["text"] == "s-1"
+        response = await client.post("/mcp", json=call(2, "whoami"))
+        assert response.json()["result"]["content"][0]["text"] == "127.0.0.1"
+
+
+@pytest.mark.asyncio
+async def test_notifications_are_accepted_without_a_reply(transport):
+    async with client_for(transport) as client:
+        response = await client.post("/mcp", json={"jsonrpc": "2.0", "method": "notifications/initialized"})
+        assert response.status_code == 202 and response.content == b""
+        assert (await client.get("/mcp")).status_code == 405
+    assert transport.stats["notifications"] == 1
+
+
+@pytest.mark.asyncio
+async def test_errors(transport):
+    async with client_for(transport) as client:
+        response = await client.post("/mcp", content=b"{not json")
+        assert response.status_code == 400 and response.json()["error"]["code"] == types.PARSE_ERROR
+        response = await client.post("/mcp", json=request(1, "no/such/method"))
+        assert response.json() == {"jsonrpc": "2.0", "id": 1,
+                                   "error": {"code": types.METHOD_NOT_FOUND, "message": "Method not found"}}
+        response = await client.post("/mcp", json=request(2, "tools/call", {"arguments": {}}))
+        assert response.json()["error"]["code"] == types.INVALID_PARAMS
+        response = await client.post("/mcp", json={"id": 3, "method": "ping"})
+        assert response.json()["error"]["code"] == types.INVALID_REQUEST
+
+
+@pytest.mark.asyncio
+async def test_batch_runs_requests_and_keeps_invalid_items_apart(transport):
+    batch = [call(1, "whoami"), "junk", request(2, "ping"), {"jsonrpc": "2.0", "method": "notifications/x"}]
+    async with client_for(transport) as client:
+        response = await client.post("/mcp", json=batch)
+    responses = response.json()
+    assert responses[0] == {"jsonrpc": "2.0", "id": None,
+                            "error": {"code": types.INVALID_REQUEST, "message": "Invalid request"}}
+    assert [r["id"] for r in responses[1:]] == [1, 2]
+    assert transport.stats["batches"] == 1 and transport.stats["requests"] == 2
+
+
+@pytest.mark.asyncio
+async def test_batch_streams_responses_as_they_finish(transport):
+    batch = [call(1, "sleep", seconds=0.05), call(2, "sleep", seconds=0)]
+    async with client_for(transport) as client:
+        response = await client.post("/mcp", json=batch, headers={"Accept": "application/json, text/event-stream"})
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [json.loads(line[len("data: "):]) for line in response.text.splitlines() if line.startswith("data: ")]
+    assert [event["id"] for event in events] == [2, 1]
+
+
+@pytest.mark.asyncio
+async def test_batches_are_refused_under_2025_06_18(transport):
+    batch = [request(1, "ping"), request(2, "ping")]
+    async with client_for(transport) as client:
+        response = await client.post("/mcp", json=batch, headers={"MCP-Protocol-Version": "2025-06-18"})
+        assert response.status_code == 400
+        assert response.json()["error"]["code"] == types.INVALID_REQUEST
+        # A single request is fine under that version, and batches under the earlier ones.
+        response = await client.post("/mcp", json=request(3, "ping"), headers={"MCP-Protocol-Version": "2025-06-18"})
+        assert response.json()["result"] == {}
+        response = await client.post("/mcp", json=batch, headers={"MCP-Protocol-Version": "2025-03-26"})
+        assert [r["id"] for r in response.json()] == [1, 2]
+    assert transport.stats["requests"] == 3